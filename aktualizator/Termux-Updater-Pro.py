@@ -13,25 +13,73 @@ Výstupy:
   - Aktualizator_seznam.json        : čistý inventář
   - Aktualizator_issue.json         : všechny varování/chyby
   - Aktualizator_repair_log.json    : log z opravného běhu
+  - Aktualizator_plan.json         : plán upgradu (--plan, provede ho --apply-plan)
 
 JSON se ukládají do:
   ~/storage/downloads/  pokud existuje,
   jinak ~/Downloads/
+S --compress gz|xz jako *.json.gz / *.json.xz (načítání pozná formát samo).
 """
 
 from __future__ import annotations
 
-import argparse
-import json
+import importlib.util
 import logging
 import os
 import shutil
-import subprocess
 import sys
+import time
 import fcntl
+import functools
 import re
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
 from datetime import datetime, timezone
-from typing import Any, Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+if TYPE_CHECKING:
+    import weakref
+    from array import array
+
+
+def _lazy_import(name: str) -> Any:
+    """
+    Modul, který se skutečně načte až při prvním přístupu k atributu
+    (importlib.util.LazyLoader). Na Pythonu < 3.12 LazyLoader není
+    thread-safe, proto jen pro moduly, na které poprvé sáhne hlavní vlákno.
+
+    Méně používané moduly (urllib.request, urllib.parse, zipfile, hashlib,
+    socket, signal, resource, glob, fnmatch, array, weakref, ...) se
+    importují až ve funkcích, které je potřebují – --help, --repair-only
+    a dotaz na daemon je tak vůbec nenačítají. re a functools se importují
+    normálně: načítá je už logging. Regexy se kompilují až při prvním
+    použití (_regex).
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+asyncio = _lazy_import("asyncio")
+argparse = _lazy_import("argparse")
+json = _lazy_import("json")
+subprocess = _lazy_import("subprocess")
+
+_regexes: Dict[str, "re.Pattern[str]"] = {}
+
+
+def _regex(pattern: str) -> "re.Pattern[str]":
+    """Regex zkompilovaný až při prvním použití (import modulu nic nekompiluje)."""
+    rx = _regexes.get(pattern)
+    if rx is None:
+        rx = _regexes[pattern] = re.compile(pattern)
+    return rx
 
 # -------------------------------------------------------------
 # Základní cesty & logging
@@ -47,12 +95,84 @@ if not os.path.isdir(DEFAULT_DOWNLOADS):
 OUT_INVENTORY = os.path.join(DEFAULT_DOWNLOADS, "Aktualizator_seznam.json")
 OUT_ISSUES = os.path.join(DEFAULT_DOWNLOADS, "Aktualizator_issue.json")
 OUT_REPAIR_LOG = os.path.join(DEFAULT_DOWNLOADS, "Aktualizator_repair_log.json")
+OUT_DIFF = os.path.join(DEFAULT_DOWNLOADS, "Aktualizator_diff.json")
 
 LOCKFILE = os.path.join(HOME, ".aktualizator.lock")
+# Zámky jednotlivých prostředků (pkg databáze, venv, výstupy) – viz LockManager
+LOCK_DIR = os.path.join(os.path.dirname(LOCKFILE), ".aktualizator.locks")
+LOCK_WAIT_LOG = 5.0  # s; po jak dlouhém čekání vypsat, kdo zámek drží
+# Žurnál dokončených kroků pro --resume (vedle LOCKFILE)
+JOURNAL_FILE = os.path.join(os.path.dirname(LOCKFILE), ".aktualizator.journal")
+JOURNAL_MAX_AGE = 24 * 3600  # s; starší žurnál se nepoužije (zastaralé apt seznamy)
+
+# Perzistentní cache (inventář, ...)
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME", os.path.join(HOME, ".cache")), "termux-updater"
+)
+INVENTORY_CACHE = os.path.join(CACHE_DIR, "inventory.json")
+INVENTORY_CACHE_VERSION = 3
+INVENTORY_CACHE_MAX_ENTRIES = 256
+INVENTORY_CACHE_MAX_AGE = 7 * 24 * 3600  # s
+MIRROR_CACHE = os.path.join(CACHE_DIR, "mirrors.json")
+VENV_DISCOVERY_CACHE = os.path.join(CACHE_DIR, "venvs.json")
+DAEMON_SOCKET = os.path.join(CACHE_DIR, "daemon.sock")
+DAEMON_POLL = 30.0  # s; jak často daemon kontroluje dpkg status a venv
+MIRROR_ROLLBACK = os.path.join(CACHE_DIR, "mirror_rollback.json")
+
+# Sdílený wheelhouse pro všechny venv (pip install --find-links)
+WHEELHOUSE = os.path.join(CACHE_DIR, "wheels")
+WHEELHOUSE_MAX_MB = 2048
+WHEELHOUSE_MAX_AGE = 60 * 24 * 3600  # s
+PIP_CACHE = os.path.join(HOME, ".cache", "pip")
+
+# Historie inventářů pro diff mezi běhy
+HISTORY_FILE = os.path.join(CACHE_DIR, "history.json")
+HISTORY_VERSION = 1
+HISTORY_SIZE = 10
+
+# Offline databáze bezpečnostních upozornění (OSV JSON / zip dumpy) a její index
+ADVISORY_DIR = os.path.join(CACHE_DIR, "osv")
+ADVISORY_INDEX = os.path.join(CACHE_DIR, "advisories.idx")
+ADVISORY_INDEX_VERSION = 1
+# OSV ekosystém pro zdroje inventáře ("Termux" dumpy si správce dodává sám)
+ADVISORY_ECOSYSTEMS = {"pkg": "Termux", "system_pip": "PyPI", "venv": "PyPI"}
+
+# Plán upgradu (--plan / --apply-plan) a odhad jeho doby z minulých běhů
+OUT_PLAN = os.path.join(DEFAULT_DOWNLOADS, "Aktualizator_plan.json")
+PLAN_VERSION = 1
+UPGRADE_STATS = os.path.join(CACHE_DIR, "upgrade_stats.json")
+UPGRADE_STATS_VERSION = 1
+UPGRADE_STATS_ALPHA = 0.3  # váha nového měření v klouzavém průměru
+# Výchozí odhady, dokud nejsou naměřené hodnoty
+UPGRADE_STATS_DEFAULT: Dict[str, float] = {
+    "apt_package": 4.0,  # s na jeden instalovaný .deb
+    "pip_package": 3.0,  # s na jeden balíček z wheelu
+    "pip_build": 90.0,  # s na jeden balíček sestavovaný ze sdist
+    "bytes_per_second": 1e6,  # stahování
+}
+
+# Plánovač (subpříkaz schedule): fronta kroků čekajících na vhodné podmínky
+SCHEDULE_QUEUE = os.path.join(CACHE_DIR, "schedule.json")
+SCHEDULE_VERSION = 1
+SCHEDULE_MAX_ATTEMPTS = 3  # po tolika neúspěších se krok z fronty vyřadí
+SCHEDULE_INTERVAL = 15 * 60  # s; --loop: jak často znovu zkoušet odložené kroky
+SCHEDULE_PROBE_TIMEOUT = 10.0  # s; termux-api bez aplikace Termux:API visí
+# Fáze upgradu, které jde zařadit (--phases); každá odpovídá části režimu D
+SCHEDULE_PHASES = ("pkg", "system-pip", "venvs")
+# Podmínky pro druh kroku. min_battery platí jen mimo nabíječku,
+# network: "any" = jakékoli připojení, "unmetered" = wifi / ethernet,
+# max_load = loadavg(1 min) na jedno CPU. Neznámá hodnota (sonda selhala) nebrání.
+SCHEDULE_POLICY: Dict[str, Dict[str, Any]] = {
+    "pkg.update": {"min_battery": 15, "network": "any"},
+    "pkg.upgrade": {"min_battery": 30, "network": "unmetered"},
+    "pip_upgrade": {"charging": True, "network": "unmetered", "max_load": 0.75},
+}
 
 # Termux PREFIX (umístění apt konfigurace)
 PREFIX = os.environ.get("PREFIX", "/data/data/com.termux/files/usr")
 APT_DIR = os.path.join(PREFIX, "etc", "apt")
+DPKG_STATUS = os.path.join(PREFIX, "var", "lib", "dpkg", "status")
+APT_ARCHIVES = os.path.join(PREFIX, "var", "cache", "apt", "archives")
 APT_SOURCES = [
     os.path.join(APT_DIR, "sources.list"),
     os.path.join(APT_DIR, "sources.list.d", "game.list"),
@@ -62,10 +182,15 @@ APT_SOURCES = [
 
 LOG_FORMAT = "%(asctime)s %(levelname)s: %(message)s"
 logger = logging.getLogger("Aktualizator")
-_handler = logging.StreamHandler()
-_handler.setFormatter(logging.Formatter(LOG_FORMAT))
-logger.addHandler(_handler)
-logger.setLevel(logging.INFO)
+
+
+def setup_logging() -> None:
+    """Handler na stderr; volá se z main(), ne při importu modulu."""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
 
 # -------------------------------------------------------------
 # Helper funkce
@@ -76,224 +201,1801 @@ def timestamp_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 
-def run_cmd(
+# -------------------------------------------------------------
+# Měření času (timings / --profile-out)
+# -------------------------------------------------------------
+
+_timings: List[Dict[str, Any]] = []
+_timings_t0 = time.perf_counter()
+_timings_lanes: Dict[int, int] = {}
+
+
+def timings_reset() -> None:
+    """Začne nové měření (volá se na začátku běhu)."""
+    global _timings_t0
+    _timings.clear()
+    _timings_lanes.clear()
+    _timings_t0 = time.perf_counter()
+
+
+def _children_usage() -> Tuple[float, int]:
+    """(CPU čas všech ukončených potomků v s, jejich peak RSS v KiB)."""
+    import resource
+
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return ru.ru_utime + ru.ru_stime, ru.ru_maxrss
+
+
+def _timing_lane() -> int:
+    """Číslo "vlákna" pro trace: každá asyncio úloha má vlastní řádek."""
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:
+        task = None
+    key = id(task) if task is not None else 0
+    return _timings_lanes.setdefault(key, len(_timings_lanes))
+
+
+@contextmanager
+def timed(kind: str, name: str, **meta: Any) -> Iterator[Dict[str, Any]]:
+    """
+    Změří blok kódu a uloží záznam do timings.
+
+    Záznam: kind ('phase'|'cmd'), name, start (s od začátku běhu), wall,
+    cpu_self, cpu_children, peak_rss_kb + meta. Volající může do vráceného
+    dictu doplnit další údaje (rc, out_bytes, ...).
+
+    cpu_children je rozdíl RUSAGE_CHILDREN, tj. při souběžných příkazech
+    zahrnuje i potomky, kteří skončili během bloku; peak_rss_kb je maximum
+    RSS ze všech dosud ukončených potomků.
+    """
+    rec: Dict[str, Any] = {"kind": kind, "name": name}
+    rec.update(meta)
+    lane = _timing_lane()
+    cpu0 = time.process_time()
+    ch_cpu0, _ = _children_usage()
+    t0 = time.perf_counter()
+    try:
+        yield rec
+    finally:
+        t1 = time.perf_counter()
+        ch_cpu1, ch_rss = _children_usage()
+        rec.update({
+            "start": round(t0 - _timings_t0, 6),
+            "wall": round(t1 - t0, 6),
+            "cpu_self": round(time.process_time() - cpu0, 6),
+            "cpu_children": round(ch_cpu1 - ch_cpu0, 6),
+            "peak_rss_kb": ch_rss,
+            "lane": lane,
+        })
+        _timings.append(rec)
+
+
+def timings_report() -> Dict[str, Any]:
+    """Sekce `timings` pro inventární JSON."""
+    records = sorted(_timings, key=lambda r: r["start"])
+    return {
+        "total_wall": round(time.perf_counter() - _timings_t0, 6),
+        "phases": [r for r in records if r["kind"] == "phase"],
+        "commands": [r for r in records if r["kind"] == "cmd"],
+    }
+
+
+def write_profile(path: str) -> None:
+    """
+    Zapíše naměřené záznamy pro --profile-out.
+
+    *.jsonl -> jeden JSON záznam na řádek,
+    jinak   -> Chrome trace (chrome://tracing, Perfetto).
+    """
+    records = sorted(_timings, key=lambda r: r["start"])
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    except Exception:
+        pass
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for rec in records:
+                f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+        else:
+            events = []
+            for rec in records:
+                args = {k: v for k, v in rec.items() if k not in ("kind", "name", "start", "wall", "lane")}
+                events.append({
+                    "name": rec["name"],
+                    "cat": rec["kind"],
+                    "ph": "X",
+                    "ts": int(rec["start"] * 1e6),
+                    "dur": int(rec["wall"] * 1e6),
+                    "pid": os.getpid(),
+                    "tid": rec["lane"],
+                    "args": args,
+                })
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+    logger.info("Writing %s", path)
+
+
+# Timeouty příkazů v sekundách (None = bez limitu); --cmd-timeout je přepíše
+CMD_TIMEOUTS: Dict[str, Optional[float]] = {
+    "pkg": 3600.0,
+    "pip": 1800.0,
+}
+STDERR_RING_LINES = 200
+_READ_CHUNK = 64 * 1024
+
+_cmd_concurrency = os.cpu_count() or 1
+_cmd_semaphores: "Optional[weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]]" = None
+
+
+def set_cmd_concurrency(n: int) -> None:
+    """Nastaví max. počet souběžně běžících příkazů (platí pro nové event loopy)."""
+    global _cmd_concurrency, _cmd_semaphores
+    _cmd_concurrency = max(1, n)
+    _cmd_semaphores = None
+
+
+def _cmd_semaphore() -> asyncio.Semaphore:
+    global _cmd_semaphores
+    if _cmd_semaphores is None:
+        import weakref
+
+        _cmd_semaphores = weakref.WeakKeyDictionary()
+    loop = asyncio.get_running_loop()
+    sem = _cmd_semaphores.get(loop)
+    if sem is None:
+        sem = asyncio.Semaphore(_cmd_concurrency)
+        _cmd_semaphores[loop] = sem
+    return sem
+
+
+async def _pump_lines(
+    stream: asyncio.StreamReader,
+    name: str,
+    sink: Callable[[str], None],
+    on_line: Optional[Callable[[str, str], None]],
+) -> None:
+    """Čte stream po blocích a předává celé řádky (bez limitu délky řádku)."""
+    pending = b""
+    while True:
+        chunk = await stream.read(_READ_CHUNK)
+        if not chunk:
+            break
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for raw in lines:
+            line = raw.decode("utf-8", errors="replace") + "\n"
+            sink(line)
+            if on_line:
+                on_line(name, line)
+    if pending:
+        line = pending.decode("utf-8", errors="replace")
+        sink(line)
+        if on_line:
+            on_line(name, line)
+
+
+async def run_cmd_async(
     cmd: List[str],
     dry_run: bool = False,
-    capture: bool = True,
+    timeout: Optional[float] = None,
+    capture_stdout: bool = True,
+    on_line: Optional[Callable[[str, str], None]] = None,
+    stderr_lines: int = STDERR_RING_LINES,
 ) -> Tuple[int, str, str]:
     """
-    Spustí příkaz a vrátí (rc, stdout, stderr).
+    Asynchronně spustí příkaz a vrátí (rc, stdout, stderr).
+
+    - výstup se čte průběžně po řádcích; on_line(stream, line) dostane každý
+      řádek ("stdout"/"stderr") hned, jak přijde,
+    - stdout se drží celý jen při capture_stdout=True,
+    - ze stderr se drží jen posledních stderr_lines řádků (ring buffer),
+    - při překročení timeoutu se proces zabije a rc = 124,
+    - při zrušení (cancel) se proces zabije a CancelledError propadne dál,
+    - počet souběžných příkazů omezuje set_cmd_concurrency().
 
     Pokud je dry_run True, příkaz se nespustí a rc = -1.
     """
     if dry_run:
         return -1, "[dry-run] " + " ".join(cmd), ""
 
+    out_parts: List[str] = []
+    err_ring: deque = deque(maxlen=max(1, stderr_lines))
+    counts = {"stdout": 0, "stderr": 0}
+
+    def _count(stream: str, line: str) -> None:
+        counts[stream] += len(line)
+        if on_line:
+            on_line(stream, line)
+
+    async with _cmd_semaphore():
+        with timed("cmd", os.path.basename(cmd[0]) + " " + " ".join(cmd[1:3]), cmd=cmd) as rec:
+            rc, out, err = await _run_proc(cmd, timeout, capture_stdout, _count, out_parts, err_ring)
+            rec.update({"rc": rc, "out_bytes": counts["stdout"], "err_bytes": counts["stderr"]})
+    return rc, out, err
+
+
+async def _run_proc(
+    cmd: List[str],
+    timeout: Optional[float],
+    capture_stdout: bool,
+    on_line: Callable[[str, str], None],
+    out_parts: List[str],
+    err_ring: deque,
+) -> Tuple[int, str, str]:
+    """Vlastní spuštění procesu pro run_cmd_async (už uvnitř semaforu)."""
     try:
-        proc = subprocess.run(
-            cmd,
-            stdout=subprocess.PIPE if capture else None,
-            stderr=subprocess.PIPE if capture else None,
-            text=True,
-            check=False,
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
         )
-        return proc.returncode, proc.stdout or "", proc.stderr or ""
     except Exception as e:  # pragma: no cover (Termux-specific)
         return 255, "", str(e)
 
+    out_sink: Callable[[str], None] = out_parts.append if capture_stdout else (lambda _line: None)
+    work = asyncio.gather(
+        _pump_lines(proc.stdout, "stdout", out_sink, on_line),
+        _pump_lines(proc.stderr, "stderr", err_ring.append, on_line),
+        proc.wait(),
+    )
+    try:
+        await asyncio.wait_for(work, timeout)
+    except asyncio.TimeoutError:
+        _kill(proc)
+        await proc.wait()
+        err_ring.append(f"[timeout] command killed after {timeout:g}s\n")
+        return 124, "".join(out_parts), "".join(err_ring)
+    except asyncio.CancelledError:
+        _kill(proc)
+        await proc.wait()
+        raise
+
+    return proc.returncode, "".join(out_parts), "".join(err_ring)
+
+
+def _kill(proc: "asyncio.subprocess.Process") -> None:
+    try:
+        proc.kill()
+    except ProcessLookupError:
+        pass
+
+
+def run_cmd(
+    cmd: List[str],
+    dry_run: bool = False,
+    capture: bool = True,
+    timeout: Optional[float] = None,
+) -> Tuple[int, str, str]:
+    """
+    Synchronní obal nad run_cmd_async (pro místa mimo event loop).
+
+    Pokud je dry_run True, příkaz se nespustí a rc = -1.
+    """
+    if dry_run:
+        return -1, "[dry-run] " + " ".join(cmd), ""
+
+    if not capture:
+        try:
+            proc = subprocess.run(cmd, check=False, timeout=timeout)
+            return proc.returncode, "", ""
+        except subprocess.TimeoutExpired:
+            return 124, "", f"[timeout] command killed after {timeout:g}s"
+        except Exception as e:  # pragma: no cover (Termux-specific)
+            return 255, "", str(e)
+
+    return asyncio.run(run_cmd_async(cmd, timeout=timeout))
+
+
+# --compress: formát -> přípona výstupu
+COMPRESS_SUFFIXES = {"gz": ".gz", "xz": ".xz"}
+_GZIP_MAGIC = b"\x1f\x8b"
+_XZ_MAGIC = b"\xfd7zXZ\x00"
+
+
+def compressed_path(path: str, compress: Optional[str] = None) -> str:
+    """Cesta výstupu pro --compress (Aktualizator_seznam.json -> .json.gz / .json.xz)."""
+    return path + COMPRESS_SUFFIXES[compress] if compress else path
+
+
+def detect_compression(path: str) -> Optional[str]:
+    """"gz" / "xz" podle prvních bajtů souboru (ne podle přípony), jinak None."""
+    with open(path, "rb") as f:
+        magic = f.read(len(_XZ_MAGIC))
+    if magic.startswith(_GZIP_MAGIC):
+        return "gz"
+    if magic == _XZ_MAGIC:
+        return "xz"
+    return None
+
+
+def _compress_stream(raw: Any, compress: Optional[str]) -> Any:
+    """Zabalí otevřený binární soubor do gzip / xz kompresoru (raw se při close nezavře)."""
+    if compress == "gz":
+        import gzip
+
+        return gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6, mtime=0)
+    if compress == "xz":
+        import lzma
+
+        return lzma.LZMAFile(raw, "wb")
+    return raw
+
+
+def open_compressed(path: str, mode: str = "rb") -> Any:
+    """
+    Otevře soubor pro čtení s transparentní dekompresí gzip / xz
+    (detect_compression). mode "rb" nebo "rt" (UTF-8).
+    """
+    compress = detect_compression(path)
+    text = "t" in mode
+    if compress == "gz":
+        import gzip
+
+        return gzip.open(path, "rt" if text else "rb", encoding="utf-8" if text else None)
+    if compress == "xz":
+        import lzma
+
+        return lzma.open(path, "rt" if text else "rb", encoding="utf-8" if text else None)
+    return open(path, "r", encoding="utf-8") if text else open(path, "rb")
+
+
+def load_json(path: str) -> Any:
+    """
+    Načte JSON soubor – čistý i komprimovaný (.json.gz / .json.xz).
+    Useknutý nebo poškozený xz / gzip proud hlásí jako ValueError (stejně
+    jako poškozený JSON), chyby čtení jako OSError.
+    """
+    try:
+        with open_compressed(path, "rt") as f:
+            return json.load(f)
+    except EOFError as e:
+        raise ValueError(f"truncated compressed file {path}") from e
+    except OSError as e:
+        gzip = sys.modules.get("gzip")
+        if gzip is not None and isinstance(e, gzip.BadGzipFile):
+            raise ValueError(str(e)) from e
+        raise
+    except Exception as e:
+        lzma = sys.modules.get("lzma")
+        if lzma is not None and isinstance(e, lzma.LZMAError):
+            raise ValueError(str(e)) from e
+        raise
+
+
+def safe_write_json(path: str, data: Any, compress: Optional[str] = None) -> str:
+    """
+    Bezpečné (atomické) zapsání JSON souboru.
 
-def safe_write_json(path: str, data: Any) -> None:
-    """Bezpečné (atomické) zapsání JSON souboru."""
+    S compress ("gz" / "xz") se zapíše kompaktní JSON (bez odsazení)
+    komprimovaně do compressed_path(path). Vrací skutečnou cestu.
+    """
+    path = compressed_path(path, compress)
     try:
         os.makedirs(os.path.dirname(path), exist_ok=True)
     except Exception:
         pass
     tmp = path + ".tmp"
-    with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=2, ensure_ascii=False)
+    if compress:
+        with open(tmp, "wb") as raw:
+            with _compress_stream(raw, compress) as f:
+                f.write(json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+    else:
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
     os.replace(tmp, path)
     logger.info("Writing %s", path)
+    return path
 
 
-def file_lock(fd) -> bool:
-    """Exkluzivní zámek na file descriptoru."""
-    try:
-        fcntl.flock(fd, fcntl.LOCK_EX)
-        return True
-    except Exception as e:
-        logger.error("Unable to acquire lock: %s", e)
-        return False
+def remove_other_variants(path: str, keep: str) -> None:
+    """Smaže zastaralé varianty výstupu path (čistý / .gz / .xz) kromě keep."""
+    for variant in [path] + [path + suffix for suffix in COMPRESS_SUFFIXES.values()]:
+        if variant != keep and os.path.exists(variant):
+            try:
+                os.remove(variant)
+                logger.debug("Removed stale %s", variant)
+            except OSError:
+                pass
+
 
 # -------------------------------------------------------------
-# Detekce prostředí
+# JSON-lines výstup (--format jsonl)
 # -------------------------------------------------------------
 
-def detect_package_manager() -> str:
-    """Preferuje Termux 'pkg', fallback na apt/apk/pacman."""
-    for cmd in ("pkg", "apt", "apk", "pacman"):
-        if shutil.which(cmd):
-            return cmd
-    return "pkg"
+def jsonl_path(path: str) -> str:
+    """Cesta pro JSON-lines variantu výstupu (*.json -> *.jsonl)."""
+    return path[:-5] + ".jsonl" if path.endswith(".json") else path
 
 
-def find_system_pip() -> Optional[str]:
-    for name in ("pip3", "pip"):
-        path = shutil.which(name)
-        if path:
-            return path
-    return None
+def _jsonl_section(record: Dict[str, Any]) -> str:
+    """Klíč sekce indexu: typ + zdroj (u balíčků i jméno venv)."""
+    kind = record.get("type", "")
+    if kind == "package":
+        if record.get("source") == "venv":
+            return f"package:venv:{record.get('venv')}"
+        return f"package:{record.get('source')}"
+    return kind
 
 
-def find_venv_pips(venv_root: str) -> List[str]:
+class JsonlWriter:
     """
-    Najde pip exáče ve virtuálních prostředích pod venv_root.
-    Očekává layout ~/venv/<jmeno>/bin/pip3.
+    Streamový zápis JSON-lines: každý záznam se zapíše hned (a flushne).
+
+    Během běhu se píše do <path>.partial; close() připíše index (poslední
+    řádek, type="index") a soubor atomicky přejmenuje na <path>. Když proces
+    spadne, zůstane .partial se vším, co se stihlo zapsat.
+
+    Index: {"type": "index", "records": n, "sections": {klíč: [offset, bajty, počet]}}
+    kde sekce jsou souvislé bloky stejného typu/zdroje (viz _jsonl_section).
+
+    S compress ("gz" / "xz") se píše do compressed_path(path); offsety indexu
+    jsou v nekomprimovaných datech. Komprimovaný proud se průběžně neflushuje
+    (zhoršilo by to kompresi), takže .partial po pádu nemusí být čitelný.
     """
-    pips: List[str] = []
-    if not os.path.isdir(venv_root):
-        return pips
 
-    for name in os.listdir(venv_root):
-        full = os.path.join(venv_root, name)
-        if not os.path.isdir(full):
-            continue
-        cand = os.path.join(full, "bin", "pip3")
-        if os.path.isfile(cand) and os.access(cand, os.X_OK):
-            pips.append(cand)
-    return pips
+    def __init__(self, path: str, compress: Optional[str] = None) -> None:
+        self.path = compressed_path(path, compress)
+        self.partial = self.path + ".partial"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        except Exception:
+            pass
+        self._raw = open(self.partial, "wb")
+        self._f = _compress_stream(self._raw, compress)
+        self._records = 0
+        self._sections: Dict[str, List[int]] = {}
+        self._current: Optional[str] = None
 
-# -------------------------------------------------------------
-# Mirror / APT helpery
-# -------------------------------------------------------------
+    def write(self, kind: str, record: Dict[str, Any]) -> None:
+        rec = {"type": kind}
+        rec.update(record)
+        line = (json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+        offset = self._f.tell()
+        section = _jsonl_section(rec)
+        entry = self._sections.get(section)
+        if entry is None or self._current != section:
+            # nová sekce; opakovaný (nesouvislý) výskyt se přidá jako "klíč#n"
+            key = section
+            n = 1
+            while key in self._sections:
+                n += 1
+                key = f"{section}#{n}"
+            self._sections[key] = entry = [offset, 0, 0]
+            self._current = section
+        entry[1] += len(line)
+        entry[2] += 1
+        self._f.write(line)
+        if self._f is self._raw:
+            self._f.flush()
+        self._records += 1
+
+    def close(self) -> None:
+        """Zapíše index, fsync a atomicky přejmenuje .partial -> path."""
+        self._current = None
+        footer = {"type": "index", "records": self._records, "sections": self._sections}
+        self._f.write((json.dumps(footer, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8"))
+        if self._f is not self._raw:
+            self._f.close()
+        self._raw.flush()
+        os.fsync(self._raw.fileno())
+        self._raw.close()
+        os.replace(self.partial, self.path)
+        logger.info("Writing %s", self.path)
 
-_MIRROR_ERROR_HINTS = ("is not signed", "NO_PUBKEY", "EXPKEYSIG")
+    def abort(self) -> None:
+        """Uzavře soubor bez dokončení (zůstane .partial)."""
+        for f in (self._f, self._raw):
+            try:
+                f.close()
+            except Exception:
+                pass
 
 
-def extract_bad_mirror_hosts(stderr: str) -> List[str]:
+def read_jsonl_index(path: str) -> Optional[Dict[str, Any]]:
     """
-    Z apt stderr se pokusí vytáhnout hostname mirrorů, jejichž repo není podepsané.
+    Přečte index z posledního řádku JSON-lines souboru (bez čtení celého
+    souboru). Komprimovaný soubor nejde číst od konce – vrací None.
     """
-    hosts: set[str] = set()
+    try:
+        if detect_compression(path):
+            return None
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            end = f.tell()
+            pos = max(0, end - 65536)
+            while True:
+                f.seek(pos)
+                tail = f.read(end - pos)
+                nl = tail.rstrip(b"\n").rfind(b"\n")
+                if nl >= 0 or pos == 0:
+                    last = tail[nl + 1 :] if nl >= 0 else tail
+                    break
+                pos = max(0, pos - 65536 * 4)
+        rec = json.loads(last)
+    except (OSError, ValueError):
+        return None
+    return rec if isinstance(rec, dict) and rec.get("type") == "index" else None
 
-    for line in stderr.splitlines():
-        if "The repository" in line and "InRelease" in line:
-            if not any(hint in line for hint in _MIRROR_ERROR_HINTS):
-                continue
-            # Příklad:
-            # E: The repository 'https://mirror.mwt.me/termux/main stable InRelease' is not signed.
-            m = re.search(r"'(https?://[^'\s]+)", line)
-            if not m:
+
+def iter_jsonl_records(
+    path: str,
+    kind: Optional[str] = None,
+    source: Optional[str] = None,
+    venv: Optional[str] = None,
+    where: Optional[Callable[[Dict[str, Any]], bool]] = None,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Streamově čte JSON-lines výstup a vrací záznamy odpovídající filtru.
+
+    kind/source/venv filtrují podle typu záznamu, zdroje balíčku a venv,
+    where je libovolný predikát. Pokud má soubor index a filtruje se podle
+    typu/zdroje, čtou se jen odpovídající sekce (seek), jinak se soubor
+    prochází řádek po řádku (vždy u .jsonl.gz / .jsonl.xz). Indexový
+    záznam se nevrací.
+    """
+    def _match(rec: Dict[str, Any]) -> bool:
+        if rec.get("type") == "index":
+            return False
+        if kind is not None and rec.get("type") != kind:
+            return False
+        if source is not None and rec.get("source") != source:
+            return False
+        if venv is not None and rec.get("venv") != venv:
+            return False
+        return where is None or where(rec)
+
+    index = read_jsonl_index(path) if kind is not None else None
+    with open_compressed(path, "rb") as f:
+        if index is not None:
+            for key, (offset, size, _count) in sorted(index["sections"].items(), key=lambda kv: kv[1][0]):
+                section = key.split("#", 1)[0]
+                if section.split(":", 1)[0] != kind:
+                    continue
+                if kind == "package" and source is not None:
+                    want = f"package:venv:{venv}" if source == "venv" and venv is not None else f"package:{source}"
+                    if section != want and not (source == "venv" and venv is None and section.startswith("package:venv:")):
+                        continue
+                f.seek(offset)
+                for raw in f.read(size).splitlines():
+                    rec = json.loads(raw)
+                    if _match(rec):
+                        yield rec
+            return
+
+        for raw in f:
+            if not raw.strip():
                 continue
-            url = m.group(1)
-            host_match = re.match(r"https?://([^/]+)", url)
-            if host_match:
-                hosts.add(host_match.group(1))
+            rec = json.loads(raw)
+            if _match(rec):
+                yield rec
 
-    return sorted(hosts)
 
+class LockTimeout(Exception):
+    """Zámek se nepodařilo získat do --lock-timeout."""
 
-def sanitize_apt_sources(bad_hosts: List[str]) -> List[Dict[str, str]]:
+
+class LockManager:
     """
-    Zakomentuje řádky v APT sources, které odkazují na problematické mirror hostname.
+    Sdílené / exkluzivní zámky (flock) po jednotlivých prostředcích.
 
-    Vrací seznam změn:
-        [{"file": path, "line": původní_řádek}, ...]
+    Prostředky:
+      "run"          – běh, který mění systém (pkg update/upgrade, pip
+                       upgrade); soubor LOCKFILE, takže se vylučuje i se
+                       staršími verzemi skriptu
+      "pkg"          – dpkg databáze (exkluzivně update/upgrade, sdíleně čtení)
+      "pip:system"   – systémový pip
+      "venv:<cesta>" – jeden venv (exkluzivně upgrade, sdíleně inventář)
+      "outputs"      – výstupní soubory a historie
+
+    Čeká se neblokujícím flock v krátkých intervalech až do timeout
+    (None = bez limitu). Každý držitel zapíše do LOCK_DIR soubor
+    <prostředek>.<pid>.holder (pid, režim, od kdy, příkaz), takže při
+    čekání / vypršení jde říct, kdo zámek drží.
     """
-    changes: List[Dict[str, str]] = []
-    if not bad_hosts:
-        return changes
 
-    for path in APT_SOURCES:
-        if not os.path.isfile(path):
-            continue
+    def __init__(self, lock_dir: str = LOCK_DIR, timeout: Optional[float] = None) -> None:
+        self.lock_dir = lock_dir
+        self.timeout = timeout
+        self._held: Dict[str, Tuple[Any, str]] = {}  # prostředek -> (fd, holder soubor)
 
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                lines = f.readlines()
-        except Exception:
-            continue
+    def _path(self, resource: str) -> str:
+        import urllib.parse
 
-        modified = False
-        new_lines: List[str] = []
+        if resource == "run":
+            return LOCKFILE
+        return os.path.join(self.lock_dir, urllib.parse.quote(resource, safe="") + ".lock")
 
-        for line in lines:
-            stripped = line.lstrip()
-            if stripped.startswith("#"):
-                new_lines.append(line)
+    def holders(self, resource: str) -> List[Dict[str, Any]]:
+        """Živí držitelé prostředku (soubory mrtvých procesů se smažou)."""
+        import glob
+
+        prefix = os.path.basename(self._path(resource))[:-5] + "."
+        found = []
+        for fn in glob.glob(os.path.join(self.lock_dir, glob.escape(prefix) + "*.holder")):
+            try:
+                with open(fn, "r", encoding="utf-8") as f:
+                    info = json.load(f)
+                os.kill(int(info["pid"]), 0)
+            except ProcessLookupError:
+                try:
+                    os.remove(fn)
+                except OSError:
+                    pass
+                continue
+            except (OSError, ValueError, KeyError, TypeError):
                 continue
+            if info.get("resource") == resource:
+                found.append(info)
+        return found
 
-            if any(host in line for host in bad_hosts):
-                # tento řádek zakomentujeme
-                new_lines.append("# disabled by Termux-Updater (bad mirror)\n")
-                new_lines.append("# " + line)
-                modified = True
-                changes.append({"file": path, "line": line.strip()})
-            else:
-                new_lines.append(line)
+    def describe(self, resource: str) -> str:
+        infos = self.holders(resource)
+        if not infos:
+            return f"{resource} is locked (holder unknown)"
+        return f"{resource} is held by " + "; ".join(
+            f"pid {h['pid']} ({h['mode']} since {h['since']}: {h.get('cmd', '')})" for h in infos
+        )
 
-        if modified:
+    def acquire(self, resource: str, shared: bool = False, timeout: Optional[float] = -1) -> None:
+        """
+        Získá zámek; timeout=-1 znamená self.timeout.
+
+        Vyhodí LockTimeout s popisem držitelů, když zámek nejde získat včas.
+        """
+        if resource in self._held:
+            raise RuntimeError(f"lock {resource} already held by this process")
+        if timeout is not None and timeout < 0:
+            timeout = self.timeout
+        path = self._path(resource)
+        os.makedirs(self.lock_dir, exist_ok=True)
+        fd = open(path, "a+")
+        op = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+        start = time.monotonic()
+        logged = False
+        delay = 0.05
+        while True:
             try:
-                backup = path + ".bak"
-                shutil.copy2(path, backup)
-            except Exception:
+                fcntl.flock(fd, op | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
                 pass
+            except OSError:
+                fd.close()
+                raise
+            waited = time.monotonic() - start
+            if timeout is not None and waited >= timeout:
+                fd.close()
+                raise LockTimeout(f"timed out after {waited:.1f}s: {self.describe(resource)}")
+            if not logged and waited >= LOCK_WAIT_LOG:
+                logger.warning("Waiting for lock: %s", self.describe(resource))
+                logged = True
+            time.sleep(delay if timeout is None else max(0.0, min(delay, timeout - waited)))
+            delay = min(delay * 2, 1.0)
+
+        holder = os.path.join(self.lock_dir, os.path.basename(path)[:-5] + f".{os.getpid()}.holder")
+        try:
+            with open(holder, "w", encoding="utf-8") as f:
+                json.dump({
+                    "pid": os.getpid(),
+                    "resource": resource,
+                    "mode": "shared" if shared else "exclusive",
+                    "since": timestamp_now_iso(),
+                    "cmd": " ".join(sys.argv),
+                }, f)
+        except OSError:
+            holder = ""
+        self._held[resource] = (fd, holder)
+
+    def release(self, resource: str) -> None:
+        fd, holder = self._held.pop(resource, (None, ""))
+        if fd is None:
+            return
+        if holder:
             try:
-                with open(path, "w", encoding="utf-8") as f:
-                    f.writelines(new_lines)
-            except Exception:
-                # když zápis selže, necháme původní stav
-                continue
+                os.remove(holder)
+            except OSError:
+                pass
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            fd.close()
 
-    return changes
+    def release_all(self) -> None:
+        for name in list(self._held):
+            self.release(name)
+
+    @contextmanager
+    def hold(self, name: str, shared: bool = False) -> Iterator[None]:
+        self.acquire(name, shared)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+    @asynccontextmanager
+    async def hold_async(self, name: str, shared: bool = False) -> Any:
+        """Jako hold(), ale čeká ve vlákně, aby neblokoval event loop."""
+        await asyncio.to_thread(self.acquire, name, shared)
+        try:
+            yield
+        finally:
+            self.release(name)
+
+
+@contextmanager
+def maybe_locked(locks: Optional[LockManager], resource: str, shared: bool = False) -> Iterator[None]:
+    """hold() pokud jsou zámky zapnuté (locks není None), jinak nic."""
+    if locks is None:
+        yield
+    else:
+        with locks.hold(resource, shared):
+            yield
+
+
+@asynccontextmanager
+async def maybe_locked_async(locks: Optional[LockManager], resource: str, shared: bool = False) -> Any:
+    if locks is None:
+        yield
+    else:
+        async with locks.hold_async(resource, shared):
+            yield
 
 # -------------------------------------------------------------
-# Operace pkg / pip
+# Žurnál kroků (--resume)
 # -------------------------------------------------------------
 
-def pkg_update_and_list(pkg_cmd: str, dry_run: bool) -> Tuple[List[Dict[str, str]], List[Dict[str, Any]]]:
+class StepJournal:
     """
-    Spustí pkg update/upgrade a list-installed.
+    Append-only žurnál úspěšně dokončených kroků běhu (JSON-lines).
 
-    Vrací:
-        (packages, issues)
-        packages: [{name, version}]
-        issues : list dictů s category/cmd/rc/stderr
+    První řádek je hlavička {"type": "run", "mode", "plan", "started"}, každý další
+    {"type": "step", "step", "done"}. Každý zápis se flushne a fsyncne,
+    takže po zabití procesu (uspaný telefon, zavřená Termux session)
+    v žurnálu zůstane vše, co se opravdu dokončilo. Kroky, které skončily
+    chybou, se nezapisují – při --resume se zopakují.
+
+    Po úspěšném doběhnutí se žurnál smaže (finish()). Žurnál běhu v jiném
+    režimu nebo s jiným plánem (plan = "generated" z --apply-plan, None bez
+    plánu) se při --resume nepoužije – kroky by znamenaly něco jiného.
     """
-    issues: List[Dict[str, Any]] = []
-    packages: List[Dict[str, str]] = []
 
-    # update
-    rc_upd, out_upd, err_upd = run_cmd([pkg_cmd, "update", "-y"], dry_run)
-    if rc_upd not in (-1, 0):
-        issues.append({
-            "category": "pkg_update",
-            "cmd": [pkg_cmd, "update", "-y"],
-            "rc": rc_upd,
-            "stderr": err_upd,
-        })
+    def __init__(self, path: str, mode: str, resume: bool = False, plan: Optional[str] = None) -> None:
+        self.path = path
+        self.completed: Dict[str, str] = {}
+        if resume:
+            self.completed = self._load(path, mode, plan)
+            if self.completed:
+                logger.info("Resuming: %d steps already completed (%s)", len(self.completed), path)
+            else:
+                logger.info("Nothing to resume in %s, starting a full run", path)
+        elif os.path.exists(path):
+            logger.info("Previous run did not finish; starting over (use --resume to continue it)")
 
-    # upgrade
-    rc_upg, out_upg, err_upg = run_cmd([pkg_cmd, "upgrade", "-y"], dry_run)
-    if rc_upg not in (-1, 0):
-        issues.append({
-            "category": "pkg_upgrade",
-            "cmd": [pkg_cmd, "upgrade", "-y"],
-            "rc": rc_upg,
-            "stderr": err_upg,
-        })
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if self.completed:
+            self._f = open(path, "a", encoding="utf-8")
+        else:
+            self._f = open(path, "w", encoding="utf-8")
+            self._append({"type": "run", "mode": mode, "plan": plan, "started": timestamp_now_iso(), "ts": time.time()})
 
-    # list-installed
-    rc_list, out_list, err_list = run_cmd([pkg_cmd, "list-installed"], dry_run)
-    if rc_list in (-1, 0):
-        if not dry_run:
-            for line in out_list.splitlines():
-                line = line.strip()
-                if not line:
-                    continue
-                token = line.split()[0]
-                if "/" in token:
-                    name = token.split("/")[0]
-                    version = "unknown"
+    @staticmethod
+    def _load(path: str, mode: str, plan: Optional[str] = None) -> Dict[str, str]:
+        steps: Dict[str, str] = {}
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = f.read().splitlines()
+        except OSError:
+            return steps
+        for n, line in enumerate(lines):
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # useknutý poslední řádek
+            if n == 0:
+                if rec.get("type") != "run" or time.time() - rec.get("ts", 0) > JOURNAL_MAX_AGE:
+                    logger.info("Journal %s is stale or invalid, ignoring it", path)
+                    return {}
+                if rec.get("mode") != mode:
+                    logger.info("Journal %s belongs to a mode %s run, not %s; ignoring it", path, rec.get("mode"), mode)
+                    return {}
+                if rec.get("plan") != plan:
+                    logger.info("Journal %s belongs to a run with a different plan; ignoring it", path)
+                    return {}
+            elif rec.get("type") == "step" and rec.get("step"):
+                steps[rec["step"]] = rec.get("done", "")
+        return steps
+
+    def _append(self, rec: Dict[str, Any]) -> None:
+        self._f.write(json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def done(self, step: str) -> bool:
+        """Byl krok dokončen v přerušeném běhu (nebo už v tomto)?"""
+        return step in self.completed
+
+    def mark(self, step: str) -> None:
+        """Zapíše úspěšně dokončený krok."""
+        self.completed[step] = timestamp_now_iso()
+        self._append({"type": "step", "step": step, "done": self.completed[step]})
+
+    def close(self) -> None:
+        """Zavře žurnál a nechá ho na disku (běh nedoběhl)."""
+        if not self._f.closed:
+            self._f.close()
+
+    def finish(self) -> None:
+        """Běh doběhl – žurnál už není potřeba."""
+        self.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+# -------------------------------------------------------------
+# Detekce prostředí
+# -------------------------------------------------------------
+
+def detect_package_manager() -> str:
+    """Preferuje Termux 'pkg', fallback na apt/apk/pacman."""
+    for cmd in ("pkg", "apt", "apk", "pacman"):
+        if shutil.which(cmd):
+            return cmd
+    return "pkg"
+
+
+def find_system_pip() -> Optional[str]:
+    for name in ("pip3", "pip"):
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+VENV_MAX_DEPTH = 3
+VENV_PRUNE = (
+    ".git", ".hg", ".svn", ".cache", ".local", ".npm", ".cargo", ".rustup",
+    "node_modules", "__pycache__", ".tox", ".nox", ".mypy_cache", ".pytest_cache",
+    "site-packages", "storage",
+)
+VENV_DISCOVERY_VERSION = 2
+
+
+def _env_pip(env: str) -> Optional[str]:
+    for name in ("pip3", "pip"):
+        cand = os.path.join(env, "bin", name)
+        if os.path.isfile(cand) and os.access(cand, os.X_OK):
+            return cand
+    return None
+
+
+def _scan_dir(path: str, prune: Tuple[str, ...], follow: bool = False) -> Tuple[str, List[str]]:
+    """
+    Jedno os.scandir(): jak adresář vypadá jako Python prostředí, a jaké má podadresáře?
+
+    Vrací (druh, podadresáře); druh:
+      "env"    – pyvenv.cfg (venv / virtualenv) nebo conda-meta/ (conda),
+      "legacy" – starý layout s bin/pip3 a lib/ bez pyvenv.cfg,
+      "bin"    – jen bin/pip3 (prostředím je jen přímo pod kořenem),
+      ""       – není prostředí.
+    S follow se za podadresáře berou i symlinky na adresáře.
+    """
+    import fnmatch
+
+    subdirs: List[str] = []
+    names = set()
+    with os.scandir(path) as it:
+        for entry in it:
+            names.add(entry.name)
+            try:
+                if entry.is_dir(follow_symlinks=follow) and not any(
+                    fnmatch.fnmatch(entry.name, pat) for pat in prune
+                ):
+                    subdirs.append(entry.name)
+            except OSError:
+                continue
+    if "pyvenv.cfg" in names or "conda-meta" in names:
+        return "env", sorted(subdirs)
+    if "bin" in names and _env_pip(path) is not None:
+        return ("legacy" if "lib" in names else "bin"), sorted(subdirs)
+    return "", sorted(subdirs)
+
+
+def _bin_mtime(path: str) -> Optional[int]:
+    try:
+        return os.stat(os.path.join(path, "bin")).st_mtime_ns
+    except OSError:
+        return None
+
+
+def discover_venvs(
+    roots: List[str],
+    max_depth: int = VENV_MAX_DEPTH,
+    prune: Tuple[str, ...] = VENV_PRUNE,
+    cache_path: Optional[str] = VENV_DISCOVERY_CACHE,
+) -> List[Tuple[str, str]]:
+    """
+    Najde Python prostředí pod roots a vrátí [(jméno, pip), ...].
+
+    - prochází os.scandir() do hloubky max_depth (root = 0, ~/venv/x = 1),
+    - adresáře odpovídající prune (fnmatch vzory) se přeskočí,
+    - do nalezeného prostředí se už nesestupuje,
+    - výsledek každého adresáře (je prostředí? podadresáře) se ukládá do
+      cache_path s mtime adresáře (a jeho bin/); dokud se mtime nezmění,
+      adresář se znovu nečte (stačí stat),
+    - symlinky se následují jen u přímých potomků rootu (~/venv/x -> jinam);
+      každý adresář (podle realpath) se projde jen jednou, takže cyklus nevadí,
+    - přímo pod rootem stačí starý layout s bin/pip3, hlouběji se chce i lib/.
+
+    Jméno je relativní cesta k rootu ("proj/.venv"); při kolizi mezi
+    roots se použije absolutní cesta. Výsledek je seřazený podle jména.
+    """
+    cache: Dict[str, Any] = {"version": VENV_DISCOVERY_VERSION, "dirs": {}}
+    if cache_path:
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if isinstance(data, dict) and data.get("version") == VENV_DISCOVERY_VERSION and data.get("prune") == list(prune):
+                cache = data
+        except (OSError, ValueError):
+            pass
+    old_dirs: Dict[str, Any] = cache["dirs"]
+    new_dirs: Dict[str, Any] = {}
+    scanned = 0
+
+    found: List[Tuple[str, str, str]] = []  # (root, env, pip)
+    visited = set()
+    for root in roots:
+        root = os.path.abspath(os.path.expanduser(root))
+        stack: List[Tuple[str, int]] = [(root, 0)]
+        while stack:
+            path, depth = stack.pop()
+            real = os.path.realpath(path)
+            if real in visited:
+                continue
+            visited.add(real)
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            follow = depth == 0
+            entry = old_dirs.get(path)
+            if (
+                entry is None
+                or entry[0] != mtime
+                or entry[4] != follow
+                or (entry[1] is not None and entry[1] != _bin_mtime(path))
+            ):
+                try:
+                    kind, subdirs = _scan_dir(path, prune, follow)
+                except OSError:
+                    continue
+                scanned += 1
+                entry = [mtime, _bin_mtime(path), kind, subdirs, follow]
+            new_dirs[path] = entry
+            _, _, kind, subdirs, _ = entry
+            is_env = kind in ("env", "legacy") or (kind == "bin" and depth == 1)
+
+            if is_env and depth > 0:
+                pip = _env_pip(path)
+                if pip:
+                    found.append((root, path, pip))
+                continue
+            if depth < max_depth:
+                stack.extend((os.path.join(path, d), depth + 1) for d in reversed(subdirs))
+
+    logger.debug("Venv discovery: %d dirs checked, %d rescanned", len(new_dirs), scanned)
+    if cache_path and (scanned or len(new_dirs) != len(old_dirs)):
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            tmp = cache_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"version": VENV_DISCOVERY_VERSION, "prune": list(prune), "dirs": new_dirs},
+                    f, separators=(",", ":"),
+                )
+            os.replace(tmp, cache_path)
+        except OSError as e:
+            logger.debug("Unable to write venv discovery cache: %s", e)
+
+    names: Dict[str, int] = {}
+    for root, env, _pip in found:
+        rel = os.path.relpath(env, root)
+        names[rel] = names.get(rel, 0) + 1
+    result = []
+    seen = set()
+    for root, env, pip in found:
+        if env in seen:
+            continue
+        seen.add(env)
+        rel = os.path.relpath(env, root)
+        result.append((rel if names[rel] == 1 else env, pip))
+    return sorted(result)
+
+
+def find_venv_pips(venv_root: str) -> List[str]:
+    """
+    Najde pip exáče ve virtuálních prostředích pod venv_root (viz discover_venvs).
+
+    Výsledek je seřazený podle jména venv, aby byl inventář deterministický.
+    """
+    return [pip for _, pip in discover_venvs([venv_root])]
+
+# -------------------------------------------------------------
+# Mirror / APT helpery
+# -------------------------------------------------------------
+
+# Jeden regex pro celý apt výstup: URL / hostitel nebo typ chyby (viz AptLogClassifier)
+_APT_EVENT_RE = (
+    r"(?P<url>(?:https?|ftp)://(?P<host>[^/\s'\":\]]+)[^\s'\"]*)"
+    r"|(?P<conn>(?:Could not connect to|Failed to connect to|Unable to connect to) (?P<conn_host>[\w.-]+))"
+    r"|(?P<dns>(?:Temporary failure resolving|Could not resolve(?: host:)?) '?(?P<dns_host>[\w.-]+))"
+    r"|(?P<unsigned>is not signed|NO_PUBKEY|no longer signed)"
+    r"|(?P<expired_key>EXPKEYSIG|KEYEXPIRED|is expired|signature by key \S+ expired)"
+    r"|(?P<hash_mismatch>Hash Sum mismatch|Hashes of expected file|File has unexpected size)"
+    r"|(?P<not_found>\b404\s+Not Found)"
+    r"|(?P<timeout>[Tt]imed? ?out\b|timeout was reached)"
+)
+APT_ERROR_KINDS = ("unsigned", "expired_key", "hash_mismatch", "not_found", "timeout", "dns")
+# Chyby, které jednoznačně ukazují na rozbitý mirror; timeout / dns jen když
+# jiné mirrory v tomtéž výstupu fungovaly (jinak je spíš rozbitá síť)
+APT_MIRROR_ERRORS = ("unsigned", "expired_key", "hash_mismatch", "not_found")
+APT_NETWORK_ERRORS = ("timeout", "dns")
+
+
+class AptLogClassifier:
+    """
+    Průběžná klasifikace apt / pkg výstupu po řádcích (feed()).
+
+    Na každý řádek se pustí jediný regex (_APT_EVENT_RE, kompiluje se
+    jednou při vytvoření klasifikátoru);
+    řádky "Get:" / "Hit:" se jen rozdělí a označí hostitele jako funkční.
+    Pokračovací řádky (odsazené pod "Err:N URL" / "Ign:N URL") se
+    přiřadí hostiteli z předchozího Err/Ign řádku.
+
+    Výsledek: counts[host][druh] = počet; chyba bez hostitele má host "".
+    """
+
+    def __init__(self) -> None:
+        self.counts: Dict[str, Dict[str, int]] = {}
+        self.ok_hosts: set = set()
+        self.lines = 0
+        self._context = ""
+        self._partial = ""
+        self._events = _regex(_APT_EVENT_RE)
+
+    def feed(self, line: str) -> None:
+        self.lines += 1
+        if line.startswith(("Get:", "Hit:")):
+            # "Get:12 https://host/path suite ..." – bez regexu, je to většina řádků
+            parts = line.split(None, 2)
+            if len(parts) > 1:
+                host = parts[1].partition("://")[2].partition("/")[0]
+                if host:
+                    self.ok_hosts.add(host.partition(":")[0])
+            return
+
+        host = ""
+        kinds = []
+        for m in self._events.finditer(line):
+            group = m.lastgroup
+            if group == "url":
+                host = host or m.group("host")
+            elif group == "conn":
+                host = host or m.group("conn_host")
+            elif group == "dns":
+                host = host or m.group("dns_host")
+                kinds.append("dns")
+            else:
+                kinds.append(group)
+
+        if line.startswith(("Err:", "Ign:")):
+            self._context = host
+        elif line[:1] in (" ", "\t"):
+            host = host or self._context
+        else:
+            self._context = ""
+
+        if kinds:
+            per_host = self.counts.setdefault(host, {})
+            for kind in kinds:
+                per_host[kind] = per_host.get(kind, 0) + 1
+
+    def feed_text(self, chunk: str) -> None:
+        """Libovolný kus výstupu (i s useknutým posledním řádkem)."""
+        lines = (self._partial + chunk).split("\n")
+        self._partial = lines.pop()
+        for line in lines:
+            self.feed(line)
+
+    def close(self) -> None:
+        if self._partial:
+            self.feed(self._partial)
+            self._partial = ""
+
+    def merge(self, other: "AptLogClassifier") -> None:
+        self.lines += other.lines
+        self.ok_hosts |= other.ok_hosts
+        for host, kinds in other.counts.items():
+            per_host = self.counts.setdefault(host, {})
+            for kind, n in kinds.items():
+                per_host[kind] = per_host.get(kind, 0) + n
+
+    def bad_hosts(self, min_count: int = 1) -> List[str]:
+        """Hostitelé, jejichž mirror má smysl zakomentovat (sanitize_apt_sources)."""
+        network_ok = bool(self.ok_hosts)
+        bad = []
+        for host, kinds in self.counts.items():
+            if not host:
+                continue
+            if sum(kinds.get(k, 0) for k in APT_MIRROR_ERRORS) >= min_count:
+                bad.append(host)
+            elif (
+                network_ok
+                and host not in self.ok_hosts
+                and sum(kinds.get(k, 0) for k in APT_NETWORK_ERRORS) >= min_count
+            ):
+                bad.append(host)
+        return sorted(bad)
+
+    def report(self) -> Dict[str, Any]:
+        totals: Dict[str, int] = {}
+        for kinds in self.counts.values():
+            for kind, n in kinds.items():
+                totals[kind] = totals.get(kind, 0) + n
+        return {
+            "lines": self.lines,
+            "totals": totals,
+            "hosts": {h or "(unknown)": dict(sorted(k.items())) for h, k in sorted(self.counts.items())},
+            "ok_hosts": sorted(self.ok_hosts),
+            "bad_hosts": self.bad_hosts(),
+        }
+
+
+def classify_apt_log(path: str) -> AptLogClassifier:
+    """Proudově projde apt log (i .gz; "-" = stdin)."""
+    import gzip
+
+    classifier = AptLogClassifier()
+    if path == "-":
+        f = sys.stdin
+    elif path.endswith(".gz"):
+        f = gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    else:
+        f = open(path, "r", encoding="utf-8", errors="replace")
+    try:
+        for line in f:
+            classifier.feed(line.rstrip("\n"))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return classifier
+
+
+def extract_bad_mirror_hosts(stderr: str) -> List[str]:
+    """
+    Z apt stderr se pokusí vytáhnout hostname mirrorů, jejichž repo není
+    podepsané nebo má prošlý klíč (viz AptLogClassifier pro ostatní chyby).
+    """
+    classifier = AptLogClassifier()
+    classifier.feed_text(stderr)
+    classifier.close()
+    return sorted(
+        host for host, kinds in classifier.counts.items()
+        if host and (kinds.get("unsigned") or kinds.get("expired_key"))
+    )
+
+
+def sanitize_apt_sources(bad_hosts: List[str]) -> List[Dict[str, str]]:
+    """
+    Zakomentuje řádky v APT sources, které odkazují na problematické mirror hostname.
+
+    Vrací seznam změn:
+        [{"file": path, "line": původní_řádek}, ...]
+    """
+    changes: List[Dict[str, str]] = []
+    if not bad_hosts:
+        return changes
+
+    for path in APT_SOURCES:
+        if not os.path.isfile(path):
+            continue
+
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except Exception:
+            continue
+
+        modified = False
+        new_lines: List[str] = []
+
+        for line in lines:
+            stripped = line.lstrip()
+            if stripped.startswith("#"):
+                new_lines.append(line)
+                continue
+
+            if any(host in line for host in bad_hosts):
+                # tento řádek zakomentujeme
+                new_lines.append("# disabled by Termux-Updater (bad mirror)\n")
+                new_lines.append("# " + line)
+                modified = True
+                changes.append({"file": path, "line": line.strip()})
+            else:
+                new_lines.append(line)
+
+        if modified:
+            try:
+                backup = path + ".bak"
+                shutil.copy2(path, backup)
+            except Exception:
+                pass
+            try:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.writelines(new_lines)
+            except Exception:
+                # když zápis selže, necháme původní stav
+                continue
+
+    return changes
+
+# -------------------------------------------------------------
+# Mirror ranking – měření latence a výběr nejrychlejšího mirroru
+# -------------------------------------------------------------
+
+# Známé Termux mirrory podle (suite, components) zdrojového řádku
+TERMUX_MIRRORS: Dict[Tuple[str, str], List[str]] = {
+    ("stable", "main"): [
+        "https://packages-cf.termux.dev/apt/termux-main",
+        "https://packages.termux.dev/apt/termux-main",
+        "https://grimler.se/termux/termux-main",
+        "https://mirror.mwt.me/termux/main",
+    ],
+    ("root", "stable"): [
+        "https://packages-cf.termux.dev/apt/termux-root",
+        "https://packages.termux.dev/apt/termux-root",
+        "https://grimler.se/termux/termux-root",
+        "https://mirror.mwt.me/termux/root",
+    ],
+    ("x11", "main"): [
+        "https://packages-cf.termux.dev/apt/termux-x11",
+        "https://packages.termux.dev/apt/termux-x11",
+        "https://grimler.se/termux/termux-x11",
+        "https://mirror.mwt.me/termux/x11",
+    ],
+}
+
+MIRROR_PROBE_TIMEOUT = 10.0  # s
+MIRROR_CACHE_TTL = 6 * 3600  # s
+MIRROR_SWITCH_MARGIN = 0.8   # nový mirror musí být aspoň o 20 % rychlejší
+
+_SOURCE_LINE_RE = r"^\s*deb\s+(?:\[[^\]]*\]\s+)?(\S+)\s+(\S+)((?:\s+\S+)*)\s*$"
+
+
+def parse_apt_sources(paths: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Aktivní `deb` řádky ze zdrojů APT.
+
+    Vrací [{file, lineno, line, url, suite, components}], url bez koncového '/'.
+    """
+    entries: List[Dict[str, Any]] = []
+    for path in paths if paths is not None else APT_SOURCES:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except OSError:
+            continue
+        for lineno, line in enumerate(lines):
+            m = _regex(_SOURCE_LINE_RE).match(line)
+            if not m:
+                continue
+            entries.append({
+                "file": path,
+                "lineno": lineno,
+                "line": line.rstrip("\n"),
+                "url": m.group(1).rstrip("/"),
+                "suite": m.group(2),
+                "components": " ".join(m.group(3).split()),
+            })
+    return entries
+
+
+def load_mirror_candidates(path: str) -> List[Tuple[str, str, str]]:
+    """
+    Soubor s kandidáty: jeden mirror na řádek ve formátu `URL SUITE COMPONENTS`
+    (stejně jako v sources.list, bez `deb`). Prázdné řádky a # se ignorují.
+    """
+    cands: List[Tuple[str, str, str]] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if not parts or parts[0].startswith("#"):
+                continue
+            if parts[0] == "deb":
+                parts = parts[1:]
+            if len(parts) < 2:
+                continue
+            cands.append((parts[0].rstrip("/"), parts[1], " ".join(parts[2:])))
+    return cands
+
+
+def probe_mirror(url: str, suite: str, timeout: float = MIRROR_PROBE_TIMEOUT) -> Dict[str, Any]:
+    """
+    Stáhne <url>/dists/<suite>/InRelease a změří latenci a propustnost.
+
+    Vrací {url, suite, healthy, latency, total, bytes, throughput, error}.
+    latency = čas do hlaviček odpovědi, total = celé stažení (s),
+    throughput v B/s. Mirror je "healthy", pokud vrátí HTTP 200
+    a obsah vypadá jako InRelease (obsahuje pole Suite:).
+    """
+    import urllib.request
+
+    result: Dict[str, Any] = {
+        "url": url,
+        "suite": suite,
+        "healthy": False,
+        "latency": None,
+        "total": None,
+        "bytes": 0,
+        "throughput": None,
+        "error": None,
+    }
+    target = f"{url}/dists/{suite}/InRelease"
+    req = urllib.request.Request(target, headers={"User-Agent": "Termux-Updater"})
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            t1 = time.perf_counter()
+            body = resp.read()
+            t2 = time.perf_counter()
+            status = resp.status
+    except Exception as e:
+        result["error"] = str(e)
+        return result
+
+    result["latency"] = round(t1 - t0, 4)
+    result["total"] = round(t2 - t0, 4)
+    result["bytes"] = len(body)
+    result["throughput"] = round(len(body) / max(t2 - t1, 1e-6), 1)
+    if status == 200 and b"Suite:" in body:
+        result["healthy"] = True
+    else:
+        result["error"] = f"HTTP {status}, not an InRelease file"
+    return result
+
+
+def _load_mirror_cache(path: str = MIRROR_CACHE) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict) and isinstance(data.get("probes"), dict):
+            return data
+    except (OSError, ValueError):
+        pass
+    return {"probes": {}}
+
+
+def rank_mirrors(
+    entries: List[Dict[str, Any]],
+    extra_candidates: Optional[List[Tuple[str, str, str]]] = None,
+    jobs: int = 8,
+    timeout: float = MIRROR_PROBE_TIMEOUT,
+    ttl: float = MIRROR_CACHE_TTL,
+    cache_path: Optional[str] = MIRROR_CACHE,
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Změří kandidátní mirrory pro každý zdroj (suite + components) souběžně.
+
+    Kandidáti skupiny = mirrory ze sources + TERMUX_MIRRORS + extra_candidates.
+    Výsledky měření se cachují v cache_path po dobu ttl sekund.
+
+    Vrací {"<suite>|<components>": [probe, ...]} seřazené: zdravé napřed,
+    pak podle celkového času stažení.
+    """
+    groups: Dict[str, List[str]] = {}
+    for e in entries:
+        key = e["suite"] + "|" + e["components"]
+        urls = groups.setdefault(key, [])
+        for url in [e["url"]] + TERMUX_MIRRORS.get((e["suite"], e["components"]), []):
+            if url not in urls:
+                urls.append(url)
+    for url, suite, comps in extra_candidates or []:
+        key = suite + "|" + comps
+        if key in groups and url not in groups[key]:
+            groups[key].append(url)
+
+    cache = _load_mirror_cache(cache_path) if cache_path else {"probes": {}}
+    now = time.time()
+    todo: List[Tuple[str, str]] = []
+    for key, urls in groups.items():
+        suite = key.split("|", 1)[0]
+        for url in urls:
+            hit = cache["probes"].get(url + "|" + suite)
+            if not hit or now - hit.get("probed", 0) > ttl:
+                todo.append((url, suite))
+
+    async def _probe_all() -> List[Dict[str, Any]]:
+        sem = asyncio.Semaphore(max(1, jobs))
+
+        async def _one(url: str, suite: str) -> Dict[str, Any]:
+            async with sem:
+                with timed("phase", "mirror_probe:" + url):
+                    return await asyncio.to_thread(probe_mirror, url, suite, timeout)
+
+        return list(await asyncio.gather(*(_one(u, su) for u, su in todo)))
+
+    if todo:
+        logger.info("Probing %d mirror candidates...", len(todo))
+        for res in asyncio.run(_probe_all()):
+            res["probed"] = now
+            cache["probes"][res["url"] + "|" + res["suite"]] = res
+
+    if cache_path:
+        cache["probes"] = {
+            k: v for k, v in cache["probes"].items() if now - v.get("probed", 0) <= ttl
+        }
+        safe_write_json(cache_path, cache)
+
+    rankings: Dict[str, List[Dict[str, Any]]] = {}
+    for key, urls in groups.items():
+        suite = key.split("|", 1)[0]
+        probes = [cache["probes"][u + "|" + suite] for u in urls if u + "|" + suite in cache["probes"]]
+        probes.sort(key=lambda r: (not r["healthy"], r["total"] if r["total"] is not None else float("inf")))
+        rankings[key] = probes
+    return rankings
+
+
+def select_fastest_mirrors(
+    rankings: Dict[str, List[Dict[str, Any]]],
+    entries: Optional[List[Dict[str, Any]]] = None,
+    rollback_path: str = MIRROR_ROLLBACK,
+) -> List[Dict[str, str]]:
+    """
+    Přepíše APT sources na nejrychlejší zdravý mirror každé skupiny.
+
+    Mirror se mění jen pokud je současný nezdravý, nebo nový je aspoň
+    o (1 - MIRROR_SWITCH_MARGIN) rychlejší. Před zápisem se každý soubor
+    zazálohuje do <soubor>.mirror.bak a cesty záloh se uloží do rollback_path
+    (viz rollback_mirror_selection). Dokud rollback neproběhl, další přepnutí
+    zálohu nepřepíše – rollback tak vrací stav před prvním přepnutím.
+    Když zápis kteréhokoli souboru selže, už zapsané soubory se vrátí ze záloh.
+
+    Volající má držet zámek "pkg" (apt nesmí běžet, když se mění jeho zdroje).
+
+    Vrací seznam změn [{"file", "old", "new"}].
+    """
+    if entries is None:
+        entries = parse_apt_sources()
+
+    rewrites: Dict[str, Dict[int, str]] = {}
+    changes: List[Dict[str, str]] = []
+    for e in entries:
+        ranked = rankings.get(e["suite"] + "|" + e["components"], [])
+        if not ranked or not ranked[0]["healthy"]:
+            continue
+        best = ranked[0]
+        current = next((r for r in ranked if r["url"] == e["url"]), None)
+        if best["url"] == e["url"]:
+            continue
+        if current and current["healthy"] and best["total"] > current["total"] * MIRROR_SWITCH_MARGIN:
+            continue
+        new_line = e["line"].replace(e["url"], best["url"], 1)
+        rewrites.setdefault(e["file"], {})[e["lineno"]] = new_line
+        changes.append({"file": e["file"], "old": e["url"], "new": best["url"]})
+
+    if not rewrites:
+        return []
+
+    try:
+        with open(rollback_path, "r", encoding="utf-8") as f:
+            pending = json.load(f)
+    except (OSError, ValueError):
+        pending = {}
+    # zálohy z přepnutí, které ještě nikdo nevrátil, zůstávají (původní stav)
+    backups: Dict[str, str] = {
+        path: backup for path, backup in pending.get("backups", {}).items() if os.path.exists(backup)
+    }
+    originals: Dict[str, List[str]] = {}
+    try:
+        for path, by_line in rewrites.items():
+            with open(path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+            originals[path] = list(lines)
+            if path not in backups:
+                backups[path] = path + ".mirror.bak"
+                shutil.copy2(path, backups[path])
+            for lineno, new_line in by_line.items():
+                lines[lineno] = new_line + "\n"
+            tmp = path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+            os.replace(tmp, path)
+    except OSError as e:
+        logger.error("Mirror rewrite failed (%s), restoring the previous sources", e)
+        for path, lines in originals.items():
+            with open(path, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+        return []
+
+    safe_write_json(rollback_path, {
+        "timestamp": timestamp_now_iso(),
+        "backups": backups,
+        "changes": (pending.get("changes", []) if pending.get("backups") else []) + changes,
+    })
+    return changes
+
+
+def rollback_mirror_selection(rollback_path: str = MIRROR_ROLLBACK) -> List[str]:
+    """Vrátí APT sources ze záloh poslední select_fastest_mirrors(); vrací obnovené soubory."""
+    try:
+        with open(rollback_path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return []
+
+    restored: List[str] = []
+    for path, backup in data.get("backups", {}).items():
+        try:
+            shutil.copy2(backup, path)
+            restored.append(path)
+        except OSError as e:
+            logger.warning("Unable to restore %s from %s: %s", path, backup, e)
+    if restored:
+        os.remove(rollback_path)
+    return restored
+
+# -------------------------------------------------------------
+# dpkg databáze (bez spouštění apt)
+# -------------------------------------------------------------
+
+def read_dpkg_status(path: str = DPKG_STATUS) -> Optional[List[Dict[str, Any]]]:
+    """
+    Streamově přečte dpkg status soubor a vrátí nainstalované balíčky.
+
+    Vrací [{name, version, architecture, installed_size}] seřazené dle jména
+    (installed_size v KiB, nebo None), případně None, pokud soubor nejde číst.
+    Balíčky ve stavu jiném než "installed" (např. config-files) se vynechají.
+    """
+    packages: List[Dict[str, Any]] = []
+    fields: Dict[str, str] = {}
+
+    def _flush() -> None:
+        status = fields.get("Status", "")
+        name = fields.get("Package")
+        if name and status.split()[-1:] == ["installed"]:
+            size = fields.get("Installed-Size", "")
+            packages.append({
+                "name": name,
+                "version": fields.get("Version", "unknown"),
+                "architecture": fields.get("Architecture", "unknown"),
+                "installed_size": int(size) if size.isdigit() else None,
+            })
+        fields.clear()
+
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if line == "\n":
+                    _flush()
+                    continue
+                if line[:1] in (" ", "\t"):
+                    # pokračovací řádek (Description apod.) nás nezajímá
+                    continue
+                key, sep, value = line.partition(":")
+                if sep and key in ("Package", "Status", "Version", "Architecture", "Installed-Size"):
+                    fields[key] = value.strip()
+            _flush()
+    except OSError:
+        return None
+
+    packages.sort(key=lambda p: p["name"])
+    return packages
+
+# -------------------------------------------------------------
+# Operace pkg / pip
+# -------------------------------------------------------------
+
+async def _pkg_step(
+    step: str,
+    category: str,
+    cmd: List[str],
+    dry_run: bool,
+    journal: Optional[StepJournal],
+    issues: List[Dict[str, Any]],
+) -> bool:
+    """
+    Jeden krok pkg/apt se zápisem do žurnálu. Chyba se přidá do issues.
+
+    Vrací True, pokud krok proběhl (nebo byl hotový už v přerušeném běhu).
+    """
+    if journal is not None and journal.done(step):
+        logger.info("Skipping %s (completed in interrupted run)", " ".join(cmd))
+        return True
+    with timed("phase", step):
+        rc, _, err = await run_cmd_async(cmd, dry_run, timeout=CMD_TIMEOUTS["pkg"], capture_stdout=False)
+    if rc not in (-1, 0):
+        issues.append({
+            "category": category,
+            "cmd": cmd,
+            "rc": rc,
+            "stderr": err,
+        })
+        return False
+    if journal is not None and not dry_run:
+        journal.mark(step)
+    return True
+
+
+async def pkg_update_and_list(
+    pkg_cmd: str,
+    dry_run: bool,
+    cache: Optional[Dict[str, Any]] = None,
+    journal: Optional[StepJournal] = None,
+    upgrade: bool = True,
+    update: bool = True,
+    offline: bool = False,
+) -> Tuple[List[Dict[str, str]], List[Dict[str, Any]]]:
+    """
+    Spustí pkg update/upgrade a zjistí nainstalované balíčky.
+    S upgrade=False jen zjistí nainstalované balíčky (--inventory-only).
+    S update=False se `pkg update` přeskočí (volající ho už spustil).
+    S offline=True se upgrade instaluje jen z APT_ARCHIVES
+    (`apt-get --no-download full-upgrade`, viz apt_prefetch); když to
+    selže, nahlásí se issue "pkg_offline_install" a zkusí se běžné `pkg upgrade`.
+
+    S journal se update/upgrade dokončené v přerušeném běhu přeskočí
+    a úspěšně dokončené kroky se do žurnálu zapíší.
+
+    U pkg/apt se seznam čte přímo z DPKG_STATUS (read_dpkg_status),
+    `list-installed` je jen fallback pro jiné správce / nečitelnou databázi.
+    Pokud je předána cache a otisk DPKG_STATUS se od minula nezměnil,
+    list-installed se přeskočí a použije se uložený seznam.
+
+    Vrací:
+        (packages, issues)
+        packages: [{name, version, architecture, installed_size}]
+                  (z list-installed fallbacku jen [{name, version}])
+        issues : list dictů s category/cmd/rc/stderr
+    """
+    issues: List[Dict[str, Any]] = []
+
+    if upgrade and update:
+        await _pkg_step("pkg.update", "pkg_update", [pkg_cmd, "update", "-y"], dry_run, journal, issues)
+    if upgrade and offline:
+        offline_issues: List[Dict[str, Any]] = []
+        cmd = ["apt-get", "-y", "--no-download", "full-upgrade"]
+        if not await _pkg_step("pkg.upgrade", "pkg_upgrade", cmd, dry_run, journal, offline_issues):
+            logger.warning("Offline install from the apt cache failed, retrying online")
+            issues.extend(dict(it, category="pkg_offline_install") for it in offline_issues)
+            offline = False
+    if upgrade and not offline:
+        await _pkg_step("pkg.upgrade", "pkg_upgrade", [pkg_cmd, "upgrade", "-y"], dry_run, journal, issues)
+
+    with timed("phase", "pkg.list"):
+        packages = await _pkg_list_installed(pkg_cmd, dry_run, cache, issues)
+    return packages, issues
+
+
+# Balíčky, jejichž upgrade mění interpret venv – venv upgrade pak čeká na instalaci
+APT_PYTHON_PACKAGES = frozenset(("python", "python3"))
+
+
+# "Inst bash [5.2.15-1] (5.2.21-1 stable [aarch64])"; u nové instalace chybí [stará verze]
+_APT_INST_RE = r"^Inst (\S+) (?:\[(\S+)\] )?\((\S+)"
+
+
+async def apt_upgrade_plan(dry_run: bool) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    `apt-get -s full-upgrade` – balíčky, které upgrade nainstaluje.
+
+    Vrací ([{name, current, target}], issue); current je None u balíčku,
+    který se instaluje nově (nová závislost).
+    """
+    cmd = ["apt-get", "-s", "full-upgrade"]
+    rc, out, err = await run_cmd_async(cmd, dry_run, timeout=CMD_TIMEOUTS["pkg"])
+    if rc == -1:
+        return [], None
+    if rc != 0:
+        return [], {"category": "apt_plan", "cmd": cmd, "rc": rc, "stderr": err}
+    plan: List[Dict[str, Any]] = []
+    inst = _regex(_APT_INST_RE)
+    for line in out.splitlines():
+        m = inst.match(line)
+        if m:
+            plan.append({"name": m.group(1), "current": m.group(2), "target": m.group(3)})
+    return plan, None
+
+
+async def apt_download_sizes(dry_run: bool) -> Tuple[Dict[str, int], Optional[Dict[str, Any]]]:
+    """
+    `apt-get --print-uris full-upgrade` – {balíček: bajtů ke stažení}.
+
+    Balíčky, které už jsou v APT_ARCHIVES, apt nevypíše (nic se nestahuje).
+    """
+    cmd = ["apt-get", "-y", "--print-uris", "full-upgrade"]
+    rc, out, err = await run_cmd_async(cmd, dry_run, timeout=CMD_TIMEOUTS["pkg"])
+    if rc == -1:
+        return {}, None
+    if rc != 0:
+        return {}, {"category": "apt_plan", "cmd": cmd, "rc": rc, "stderr": err}
+    sizes: Dict[str, int] = {}
+    for line in out.splitlines():
+        # 'https://.../bash_5.2.21-1_aarch64.deb' bash_5.2.21-1_aarch64.deb 1234 SHA256:...
+        parts = line.split()
+        if len(parts) >= 3 and parts[0].startswith("'") and parts[2].isdigit():
+            sizes[parts[1].split("_")[0]] = int(parts[2])
+    return sizes, None
+
+
+def _archive_sizes(path: str = APT_ARCHIVES) -> Dict[str, int]:
+    try:
+        return {e.name: e.stat().st_size for e in os.scandir(path) if e.name.endswith(".deb")}
+    except OSError:
+        return {}
+
+
+async def apt_prefetch(
+    dry_run: bool,
+    journal: Optional[StepJournal],
+    issues: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    """
+    `apt-get --download-only full-upgrade` do APT_ARCHIVES (bez instalace).
+
+    Vrací {ok, files, bytes, seconds}; bytes = velikost nově stažených .deb.
+    """
+    before = _archive_sizes()
+    t0 = time.perf_counter()
+    ok = await _pkg_step(
+        "pkg.prefetch", "pkg_prefetch", ["apt-get", "-y", "--download-only", "full-upgrade"],
+        dry_run, journal, issues,
+    )
+    seconds = time.perf_counter() - t0
+    fetched = {n: size for n, size in _archive_sizes().items() if before.get(n) != size}
+    return {"ok": ok, "files": len(fetched), "bytes": sum(fetched.values()), "seconds": round(seconds, 3)}
+
+
+async def _pkg_list_installed(
+    pkg_cmd: str,
+    dry_run: bool,
+    cache: Optional[Dict[str, Any]],
+    issues: List[Dict[str, Any]],
+) -> List[Dict[str, Any]]:
+    """Seznam nainstalovaných balíčků pro pkg_update_and_list (cache -> dpkg -> list-installed)."""
+    packages: List[Dict[str, Any]] = []
+
+    # pokud se dpkg databáze nezměnila, stačí cache
+    cache_key = "pkg:" + pkg_cmd
+    fingerprint = path_fingerprint([DPKG_STATUS]) if pkg_cmd in ("pkg", "apt") else None
+    cached = cache_get(cache, cache_key, fingerprint)
+    if cached is not None:
+        logger.debug("Package list unchanged since last run, using cache")
+        return cached
+
+    if fingerprint is not None:
+        dpkg_pkgs = read_dpkg_status(DPKG_STATUS)
+        if dpkg_pkgs is not None:
+            cache_put(cache, cache_key, fingerprint, dpkg_pkgs)
+            return dpkg_pkgs
+
+    rc_list, out_list, err_list = await run_cmd_async(
+        [pkg_cmd, "list-installed"], dry_run, timeout=CMD_TIMEOUTS["pkg"]
+    )
+    if rc_list in (-1, 0):
+        if not dry_run:
+            for line in out_list.splitlines():
+                # formát apt: "name/repo,now 1.2-3 aarch64 [installed]"
+                parts = line.split()
+                if not parts or parts[0].startswith("Listing"):
+                    continue
+                token = parts[0]
+                if "/" in token:
+                    name = token.split("/")[0]
+                    version = parts[1] if len(parts) > 1 else "unknown"
                 elif "-" in token:
                     i = token.rfind("-")
                     name = token[:i]
@@ -302,245 +2004,3854 @@ def pkg_update_and_list(pkg_cmd: str, dry_run: bool) -> Tuple[List[Dict[str, str
                     name = token
                     version = "unknown"
                 packages.append({"name": name, "version": version})
+            cache_put(cache, cache_key, fingerprint, packages)
+    else:
+        issues.append({
+            "category": "pkg_list",
+            "cmd": [pkg_cmd, "list-installed"],
+            "rc": rc_list,
+            "stderr": err_list,
+        })
+
+    return packages
+
+
+async def pip_list(pip_exe: str, dry_run: bool) -> Tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]:
+    """
+    `pip list --format=json`
+    """
+    cmd = [pip_exe, "list", "--format=json"]
+    rc, out, err = await run_cmd_async(cmd, dry_run, timeout=CMD_TIMEOUTS["pip"])
+    if rc in (-1, 0):
+        if dry_run:
+            return [], None
+        try:
+            data = json.loads(out)
+        except Exception as e:
+            return [], {
+                "category": "pip_list_parse",
+                "cmd": cmd,
+                "rc": rc,
+                "stderr": f"parse error: {e}; raw: {out[:200]}",
+            }
+        pkgs = [{"name": p.get("name"), "version": p.get("version")} for p in data]
+        return pkgs, None
+
+    return [], {"category": "pip_exec", "cmd": cmd, "rc": rc, "stderr": err}
+
+
+PIP_UPGRADE_CHUNK = 20
+
+
+async def pip_outdated(pip_exe: str, dry_run: bool) -> Tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]:
+    """
+    `pip list --outdated --format=json`
+
+    Vrací ([{name, version, latest_version}], issue).
+    """
+    cmd = [pip_exe, "list", "--outdated", "--format=json"]
+    rc, out, err = await run_cmd_async(cmd, dry_run, timeout=CMD_TIMEOUTS["pip"])
+    if rc in (-1, 0):
+        if dry_run:
+            return [], None
+        try:
+            data = json.loads(out)
+        except Exception as e:
+            return [], {
+                "category": "pip_outdated_parse",
+                "cmd": cmd,
+                "rc": rc,
+                "stderr": f"parse error: {e}; raw: {out[:200]}",
+            }
+        pkgs = [
+            {"name": p.get("name"), "version": p.get("version"), "latest_version": p.get("latest_version")}
+            for p in data
+            if p.get("name")
+        ]
+        return pkgs, None
+
+    return [], {"category": "pip_exec", "cmd": cmd, "rc": rc, "stderr": err}
+
+
+async def pip_install_chunked(
+    pip_exe: str,
+    names: List[str],
+    chunk_size: int = PIP_UPGRADE_CHUNK,
+    wheelhouse: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    `pip install --upgrade` po dávkách o velikosti chunk_size.
+
+    Dávky skládá dependency_chunks: balíčky svázané přes Requires-Dist jdou
+    do stejné dávky, aby pip řešil jejich nové verze společně.
+    Když dávka selže, zopakuje se balíček po balíčku, takže jeden rozbitý
+    balíček neshodí ostatní. Vrací issue pro každý balíček, který selhal.
+    S wheelhouse se přidá --find-links, takže už sestavené wheely se použijí
+    místo nového stahování / kompilace.
+    """
+    issues: List[Dict[str, Any]] = []
+    size = chunk_size if chunk_size > 0 else max(1, len(names))
+    base = [pip_exe, "install", "--upgrade"]
+    if wheelhouse and os.path.isdir(wheelhouse):
+        base += ["--find-links", wheelhouse]
+
+    site_dirs = find_site_packages(pip_exe)
+    chunks = await asyncio.to_thread(dependency_chunks, site_dirs, names, size)
+    for chunk in chunks:
+        cmd = base + chunk
+        rc, out, err = await run_cmd_async(cmd, timeout=CMD_TIMEOUTS["pip"])
+        if rc == 0:
+            continue
+        if len(chunk) == 1:
+            issues.append({"category": "pip_upgrade", "cmd": cmd, "rc": rc, "stderr": err, "package": chunk[0].split("==")[0]})
+            continue
+
+        logger.warning("pip upgrade chunk failed (rc=%s), retrying %d packages one by one", rc, len(chunk))
+        for name in chunk:
+            cmd1 = base + [name]
+            rc1, out1, err1 = await run_cmd_async(cmd1, timeout=CMD_TIMEOUTS["pip"])
+            if rc1 != 0:
+                issues.append({"category": "pip_upgrade", "cmd": cmd1, "rc": rc1, "stderr": err1, "package": name.split("==")[0]})
+
+    return issues
+
+
+async def pip_upgrade(
+    pip_exe: str,
+    dry_run: bool,
+    chunk_size: int = PIP_UPGRADE_CHUNK,
+    wheelhouse: Optional[str] = None,
+    outdated: Optional[List[Dict[str, str]]] = None,
+    stats: Optional[Dict[str, Any]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Upgrade zastaralých balíčků (`pip list --outdated`) po dávkách.
+    Používá se jen v režimu D a nikdy s --dry-run.
+
+    S wheelhouse se použijí (a označí jako právě použité) už sestavené
+    wheely a po upgradu se do wheelhouse převezmou nově sestavené wheely
+    z pip cache.
+
+    outdated: hotový plán (výstup pip_outdated jiného, identického venv);
+    pip list --outdated se pak nespouští a instalují se přesně verze
+    z plánu (jméno==latest_version).
+
+    stats: dict (typicky záznam z timed), do kterého se zapíše počet
+    instalovaných balíčků ("packages") a nově sestavených wheelů ("built")
+    – z nich learn_upgrade_stats odhaduje dobu příštích upgradů.
+
+    Vrací seznam issues (prázdný = vše v pořádku).
+    """
+    if dry_run:
+        return []
+
+    if outdated is None:
+        outdated, issue = await pip_outdated(pip_exe, dry_run=False)
+        if issue:
+            return [issue]
+        names = [p["name"] for p in outdated]
+    else:
+        names = [
+            f"{p['name']}=={p['latest_version']}" if p.get("latest_version") else p["name"]
+            for p in outdated
+        ]
+
+    if not names:
+        logger.debug("No outdated packages for %s", pip_exe)
+        return []
+
+    logger.info("Upgrading %d outdated packages via %s", len(names), pip_exe)
+    if wheelhouse:
+        touch_wheels(wheelhouse, [(p["name"], p.get("latest_version")) for p in outdated])
+    issues = await pip_install_chunked(pip_exe, names, chunk_size, wheelhouse)
+    harvested = 0
+    if wheelhouse:
+        harvested = await asyncio.to_thread(harvest_pip_wheels, PIP_CACHE, wheelhouse)
+        if harvested:
+            logger.info("Added %d built wheels to wheelhouse %s", harvested, wheelhouse)
+    if stats is not None:
+        stats.update({"packages": len(names), "built": harvested})
+    return issues
+
+# -------------------------------------------------------------
+# Wheelhouse – sdílené wheely pro všechny venv
+# -------------------------------------------------------------
+
+def wheel_project(filename: str) -> Tuple[str, str]:
+    """(kanonické jméno, verze) z názvu wheel souboru."""
+    parts = filename[:-4].split("-") if filename.endswith(".whl") else [filename]
+    name = canonical_pkg_name(parts[0])
+    version = parts[1] if len(parts) > 1 else ""
+    return name, version
+
+
+def _wheel_ok(path: str) -> bool:
+    """Je soubor čitelný zip s *.dist-info/METADATA (tj. nepoškozený wheel)?"""
+    import zipfile
+
+    try:
+        with zipfile.ZipFile(path) as zf:
+            return any(n.endswith(".dist-info/METADATA") for n in zf.namelist()) and zf.testzip() is None
+    except (OSError, zipfile.BadZipFile):
+        return False
+
+
+def harvest_pip_wheels(pip_cache: str = PIP_CACHE, wheelhouse: str = WHEELHOUSE) -> int:
+    """
+    Převezme lokálně sestavené wheely z <pip_cache>/wheels do wheelhouse.
+
+    Soubor se do wheelhouse hardlinkuje (fallback kopie), takže mazání pip
+    cache wheelhouse nepoškodí. Vrací počet nově přidaných wheelů.
+    """
+    src_root = os.path.join(pip_cache, "wheels")
+    if not os.path.isdir(src_root):
+        return 0
+    os.makedirs(wheelhouse, exist_ok=True)
+    have = set(os.listdir(wheelhouse))
+
+    added = 0
+    for dirpath, _dirs, files in os.walk(src_root):
+        for fn in files:
+            if not fn.endswith(".whl") or fn in have:
+                continue
+            src = os.path.join(dirpath, fn)
+            if not _wheel_ok(src):
+                continue
+            dst = os.path.join(wheelhouse, fn)
+            try:
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    shutil.copy2(src, dst)
+                os.utime(dst)
+            except OSError as e:
+                logger.debug("Unable to add %s to wheelhouse: %s", fn, e)
+                continue
+            have.add(fn)
+            added += 1
+    return added
+
+
+def touch_wheels(wheelhouse: str, wanted: List[Tuple[str, Optional[str]]]) -> None:
+    """Označí wheely (jméno, verze) jako právě použité – řídí LRU v prune_wheelhouse."""
+    try:
+        files = os.listdir(wheelhouse)
+    except OSError:
+        return
+    keys = {(canonical_pkg_name(n), v) for n, v in wanted}
+    names = {k for k, _ in keys}
+    for fn in files:
+        name, version = wheel_project(fn)
+        if name in names and ((name, version) in keys or (name, None) in keys):
+            try:
+                os.utime(os.path.join(wheelhouse, fn))
+            except OSError:
+                pass
+
+
+def prune_wheelhouse(
+    wheelhouse: str = WHEELHOUSE,
+    max_bytes: int = WHEELHOUSE_MAX_MB * 1024 * 1024,
+    max_age: float = WHEELHOUSE_MAX_AGE,
+    verify: bool = False,
+) -> Dict[str, Any]:
+    """
+    Úklid wheelhouse: smaže wheely nepoužité déle než max_age, s verify=True
+    i poškozené, a pak nejdéle nepoužité (LRU podle mtime), dokud celková
+    velikost nepřesahuje max_bytes.
+
+    Vrací {"removed": [jména souborů], "freed": bajty, "size": zbylá velikost}.
+    """
+    removed: List[str] = []
+    freed = 0
+    try:
+        names = [fn for fn in os.listdir(wheelhouse) if fn.endswith(".whl")]
+    except OSError:
+        return {"removed": removed, "freed": 0, "size": 0}
+
+    now = time.time()
+    alive: List[Tuple[float, int, str]] = []
+    for fn in names:
+        path = os.path.join(wheelhouse, fn)
+        try:
+            st = os.stat(path)
+        except OSError:
+            continue
+        if now - st.st_mtime > max_age or (verify and not _wheel_ok(path)):
+            try:
+                os.remove(path)
+                removed.append(fn)
+                freed += st.st_size
+            except OSError:
+                pass
+            continue
+        alive.append((st.st_mtime, st.st_size, fn))
+
+    total = sum(size for _, size, _ in alive)
+    alive.sort()
+    for mtime, size, fn in alive:
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(wheelhouse, fn))
+        except OSError:
+            continue
+        removed.append(fn)
+        freed += size
+        total -= size
+
+    return {"removed": removed, "freed": freed, "size": total}
+
+
+def prune_pip_cache(pip_cache: str = PIP_CACHE, max_age: float = WHEELHOUSE_MAX_AGE) -> Dict[str, int]:
+    """
+    Šetrný úklid pip cache (místo smazání celé cache v repair):
+    smaže poškozené wheely a soubory starší než max_age, pak prázdné adresáře.
+
+    Vrací {"removed": počet souborů, "freed": bajty}.
+    """
+    removed = freed = 0
+    now = time.time()
+    for dirpath, _dirs, files in os.walk(pip_cache, topdown=False):
+        for fn in files:
+            path = os.path.join(dirpath, fn)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            stale = now - st.st_mtime > max_age
+            corrupt = fn.endswith(".whl") and not _wheel_ok(path)
+            if stale or corrupt:
+                try:
+                    os.remove(path)
+                    removed += 1
+                    freed += st.st_size
+                except OSError:
+                    pass
+        if dirpath != pip_cache:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+    return {"removed": removed, "freed": freed}
+
+# -------------------------------------------------------------
+# Inventář přímo ze site-packages (bez spouštění pip)
+# -------------------------------------------------------------
+
+INVENTORY_BACKENDS = ("metadata", "pip")
+
+_PY_VERSION_RE = r"python(\d+\.\d+)"
+
+
+def canonical_pkg_name(name: str) -> str:
+    """Normalizace jména distribuce dle PEP 503 (pro deduplikaci a řazení)."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def _pip_python_version(pip_exe: str) -> Optional[str]:
+    """
+    Zjistí verzi Pythonu ("3.11"), ke které pip patří.
+
+    Nejdřív zkusí pyvenv.cfg (venv), potom shebang pip skriptu.
+    """
+    prefix = os.path.dirname(os.path.dirname(pip_exe))
+    cfg = os.path.join(prefix, "pyvenv.cfg")
+    try:
+        with open(cfg, "r", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition("=")
+                if key.strip() in ("version", "version_info"):
+                    parts = value.strip().split(".")
+                    if len(parts) >= 2:
+                        return parts[0] + "." + parts[1]
+    except OSError:
+        pass
+
+    try:
+        with open(pip_exe, "r", encoding="utf-8", errors="replace") as f:
+            shebang = f.readline()
+    except OSError:
+        return None
+    m = _regex(_PY_VERSION_RE).search(shebang)
+    return m.group(1) if m else None
+
+
+def find_site_packages(pip_exe: str, include_user: bool = False) -> List[str]:
+    """
+    Najde site-packages adresáře, které vidí daný pip.
+
+    venv:   <venv>/lib/pythonX.Y/site-packages
+    system: <prefix>/lib/pythonX.Y/site-packages (+ ~/.local pokud include_user)
+
+    Pokud nejde jednoznačně určit verzi Pythonu, nebo venv vidí i systémové
+    site-packages, vrátí prázdný seznam (volající pak použije pip_list).
+    """
+    import glob
+
+    venv_prefix = os.path.dirname(os.path.dirname(pip_exe))
+    cfg = os.path.join(venv_prefix, "pyvenv.cfg")
+    if os.path.isfile(cfg):
+        try:
+            with open(cfg, "r", encoding="utf-8") as f:
+                if re.search(r"^include-system-site-packages\s*=\s*true", f.read(), re.M | re.I):
+                    return []
+        except OSError:
+            return []
+        prefixes = [venv_prefix]
+    else:
+        prefixes = [os.path.dirname(os.path.dirname(os.path.realpath(pip_exe)))]
+        if include_user:
+            prefixes.append(os.path.join(HOME, ".local"))
+
+    pyver = _pip_python_version(pip_exe)
+    dirs: List[str] = []
+    for prefix in prefixes:
+        cands = sorted(glob.glob(os.path.join(prefix, "lib", "python*", "site-packages")))
+        if pyver:
+            cands = [c for c in cands if os.path.basename(os.path.dirname(c)) == "python" + pyver]
+        elif len(cands) > 1:
+            return []
+        dirs.extend(cands)
+    return dirs
+
+
+def _read_metadata_headers(path: str) -> Optional[Tuple[str, str]]:
+    """Přečte jen hlavičky Name/Version z METADATA / PKG-INFO souboru."""
+    name = version = None
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    break
+                if line.startswith("Name:"):
+                    name = line[5:].strip()
+                elif line.startswith("Version:"):
+                    version = line[8:].strip()
+                if name and version:
+                    break
+    except OSError:
+        return None
+    if not name or not version:
+        return None
+    return name, version
+
+
+def _read_requires_dist(path: str) -> List[str]:
+    """Jména distribucí z hlaviček Requires-Dist (bez závislostí podmíněných extra)."""
+    names: List[str] = []
+    try:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            for line in f:
+                if not line.strip():
+                    break
+                if not line.startswith("Requires-Dist:"):
+                    continue
+                spec, _, marker = line[14:].partition(";")
+                if "extra" in marker:
+                    continue
+                m = re.match(r"\s*([A-Za-z0-9][A-Za-z0-9._-]*)", spec)
+                if m:
+                    names.append(m.group(1))
+    except OSError:
+        pass
+    return names
+
+
+def dependency_chunks(site_dirs: List[str], names: List[str], size: int) -> List[List[str]]:
+    """
+    Rozdělí names (jména nebo jméno==verze) do dávek pro pip install.
+
+    Balíčky, které na sebe přes Requires-Dist v site_dirs (přímo nebo
+    přes jiný balíček z names) odkazují, tvoří skupinu a skupina se nikdy
+    nedělí mezi dávky; skupiny se do dávek skládají v pořadí names až do
+    velikosti size. Skupina větší než size tvoří vlastní dávku. Balíčky
+    bez čitelných metadat jsou samostatné skupiny.
+    """
+    keys = [canonical_pkg_name(n.split("==")[0]) for n in names]
+    wanted = set(keys)
+    parent = {k: k for k in keys}
+
+    def _root(k: str) -> str:
+        while parent[k] != k:
+            parent[k] = parent[parent[k]]
+            k = parent[k]
+        return k
+
+    for site in site_dirs:
+        try:
+            entries = os.listdir(site)
+        except OSError:
+            continue
+        for entry in entries:
+            if not entry.endswith(".dist-info"):
+                continue
+            key = canonical_pkg_name(entry[: -len(".dist-info")].rsplit("-", 1)[0])
+            if key not in wanted:
+                continue
+            for dep in _read_requires_dist(os.path.join(site, entry, "METADATA")):
+                dep_key = canonical_pkg_name(dep)
+                if dep_key in wanted:
+                    parent[_root(dep_key)] = _root(key)
+
+    groups: Dict[str, List[str]] = {}
+    for name, key in zip(names, keys):
+        groups.setdefault(_root(key), []).append(name)
+
+    chunks: List[List[str]] = []
+    chunk: List[str] = []
+    for group in groups.values():
+        if chunk and len(chunk) + len(group) > size:
+            chunks.append(chunk)
+            chunk = []
+        chunk = chunk + group
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def read_site_packages(site_dirs: List[str]) -> Optional[List[Dict[str, str]]]:
+    """
+    Sestaví seznam balíčků z *.dist-info/METADATA a *.egg-info v site_dirs.
+
+    Vrací stejné schéma jako pip_list ([{name, version}], seřazeno dle jména),
+    nebo None, pokud některá metadata nejdou přečíst.
+    """
+    import glob
+
+    seen: Dict[str, Dict[str, str]] = {}
+
+    for site in site_dirs:
+        try:
+            entries = sorted(os.listdir(site))
+        except OSError:
+            return None
+
+        for entry in entries:
+            full = os.path.join(site, entry)
+            if entry.endswith(".dist-info"):
+                meta = os.path.join(full, "METADATA")
+            elif entry.endswith(".egg-info"):
+                meta = os.path.join(full, "PKG-INFO") if os.path.isdir(full) else full
+            elif entry.endswith(".egg-link"):
+                try:
+                    with open(full, "r", encoding="utf-8") as f:
+                        project = f.readline().strip()
+                except OSError:
+                    return None
+                infos = glob.glob(os.path.join(project, "*.egg-info", "PKG-INFO"))
+                if not infos:
+                    return None
+                meta = infos[0]
+            else:
+                continue
+
+            parsed = _read_metadata_headers(meta)
+            if parsed is None:
+                return None
+            name, version = parsed
+            key = canonical_pkg_name(name)
+            if key not in seen:
+                seen[key] = {"name": name, "version": version}
+
+    return [seen[k] for k in sorted(seen)]
+
+
+async def inventory_list(
+    pip_exe: str,
+    dry_run: bool,
+    backend: str = "metadata",
+    include_user: bool = False,
+) -> Tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]:
+    """
+    Inventář jednoho pipu (system / venv).
+
+    backend 'metadata' čte site-packages přímo v procesu (v pracovním vlákně,
+    jen čtení, běží i s --dry-run); pokud site-packages nejdou najít nebo
+    přečíst, použije se pip_list. Backend 'pip' volá rovnou pip_list.
+    """
+    if backend == "metadata":
+        site_dirs = find_site_packages(pip_exe, include_user=include_user)
+        if site_dirs:
+            pkgs = await asyncio.to_thread(read_site_packages, site_dirs)
+            if pkgs is not None:
+                return pkgs, None
+        logger.debug("Metadata inventory unavailable for %s, falling back to pip list", pip_exe)
+    return await pip_list(pip_exe, dry_run)
+
+# -------------------------------------------------------------
+# Kompaktní reprezentace seznamů balíčků
+# -------------------------------------------------------------
+
+class PackageTable:
+    """
+    Sdílená tabulka hodnot pro seznamy balíčků (jméno, verze, architektura...).
+
+    Každá hodnota je v tabulce jen jednou (řetězce navíc sys.intern), záznam
+    seznamu je řada indexů v array('I') podle n-tice polí. Stejná jména
+    a verze v mnoha venv tak zabírají místo jednou a seznam o tisících
+    balíčků je jedno pole čísel místo tisíců dictů. Hodnoty musí být
+    skaláry (str / int / float / None); index 0 znamená chybějící pole.
+    """
+
+    __slots__ = ("values", "_lookup")
+
+    def __init__(self, values: Optional[List[Any]] = None) -> None:
+        self.values: List[Any] = [None]
+        self._lookup: Dict[Tuple[type, Any], int] = {}
+        for value in (values or [None])[1:]:
+            self.values.append(sys.intern(value) if isinstance(value, str) else value)
+            self._lookup[(type(value), value)] = len(self.values) - 1
+
+    def index(self, value: Any) -> int:
+        key = (type(value), value)  # 1 a True / "1" se nesmí slít
+        i = self._lookup.get(key)
+        if i is None:
+            i = self._lookup[key] = len(self.values)
+            self.values.append(sys.intern(value) if isinstance(value, str) else value)
+        return i
+
+    def pack(self, records: List[Dict[str, Any]]) -> Tuple[Tuple[str, ...], array]:
+        """[{pole: hodnota}] -> (pole, array indexů po řádcích)."""
+        from array import array
+
+        fields = tuple(dict.fromkeys(k for r in records for k in r))
+        rows = array("I")
+        for r in records:
+            rows.extend(self.index(r[f]) if f in r else 0 for f in fields)
+        return fields, rows
+
+    def unpack(self, fields: Tuple[str, ...], rows: array) -> List[Dict[str, Any]]:
+        """Opak pack(): nové dicty (volající je smí měnit)."""
+        values, width = self.values, len(fields)
+        if not width:
+            return []
+        return [
+            {f: values[i] for f, i in zip(fields, rows[j : j + width]) if i}
+            for j in range(0, len(rows), width)
+        ]
+
+
+class CompactInventory:
+    """
+    Inventář (výstup build_inventory_and_issues) s balíčky v PackageTable.
+
+    Pro data držená v paměti dlouho (InventoryDaemon): místo dictu na balíček
+    drží každý zdroj jen (pole, array). expand() vrátí běžný inventář.
+    """
+
+    __slots__ = ("table", "meta", "sources", "venvs")
+
+    def __init__(self, inventory: Dict[str, Any]) -> None:
+        self.table = PackageTable()
+        self.meta = {k: (None if k in ("pkg", "system_pip", "venvs") else v) for k, v in inventory.items()}
+        self.sources = {src: self.table.pack(inventory.get(src, [])) for src in ("pkg", "system_pip")}
+        self.venvs: Dict[str, Tuple[Dict[str, Any], Tuple[Tuple[str, ...], array]]] = {}
+        for vname, entry in inventory.get("venvs", {}).items():
+            info = {k: (None if k == "packages" else v) for k, v in entry.items()}
+            self.venvs[vname] = (info, self.table.pack(entry["packages"]))
+
+    @staticmethod
+    def _count(packed: Tuple[Tuple[str, ...], array]) -> int:
+        fields, rows = packed
+        return len(rows) // len(fields) if fields else 0
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            "pkg": self._count(self.sources["pkg"]),
+            "system_pip": self._count(self.sources["system_pip"]),
+            "venvs": len(self.venvs),
+        }
+
+    def expand(self) -> Dict[str, Any]:
+        inventory = dict(self.meta)
+        for src, packed in self.sources.items():
+            inventory[src] = self.table.unpack(*packed)
+        inventory["venvs"] = {
+            vname: dict(info, packages=self.table.unpack(*packed))  # pořadí klíčů zůstane
+            for vname, (info, packed) in self.venvs.items()
+        }
+        return inventory
+
+# -------------------------------------------------------------
+# Inkrementální cache inventáře
+# -------------------------------------------------------------
+
+def path_fingerprint(paths: List[str]) -> Optional[List[List[Any]]]:
+    """
+    Otisk souborů/adresářů: [[path, mtime_ns, size], ...].
+
+    Vrací None, pokud seznam je prázdný nebo některá cesta neexistuje
+    (takový výsledek se necachuje).
+    """
+    if not paths:
+        return None
+    fp: List[List[Any]] = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        fp.append([path, st.st_mtime_ns, st.st_size])
+    return fp
+
+
+def load_inventory_cache(path: str = INVENTORY_CACHE) -> Dict[str, Any]:
+    """
+    Načte cache inventáře; při chybě nebo jiné verzi formátu vrátí prázdnou.
+
+    Na disku jsou balíčky v kompaktní podobě PackageTable: společná tabulka
+    "values" a u každého záznamu "fields" + "rows" (indexy).
+    """
+    from array import array
+
+    empty: Dict[str, Any] = {"version": INVENTORY_CACHE_VERSION, "table": PackageTable(), "entries": {}}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return empty
+    if not isinstance(data, dict) or data.get("version") != INVENTORY_CACHE_VERSION:
+        return empty
+    if not isinstance(data.get("entries"), dict) or not isinstance(data.get("values"), list):
+        return empty
+    try:
+        table = PackageTable(data["values"])
+        entries = {
+            key: {
+                "fingerprint": e["fingerprint"],
+                "stored": e["stored"],
+                "packages": (tuple(e["fields"]), array("I", e["rows"])),
+            }
+            for key, e in data["entries"].items()
+        }
+    except (KeyError, TypeError, OverflowError):
+        return empty
+    return {"version": INVENTORY_CACHE_VERSION, "table": table, "entries": entries}
+
+
+def cache_get(
+    cache: Optional[Dict[str, Any]],
+    key: str,
+    fingerprint: Optional[List[List[Any]]],
+) -> Optional[List[Dict[str, str]]]:
+    """Vrátí uložené balíčky pro key, pokud otisk stále sedí."""
+    if cache is None or fingerprint is None:
+        return None
+    entry = cache["entries"].get(key)
+    if not entry or entry.get("fingerprint") != fingerprint:
+        return None
+    if time.time() - entry.get("stored", 0) > INVENTORY_CACHE_MAX_AGE:
+        return None
+    return cache["table"].unpack(*entry["packages"])
+
+
+def cache_put(
+    cache: Optional[Dict[str, Any]],
+    key: str,
+    fingerprint: Optional[List[List[Any]]],
+    packages: List[Dict[str, str]],
+) -> None:
+    if cache is None or fingerprint is None:
+        return
+    cache["entries"][key] = {
+        "fingerprint": fingerprint,
+        "stored": time.time(),
+        "packages": cache["table"].pack(packages),
+    }
+
+
+def save_inventory_cache(cache: Dict[str, Any], path: str = INVENTORY_CACHE) -> None:
+    """
+    Uloží cache inventáře (atomicky, bez odsazení).
+
+    Zahodí záznamy starší než INVENTORY_CACHE_MAX_AGE a ponechá nejvýše
+    INVENTORY_CACHE_MAX_ENTRIES nejnovějších. Tabulka hodnot se sestaví
+    znovu jen z ponechaných záznamů, takže neroste donekonečna.
+    """
+    now = time.time()
+    entries = [
+        (k, v) for k, v in cache["entries"].items()
+        if now - v.get("stored", 0) <= INVENTORY_CACHE_MAX_AGE
+    ]
+    entries.sort(key=lambda kv: kv[1].get("stored", 0), reverse=True)
+    cache["entries"] = dict(entries[:INVENTORY_CACHE_MAX_ENTRIES])
+
+    table = PackageTable()
+    out_entries: Dict[str, Any] = {}
+    for key, e in cache["entries"].items():
+        fields, rows = table.pack(cache["table"].unpack(*e["packages"]))
+        out_entries[key] = {"fingerprint": e["fingerprint"], "stored": e["stored"], "fields": fields, "rows": rows.tolist()}
+    data = {"version": INVENTORY_CACHE_VERSION, "values": table.values, "entries": out_entries}
+
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.debug("Unable to write inventory cache %s: %s", path, e)
+
+# -------------------------------------------------------------
+# Skupiny venv – klony se stejným interpretem a sadou balíčků
+# -------------------------------------------------------------
+
+def venv_base_interpreter(pip_exe: str) -> str:
+    """
+    Základní interpret venv: "home" + "version" z pyvenv.cfg.
+
+    Bez pyvenv.cfg (conda, starý layout) se použije realpath bin/python.
+    """
+    prefix = os.path.dirname(os.path.dirname(pip_exe))
+    home = version = ""
+    try:
+        with open(os.path.join(prefix, "pyvenv.cfg"), "r", encoding="utf-8") as f:
+            for line in f:
+                key, _, value = line.partition("=")
+                key = key.strip()
+                if key == "home":
+                    home = value.strip()
+                elif key in ("version", "version_info"):
+                    version = value.strip()
+    except OSError:
+        pass
+    if home:
+        return f"{home} ({version})" if version else home
+    return os.path.realpath(os.path.join(prefix, "bin", "python"))
+
+
+def venv_fingerprint(pip_exe: str, pkgs: List[Dict[str, Any]]) -> str:
+    """Otisk venv: základní interpret + hash seřazených "jméno==verze"."""
+    import hashlib
+
+    h = hashlib.sha256(venv_base_interpreter(pip_exe).encode("utf-8"))
+    for line in sorted(f"{canonical_pkg_name(p['name'])}=={p.get('version', '')}" for p in pkgs):
+        h.update(b"\n" + line.encode("utf-8"))
+    return h.hexdigest()[:16]
+
+
+def group_venvs(venvs: Dict[str, Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Seskupí venv z inventáře podle venv_fingerprint.
+
+    Venv s chybou inventáře (issue) tvoří vždy samostatnou skupinu,
+    protože jeho sada balíčků není známá. Vrací
+    [{fingerprint, base, members: [jméno, ...], packages}] seřazené podle
+    prvního člena; první člen je "leader", na kterém se řeší plán upgradu.
+    """
+    groups: Dict[str, Dict[str, Any]] = {}
+    for vname in sorted(venvs):
+        entry = venvs[vname]
+        if entry.get("error"):
+            fp = "error:" + vname
+        else:
+            fp = venv_fingerprint(entry["pip"], entry["packages"])
+        group = groups.get(fp)
+        if group is None:
+            group = groups[fp] = {
+                "fingerprint": fp,
+                "base": venv_base_interpreter(entry["pip"]),
+                "members": [],
+                "packages": len(entry["packages"]),
+            }
+        group["members"].append(vname)
+        entry["group"] = fp
+    return sorted(groups.values(), key=lambda g: g["members"][0])
+
+# -------------------------------------------------------------
+# Porovnání verzí
+# -------------------------------------------------------------
+
+_VERSION_TOKEN_RE = r"\d+|[A-Za-z]+|~"
+_PRERELEASE_TOKENS = frozenset(("~", "dev", "a", "alpha", "b", "beta", "c", "rc", "pre", "preview"))
+
+
+@functools.lru_cache(maxsize=8192)
+def _version_tokens(version: str) -> Tuple[int, List[Tuple[int, Any]]]:
+    """
+    (epoch, tokeny) – čísla (2, n), písmena (1, s), pre-release (-1, s).
+    Koncové nuly úvodní číselné části (release segment) se zahodí, takže
+    1.0 a 1.0.0 mají stejné tokeny (PEP 440 doplňuje release nulami).
+    Výsledek je cachovaný a sdílený – volající ho nesmí měnit.
+    """
+    epoch = 0
+    head, sep, rest = version.partition(":")
+    if sep and head.isdigit():
+        epoch, version = int(head), rest
+    tokens: List[Tuple[int, Any]] = []
+    raw = _regex(_VERSION_TOKEN_RE).findall(version.lower())
+    for i, tok in enumerate(raw):
+        if tok.isdigit():
+            tokens.append((2, int(tok)))
+        elif tok == "~" or (tok in _PRERELEASE_TOKENS and i + 1 < len(raw) and raw[i + 1].isdigit()):
+            # "1.0rc1" je pre-release, ale "1.1.1a" (openssl styl) je novější než 1.1.1
+            tokens.append((-1, tok))
+        else:
+            tokens.append((1, tok))
+    release = next((i for i, t in enumerate(tokens) if t[0] != 2), len(tokens))
+    end = release
+    while end > 1 and tokens[end - 1] == (2, 0):
+        end -= 1
+    if end < release:
+        del tokens[end:release]
+    return epoch, tokens
+
+
+def compare_versions(a: str, b: str) -> int:
+    """
+    Přibližné porovnání verzí pro dpkg i PEP 440 řetězce: -1 / 0 / 1.
+
+    Epocha ("1:") má přednost, pak se porovnávají číselné a textové části;
+    pre-release značky (~, nebo dev/a/b/rc/... následované číslem) jsou menší
+    než konec verze, takže 1.0rc1 < 1.0 == 1.0.0 < 1.0.post1 a 1.1.1 < 1.1.1a.
+    """
+    ea, ta = _version_tokens(a)
+    eb, tb = _version_tokens(b)
+    if ea != eb:
+        return -1 if ea < eb else 1
+    pad = (0, "")
+    for x, y in zip(ta + [pad] * (len(tb) - len(ta)), tb + [pad] * (len(ta) - len(tb))):
+        if x != y:
+            return -1 if x < y else 1
+    return 0
+
+
+version_sort_key = functools.cmp_to_key(compare_versions)
+
+# -------------------------------------------------------------
+# Historie inventářů a diff mezi běhy
+# -------------------------------------------------------------
+
+def inventory_sources(inventory: Dict[str, Any]) -> Dict[str, Dict[str, str]]:
+    """Inventář jako {zdroj: {jméno: verze}}; zdroje pkg, system_pip, venv:<jméno>."""
+    sources: Dict[str, Dict[str, str]] = {
+        "pkg": {p["name"]: p.get("version") or "" for p in inventory.get("pkg", []) if p.get("name")},
+        "system_pip": {p["name"]: p.get("version") or "" for p in inventory.get("system_pip", []) if p.get("name")},
+    }
+    for vname, venv in inventory.get("venvs", {}).items():
+        sources["venv:" + vname] = {
+            p["name"]: p.get("version") or "" for p in venv.get("packages", []) if p.get("name")
+        }
+    return sources
+
+
+def diff_sources(
+    old: Dict[str, Dict[str, str]],
+    new: Dict[str, Dict[str, str]],
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Rozdíl dvou inventářů po zdrojích v lineárním čase (hash index = dict).
+
+    Vrací jen změněné zdroje:
+        {zdroj: {"added": [{name, version}], "removed": [{name, version}],
+                 "upgraded": [{name, from, to}], "downgraded": [...],
+                 "status": "changed" | "new" | "gone"}}
+    """
+    result: Dict[str, Dict[str, Any]] = {}
+    for src in sorted(set(old) | set(new)):
+        before = old.get(src, {})
+        after = new.get(src, {})
+        entry: Dict[str, Any] = {"added": [], "removed": [], "upgraded": [], "downgraded": []}
+        for name, ver in after.items():
+            prev = before.get(name)
+            if prev is None:
+                entry["added"].append({"name": name, "version": ver})
+            elif prev != ver:
+                kind = "downgraded" if compare_versions(ver, prev) < 0 else "upgraded"
+                entry[kind].append({"name": name, "from": prev, "to": ver})
+        for name, ver in before.items():
+            if name not in after:
+                entry["removed"].append({"name": name, "version": ver})
+        if any(entry[k] for k in ("added", "removed", "upgraded", "downgraded")) or (src in old) != (src in new):
+            entry["status"] = "new" if src not in old else "gone" if src not in new else "changed"
+            for k in ("added", "removed", "upgraded", "downgraded"):
+                entry[k].sort(key=lambda e: e["name"])
+            result[src] = entry
+    return result
+
+
+def diff_summary(diff: Dict[str, Dict[str, Any]]) -> Dict[str, int]:
+    return {k: sum(len(e[k]) for e in diff.values()) for k in ("added", "removed", "upgraded", "downgraded")}
+
+
+def load_history(path: str = HISTORY_FILE) -> Dict[str, Any]:
+    """
+    Kompaktní historie inventářů.
+
+    Formát:
+        {"version": 1,
+         "names": [jméno, ...],                       # každé jméno jen jednou
+         "base": {"timestamp", "sources": {zdroj: [[idx, verze], ...]}},
+         "deltas": [{"timestamp", "set": {zdroj: [[idx, verze], ...]},
+                     "del": {zdroj: [idx, ...]}, "gone": [zdroj, ...]}, ...]}
+
+    Každý další snímek je uložen jen jako rozdíl vůči předchozímu.
+    """
+    empty: Dict[str, Any] = {"version": HISTORY_VERSION, "names": [], "base": None, "deltas": []}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return empty
+    if not isinstance(data, dict) or data.get("version") != HISTORY_VERSION:
+        return empty
+    return data
+
+
+def _history_snapshots(history: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Dict[str, str]]]]:
+    """Postupně rekonstruuje snímky (timestamp, {zdroj: {jméno: verze}}) od nejstaršího."""
+    base = history.get("base")
+    if not base:
+        return
+    names = history["names"]
+    state = {src: {names[i]: v for i, v in pairs} for src, pairs in base["sources"].items()}
+    yield base["timestamp"], state
+    for delta in history["deltas"]:
+        state = {src: dict(pkgs) for src, pkgs in state.items()}
+        for src in delta.get("gone", []):
+            state.pop(src, None)
+        for src, idxs in delta.get("del", {}).items():
+            pkgs = state.get(src, {})
+            for i in idxs:
+                pkgs.pop(names[i], None)
+        for src, pairs in delta.get("set", {}).items():
+            pkgs = state.setdefault(src, {})
+            for i, v in pairs:
+                pkgs[names[i]] = v
+        yield delta["timestamp"], state
+
+
+def history_latest(history: Dict[str, Any]) -> Optional[Tuple[str, Dict[str, Dict[str, str]]]]:
+    last = None
+    for snap in _history_snapshots(history):
+        last = snap
+    return last
+
+
+def history_append(
+    history: Dict[str, Any],
+    timestamp: str,
+    sources: Dict[str, Dict[str, str]],
+    keep: int = HISTORY_SIZE,
+) -> None:
+    """Přidá snímek jako delta vůči poslednímu; nejstarší delty se slučují do base."""
+    names: List[str] = history["names"]
+    index = {n: i for i, n in enumerate(names)}
+
+    def _idx(name: str) -> int:
+        i = index.get(name)
+        if i is None:
+            i = index[name] = len(names)
+            names.append(name)
+        return i
+
+    latest = history_latest(history)
+    if latest is None:
+        history["base"] = {
+            "timestamp": timestamp,
+            "sources": {src: [[_idx(n), v] for n, v in sorted(pkgs.items())] for src, pkgs in sources.items()},
+        }
+        history["deltas"] = []
+        return
+
+    _, prev = latest
+    delta: Dict[str, Any] = {"timestamp": timestamp, "set": {}, "del": {}, "gone": sorted(set(prev) - set(sources))}
+    for src, pkgs in sources.items():
+        old = prev.get(src, {})
+        changed = [[_idx(n), v] for n, v in sorted(pkgs.items()) if old.get(n) != v]
+        removed = [_idx(n) for n in sorted(old) if n not in pkgs]
+        if changed:
+            delta["set"][src] = changed
+        if removed:
+            delta["del"][src] = removed
+    history["deltas"].append(delta)
+
+    # max. `keep` snímků: nejstarší deltu "vmícháme" do base
+    while len(history["deltas"]) + 1 > max(1, keep):
+        snaps = _history_snapshots(history)
+        next(snaps)
+        ts, state = next(snaps)
+        history["base"] = {
+            "timestamp": ts,
+            "sources": {src: [[_idx(n), v] for n, v in sorted(pkgs.items())] for src, pkgs in state.items()},
+        }
+        history["deltas"].pop(0)
+
+
+def save_history(history: Dict[str, Any], path: str = HISTORY_FILE) -> None:
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(history, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("Unable to write inventory history %s: %s", path, e)
+
+
+def record_and_diff(
+    inventory: Dict[str, Any],
+    history_path: str = HISTORY_FILE,
+    keep: int = HISTORY_SIZE,
+    record: bool = True,
+) -> Dict[str, Any]:
+    """
+    Porovná inventář s posledním uloženým snímkem, uloží ho do historie
+    a vrátí obsah pro Aktualizator_diff.json. S record=False (--dry-run)
+    se historie nemění.
+    """
+    history = load_history(history_path)
+    sources = inventory_sources(inventory)
+    latest = history_latest(history)
+    if latest is None:
+        prev_ts, diff = None, {}
+    else:
+        prev_ts, prev = latest
+        diff = diff_sources(prev, sources)
+    if record:
+        history_append(history, inventory["timestamp"], sources, keep=keep)
+        save_history(history, history_path)
+    return {
+        "generated": timestamp_now_iso(),
+        "from": prev_ts,
+        "to": inventory["timestamp"],
+        "baseline": latest is None,
+        "summary": diff_summary(diff),
+        "sources": diff,
+    }
+
+
+def log_diff_summary(diff: Dict[str, Any]) -> None:
+    """Souhrn diffu pro --diff."""
+    if diff["baseline"]:
+        logger.info("Diff: no previous inventory, this run is the baseline.")
+        return
+    sm = diff["summary"]
+    logger.info(
+        "Diff since %s: +%d added, -%d removed, %d upgraded, %d downgraded",
+        diff["from"], sm["added"], sm["removed"], sm["upgraded"], sm["downgraded"],
+    )
+    for src, e in diff["sources"].items():
+        parts = [f"{k}={len(e[k])}" for k in ("added", "removed", "upgraded", "downgraded") if e[k]]
+        logger.info("  %-30s %-8s %s", src, e["status"], " ".join(parts))
+        for u in e["upgraded"] + e["downgraded"]:
+            logger.info("      %s %s -> %s", u["name"], u["from"], u["to"])
+
+# -------------------------------------------------------------
+# Fleet agregace – inventáře z mnoha zařízení
+# -------------------------------------------------------------
+
+def load_inventory_rows(path: str) -> Optional[Tuple[str, str, List[Tuple[str, str, str]]]]:
+    """
+    Načte jeden inventářový soubor (json / jsonl, i .gz / .xz) a vrátí
+    (host, timestamp, [(zdroj, balíček, verze), ...]); jiné soubory
+    (issues, diff) -> None. Chybějící timestamp je "".
+
+    Zdroje odpovídají inventory_sources(): pkg, system_pip, venv:<jméno>.
+    """
+    base = path
+    for suffix in COMPRESS_SUFFIXES.values():
+        if base.endswith(suffix):
+            base = base[: -len(suffix)]
+    try:
+        if base.endswith(".jsonl"):
+            host = None
+            ts = ""
+            rows: List[Tuple[str, str, str]] = []
+            for rec in iter_jsonl_records(path):
+                if rec["type"] == "package":
+                    src = "venv:" + rec["venv"] if rec.get("source") == "venv" else rec.get("source", "")
+                    rows.append((src, rec.get("name") or "", rec.get("version") or ""))
+                elif rec["type"] == "inventory":
+                    host = rec.get("host")
+                    ts = rec.get("timestamp") or ""
+            if host is None:
+                return None
+            return host, ts, rows
+
+        data = load_json(path)
+    except (OSError, ValueError, KeyError, EOFError):
+        return None
+
+    inventory = data.get("inventory") if isinstance(data, dict) else None
+    if not isinstance(inventory, dict) or "pkg" not in inventory:
+        return None
+    host = inventory.get("host") or os.path.basename(path)
+    rows = [
+        (src, name, version)
+        for src, pkgs in inventory_sources(inventory).items()
+        for name, version in pkgs.items()
+    ]
+    return host, inventory.get("timestamp") or "", rows
+
+
+class FleetIndex:
+    """
+    Sloupcový index (host, zdroj, balíček, verze) přes celou flotilu.
+    Zdroj je pkg, system_pip nebo venv:<jméno>; dotazy filtrují podle druhu.
+
+    Řetězce jsou internované v tabulkách, řádky jsou čtyři pole array('I')
+    s indexy do tabulek; pro každý balíček se drží seznam řádků, takže dotaz
+    na jeden balíček nečte nic jiného. Porovnání verzí se počítá jen jednou
+    pro každou různou verzi.
+    """
+
+    COLUMNS = ("host", "source", "package", "version")
+
+    def __init__(self) -> None:
+        from array import array
+
+        self.tables: Dict[str, List[str]] = {c: [] for c in self.COLUMNS}
+        self._lookup: Dict[str, Dict[str, int]] = {c: {} for c in self.COLUMNS}
+        self.cols: Dict[str, array] = {c: array("I") for c in self.COLUMNS}
+        self.by_package: Dict[int, array] = {}
+
+    def _intern(self, column: str, value: str) -> int:
+        lookup = self._lookup[column]
+        i = lookup.get(value)
+        if i is None:
+            i = lookup[value] = len(self.tables[column])
+            self.tables[column].append(value)
+        return i
+
+    def add(self, host: str, rows: List[Tuple[str, str, str]]) -> None:
+        """Přidá řádky jednoho hosta; každý host se přidává jen jednou (viz build_fleet_index)."""
+        from array import array
+
+        h = self._intern("host", host)
+        for src, name, version in rows:
+            row = len(self.cols["host"])
+            p = self._intern("package", canonical_pkg_name(name))
+            self.cols["host"].append(h)
+            self.cols["source"].append(self._intern("source", src))
+            self.cols["package"].append(p)
+            self.cols["version"].append(self._intern("version", version))
+            self.by_package.setdefault(p, array("I")).append(row)
+
+    def __len__(self) -> int:
+        return len(self.cols["host"])
+
+    def _rows(self, package: str, source: Optional[str] = None) -> Iterator[int]:
+        p = self._lookup["package"].get(canonical_pkg_name(package))
+        if p is None:
+            return
+        allowed = None
+        if source:
+            # source = druh zdroje (pkg / system_pip / venv), tabulka drží i jméno venv
+            allowed = {i for i, name in enumerate(self.tables["source"]) if name.split(":", 1)[0] == source}
+        src_col = self.cols["source"]
+        for row in self.by_package.get(p, ()):
+            if allowed is None or src_col[row] in allowed:
+                yield row
+
+    def hosts_below(self, package: str, version: str, source: Optional[str] = None) -> List[Dict[str, str]]:
+        """Které hosty mají balíček v nižší verzi než version."""
+        below: Dict[int, bool] = {}
+        hosts, srcs, vers = self.tables["host"], self.tables["source"], self.tables["version"]
+        out: List[Dict[str, str]] = []
+        for row in self._rows(package, source):
+            v = self.cols["version"][row]
+            if v not in below:
+                below[v] = compare_versions(vers[v], version) < 0
+            if below[v]:
+                out.append({
+                    "host": hosts[self.cols["host"][row]],
+                    "source": srcs[self.cols["source"][row]],
+                    "version": vers[v],
+                })
+        out.sort(key=lambda r: (r["host"], r["source"]))
+        return out
+
+    def version_spread(self, package: str, source: Optional[str] = None) -> Dict[str, Any]:
+        """Rozložení verzí balíčku: počet hostů na verzi, min/max."""
+        per_version: Dict[int, set] = {}
+        for row in self._rows(package, source):
+            per_version.setdefault(self.cols["version"][row], set()).add(self.cols["host"][row])
+        vers = self.tables["version"]
+        ordered = sorted(per_version, key=lambda v: version_sort_key(vers[v]))
+        return {
+            "package": canonical_pkg_name(package),
+            "versions": {vers[v]: len(per_version[v]) for v in ordered},
+            "hosts": len(set().union(*per_version.values())) if per_version else 0,
+            "min": vers[ordered[0]] if ordered else None,
+            "max": vers[ordered[-1]] if ordered else None,
+        }
+
+    def spread_all(self, source: Optional[str] = None, min_versions: int = 2) -> List[Dict[str, Any]]:
+        """Version spread pro všechny balíčky s aspoň min_versions různými verzemi."""
+        out = []
+        for p in self.by_package:
+            sp = self.version_spread(self.tables["package"][p], source)
+            if len(sp["versions"]) >= min_versions:
+                out.append(sp)
+        out.sort(key=lambda sp: (-len(sp["versions"]), sp["package"]))
+        return out
+
+    def save(self, path: str) -> None:
+        data = {
+            "tables": self.tables,
+            "cols": {c: list(a) for c, a in self.cols.items()},
+        }
+        safe_write_json(path, data)
+
+    @classmethod
+    def load(cls, path: str) -> "FleetIndex":
+        from array import array
+
+        data = load_json(path)
+        idx = cls()
+        idx.tables = data["tables"]
+        idx._lookup = {c: {v: i for i, v in enumerate(t)} for c, t in idx.tables.items()}
+        idx.cols = {c: array("I", data["cols"][c]) for c in cls.COLUMNS}
+        for row, p in enumerate(idx.cols["package"]):
+            idx.by_package.setdefault(p, array("I")).append(row)
+        return idx
+
+
+INVENTORY_FILE_SUFFIXES = tuple(
+    ext + suffix for ext in (".json", ".jsonl") for suffix in ("",) + tuple(COMPRESS_SUFFIXES.values())
+)
+
+
+def _inventory_files(root: str, exclude: Tuple[str, ...] = ()) -> List[str]:
+    """Kandidáti na inventáře pod root; soubory z exclude (např. uložený --index) se vynechají."""
+    skip = {os.path.realpath(p) for p in exclude}
+    files: List[str] = []
+    for dirpath, _dirs, names in os.walk(root):
+        for fn in names:
+            full = os.path.join(dirpath, fn)
+            if fn.endswith(INVENTORY_FILE_SUFFIXES) and os.path.realpath(full) not in skip:
+                files.append(full)
+    return sorted(files)
+
+
+def _timestamp_key(ts: str) -> float:
+    """ISO timestamp inventáře jako číslo pro porovnání; nečitelný / chybějící je nejstarší."""
+    try:
+        return datetime.fromisoformat(ts).timestamp()
+    except (TypeError, ValueError):
+        return float("-inf")
+
+
+def build_fleet_index(root: str, jobs: Optional[int] = None, exclude: Tuple[str, ...] = ()) -> FleetIndex:
+    """
+    Načte všechny inventáře pod root paralelně v procesech a sestaví FleetIndex.
+
+    Z každého hosta se použije jen nejnovější inventář (podle timestamp),
+    takže host s .json i .jsonl variantou nebo se starou kopií se nezapočítá
+    dvakrát. Při shodě vyhrává soubor později v abecedním pořadí.
+    """
+    files = _inventory_files(root, exclude)
+    index = FleetIndex()
+    if not files:
+        return index
+    workers = max(1, min(jobs or default_jobs(), len(files)))
+    newest: Dict[str, Tuple[float, List[Tuple[str, str, str]]]] = {}
+
+    def _keep(res: Optional[Tuple[str, str, List[Tuple[str, str, str]]]]) -> None:
+        if res is None:
+            return
+        host, ts, rows = res
+        key = _timestamp_key(ts)
+        if host not in newest or key >= newest[host][0]:
+            newest[host] = (key, rows)
+
+    if workers == 1:
+        for res in map(load_inventory_rows, files):
+            _keep(res)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for res in pool.map(load_inventory_rows, files, chunksize=max(1, len(files) // (workers * 4))):
+                _keep(res)
+    for host in sorted(newest):
+        index.add(host, newest[host][1])
+    return index
+
+
+def parse_aggregate_args(argv: List[str]) -> argparse.Namespace:
+    p = argparse.ArgumentParser(
+        prog="aktualizator aggregate",
+        description="Sloučí Aktualizator_seznam.json z mnoha zařízení a odpoví na dotazy nad flotilou.",
+    )
+    p.add_argument("directory", help="Adresář s inventáři (prochází se rekurzivně).")
+    p.add_argument("--jobs", type=int, default=default_jobs(), metavar="N",
+                   help="Počet procesů pro načítání (výchozí: počet CPU).")
+    p.add_argument("--index", default=None, metavar="FILE",
+                   help="Uložený index; použije se, pokud je novější než všechny inventáře.")
+    p.add_argument("--source", default=None, choices=["pkg", "system_pip", "venv"],
+                   help="Omezit dotazy na jeden zdroj.")
+    p.add_argument("--below", nargs=2, metavar=("PACKAGE", "VERSION"), action="append", default=[],
+                   help="Hosty s balíčkem PACKAGE ve verzi nižší než VERSION (lze opakovat).")
+    p.add_argument("--spread", metavar="PACKAGE", action="append", default=[],
+                   help="Rozložení verzí balíčku (lze opakovat).")
+    p.add_argument("--spread-all", action="store_true",
+                   help="Rozložení verzí všech balíčků s více verzemi.")
+    p.add_argument("--out", default=None, metavar="FILE", help="Zapsat výsledek do JSON souboru místo stdout.")
+    return p.parse_args(argv)
+
+
+def aggregate_main(argv: List[str]) -> None:
+    """Subpříkaz `aggregate`."""
+    args = parse_aggregate_args(argv)
+    t0 = time.perf_counter()
+
+    index: Optional[FleetIndex] = None
+    if args.index and os.path.isfile(args.index):
+        newest = max((os.path.getmtime(f) for f in _inventory_files(args.directory, (args.index,))), default=0)
+        if os.path.getmtime(args.index) >= newest:
+            index = FleetIndex.load(args.index)
+    if index is None:
+        index = build_fleet_index(args.directory, jobs=args.jobs, exclude=(args.index,) if args.index else ())
+        if args.index:
+            index.save(args.index)
+    t1 = time.perf_counter()
+
+    result: Dict[str, Any] = {
+        "generated": timestamp_now_iso(),
+        "hosts": len(index.tables["host"]),
+        "packages": len(index.tables["package"]),
+        "rows": len(index),
+        "below": [
+            {"package": pkg, "version": ver, "hosts": index.hosts_below(pkg, ver, args.source)}
+            for pkg, ver in args.below
+        ],
+        "spread": [index.version_spread(pkg, args.source) for pkg in args.spread],
+    }
+    if args.spread_all:
+        result["spread_all"] = index.spread_all(args.source)
+    result["timings"] = {"index": round(t1 - t0, 6), "queries": round(time.perf_counter() - t1, 6)}
+
+    if args.out:
+        safe_write_json(args.out, result)
+    else:
+        json.dump(result, sys.stdout, indent=2, ensure_ascii=False)
+        sys.stdout.write("\n")
+
+# -------------------------------------------------------------
+# Repair systém – důkladná oprava Termux prostředí
+# -------------------------------------------------------------
+
+def run_repair_routines() -> Dict[str, Any]:
+    """Synchronní obal nad run_repair_routines_async()."""
+    return asyncio.run(run_repair_routines_async())
+
+
+async def run_repair_routines_async() -> Dict[str, Any]:
+    """
+    Důkladná opravná sekvence pro Termux-Updater prostředí.
+
+    - Spustí pkg update/upgrade a zachytí chyby mirrorů (stdout i stderr se
+      průběžně klasifikují po řádcích – AptLogClassifier).
+    - Zakomentuje mirrory s chybami podle počtů na hostitele (not signed,
+      prošlý klíč, hash mismatch, 404; timeout / DNS jen když jiné fungují).
+    - Vyčistí pip cache a dočasné adresáře Termuxu.
+    - Opraví ~/bin/aktualizator symlink a executable bit.
+    """
+    results: Dict[str, Any] = {
+        "timestamp": timestamp_now_iso(),
+        "steps": [],
+    }
+
+    def _log(msg: str) -> None:
+        logger.info(msg)
+        results["steps"].append(msg)
+
+    _log("==> Repair: starting Termux-Updater repair sequence")
+
+    classifier = AptLogClassifier()
+
+    async def _pkg(action: str) -> Tuple[int, str]:
+        """pkg <action> -y; vrací (rc, konec stderr), výstup jde do classifier."""
+        rc, _, err = await run_cmd_async(
+            ["pkg", action, "-y"],
+            timeout=CMD_TIMEOUTS["pkg"],
+            capture_stdout=False,
+            on_line=lambda _stream, line: classifier.feed(line),
+        )
+        return rc, err
+
+    # 1. pkg update / upgrade, chyby uložíme
+    _log("[step] pkg update/upgrade via 'pkg'")
+    rc_upd, err_upd = await _pkg("update")
+    if rc_upd != 0:
+        _log(f"[warn] pkg update failed (rc={rc_upd}):\n{err_upd[-400:]}")
+
+    rc_upg, err_upg = await _pkg("upgrade")
+    if rc_upg != 0:
+        _log(f"[warn] pkg upgrade failed (rc={rc_upg}):\n{err_upg[-400:]}")
+    results["apt_errors"] = classifier.report()
+
+    # 1b. Pokud jsme našli špatné mirrory – upravíme APT sources a zkusíme to znovu
+    unique_bad = classifier.bad_hosts() if rc_upd != 0 or rc_upg != 0 else []
+    if unique_bad:
+        for host in unique_bad:
+            counts = ", ".join(f"{k}={n}" for k, n in sorted(classifier.counts[host].items()))
+            _log(f"[info] {host}: {counts}")
+        _log(f"[step] Detected problematic mirrors: {', '.join(unique_bad)}")
+        changes = sanitize_apt_sources(unique_bad)
+        if changes:
+            for ch in changes:
+                _log(f"[fix] Disabled mirror in {ch['file']}: {ch['line']}")
+            _log("[step] Retrying pkg update/upgrade after mirror fix...")
+            rc2, err2 = await _pkg("update")
+            if rc2 != 0:
+                _log(f"[warn] pkg update still failing after mirror fix (rc={rc2}):\n{err2[-400:]}")
+            rc3, err3 = await _pkg("upgrade")
+            if rc3 != 0:
+                _log(f"[warn] pkg upgrade still failing after mirror fix (rc={rc3}):\n{err3[-400:]}")
+        else:
+            _log("[info] No APT source files modified while sanitizing mirrors.")
+
+    # 2. Vyčištění pip cache
+    _log("[step] Cleaning pip caches...")
+    # pip cache a wheelhouse se nemažou celé – jen poškozené a zastaralé položky
+    if os.path.isdir(PIP_CACHE):
+        res = prune_pip_cache(PIP_CACHE)
+        _log(f"[clean] Pruned {res['removed']} stale/corrupted files from {PIP_CACHE} ({res['freed']} B)")
+    if os.path.isdir(WHEELHOUSE):
+        res_wh = prune_wheelhouse(WHEELHOUSE, verify=True)
+        _log(f"[clean] Pruned {len(res_wh['removed'])} wheels from {WHEELHOUSE} ({res_wh['freed']} B)")
+    for cache in ["~/.cache/jupyter", "~/.cache/pip-tools"]:
+        path = os.path.expanduser(cache)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            _log(f"[clean] Removed cache: {path}")
+
+    # 3. Vyčištění dočasných adresářů Termuxu
+    _log("[step] Cleaning Termux temporary directories...")
+    for tmpdir in ["~/tmp", "/data/data/com.termux/files/usr/tmp"]:
+        path = os.path.expanduser(tmpdir)
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+            _log(f"[clean] Removed tmp: {path}")
+
+    # 4. Oprava symlinku ~/bin/aktualizator + executable bit
+    _log("[step] Repairing aktualizator symlink and executable bit...")
+    exe = os.path.join(HOME, "Termux-Updater", "aktualizator", "Termux-Updater-Pro.py")
+    bindir = os.path.join(HOME, "bin")
+    os.makedirs(bindir, exist_ok=True)
+    symlink = os.path.join(bindir, "aktualizator")
+
+    try:
+        if os.path.islink(symlink) or os.path.isfile(symlink):
+            os.remove(symlink)
+        os.symlink(exe, symlink)
+        _log(f"[ok] Recreated symlink: {symlink} -> {exe}")
+    except Exception as e:
+        _log(f"[warn] Failed to repair symlink: {e}")
+
+    try:
+        os.chmod(exe, 0o755)
+        _log(f"[ok] Ensured executable bit on: {exe}")
+    except Exception as e:
+        _log(f"[warn] Failed to chmod main script: {e}")
+
+    _log("==> Repair: completed")
+
+    # Repair log uložíme i standardně
+    safe_write_json(OUT_REPAIR_LOG, results)
+    return results
+
+
+def parse_classify_args(argv: List[str]) -> argparse.Namespace:
+    p = argparse.ArgumentParser(
+        prog="aktualizator classify-log",
+        description="Klasifikuje chyby mirrorů v apt / pkg logu (i mnoha a velkých, .gz).",
+    )
+    p.add_argument("logs", nargs="+", metavar="LOG", help='apt log(y); "-" = stdin.')
+    p.add_argument("--jobs", type=int, default=default_jobs(), metavar="N",
+                   help="Počet procesů pro více souborů (výchozí: počet CPU).")
+    p.add_argument("--sanitize", action="store_true",
+                   help="Zakomentovat v APT sources mirrory, které klasifikace označí jako rozbité.")
+    p.add_argument("--out", default=None, metavar="FILE", help="Zapsat výsledek do JSON souboru místo stdout.")
+    return p.parse_args(argv)
+
+
+def classify_main(argv: List[str]) -> None:
+    """Subpříkaz `classify-log`."""
+    args = parse_classify_args(argv)
+    t0 = time.perf_counter()
+    total = AptLogClassifier()
+    files = [f for f in args.logs if f != "-"]
+    if "-" in args.logs:
+        total.merge(classify_apt_log("-"))
+    if len(files) > 1 and args.jobs > 1:
+        from concurrent.futures import ProcessPoolExecutor
+
+        with ProcessPoolExecutor(max_workers=min(args.jobs, len(files))) as pool:
+            for part in pool.map(classify_apt_log, files):
+                total.merge(part)
     else:
-        issues.append({
-            "category": "pkg_list",
-            "cmd": [pkg_cmd, "list-installed"],
-            "rc": rc_list,
-            "stderr": err_list,
+        for f in files:
+            total.merge(classify_apt_log(f))
+
+    report = total.report()
+    report["elapsed"] = round(time.perf_counter() - t0, 6)
+    if args.sanitize and report["bad_hosts"]:
+        report["sanitized"] = sanitize_apt_sources(report["bad_hosts"])
+    if args.out:
+        safe_write_json(args.out, report)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+
+# -------------------------------------------------------------
+# Orchestr – inventář
+# -------------------------------------------------------------
+
+def default_jobs() -> int:
+    """Výchozí počet paralelních workerů = počet CPU."""
+    return os.cpu_count() or 1
+
+
+def build_inventory_and_issues(
+    mode: str,
+    venv_dir: str,
+    dry_run: bool,
+    verbose: bool,
+    do_upgrade: bool,
+    jobs: Optional[int] = None,
+    backend: str = "metadata",
+    use_cache: bool = True,
+    chunk_size: int = PIP_UPGRADE_CHUNK,
+    wheelhouse: Optional[str] = WHEELHOUSE,
+    sink: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    venv_roots: Optional[List[str]] = None,
+    venv_depth: int = VENV_MAX_DEPTH,
+    venv_prune: Tuple[str, ...] = VENV_PRUNE,
+    journal: Optional[StepJournal] = None,
+    inventory_only: bool = False,
+    locks: Optional[LockManager] = None,
+    prefetch: bool = True,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Orchestruje pkg + pip + venv inventář a upgrady.
+
+    mode: 'A'|'B'|'C'|'D'
+    do_upgrade: pokud True a mode == 'D', provede pip upgrade (nikdy s --dry-run).
+    jobs: max. počet souběžně běžících příkazů (výchozí = počet CPU).
+    backend: 'metadata' (čtení site-packages) nebo 'pip' (pip list).
+    use_cache: použít INVENTORY_CACHE (výsledky s nezměněným otiskem
+               site-packages / dpkg status se neskenují znovu).
+    chunk_size: velikost dávky pro pip upgrade zastaralých balíčků (D).
+    wheelhouse: sdílený adresář wheelů pro pip upgrade (None = nepoužívat).
+    sink: volitelný callback sink(kind, record), který dostává záznamy
+          ('package', 'venv', 'issue') hned, jak vzniknou (viz JsonlWriter).
+    venv_roots: další kořeny pro hledání venv (kromě venv_dir).
+    venv_depth / venv_prune: hloubka a vynechané adresáře (viz discover_venvs).
+    journal: StepJournal pro --resume; kroky hotové v přerušeném běhu
+             (pkg update/upgrade, pip upgrade jednotlivých pipů) se přeskočí.
+    inventory_only: jen inventář – bez pkg update/upgrade a pip upgrade.
+    locks: LockManager; pkg, system pip a každý venv se zamyká zvlášť
+           (sdíleně pro inventář, exkluzivně pro upgrade). Vypršení zámku
+           se hlásí jako issue "lock_timeout" u daného zdroje.
+    prefetch: v režimu D stáhnout apt balíčky (apt_prefetch) souběžně
+              s pip upgrady a pak je nainstalovat offline.
+
+    Synchronní obal nad build_inventory_and_issues_async().
+    """
+    set_cmd_concurrency(jobs or default_jobs())
+    return asyncio.run(build_inventory_and_issues_async(
+        mode=mode,
+        venv_dir=venv_dir,
+        dry_run=dry_run,
+        verbose=verbose,
+        do_upgrade=do_upgrade,
+        backend=backend,
+        use_cache=use_cache,
+        chunk_size=chunk_size,
+        wheelhouse=wheelhouse,
+        sink=sink,
+        venv_roots=venv_roots,
+        venv_depth=venv_depth,
+        venv_prune=venv_prune,
+        journal=journal,
+        inventory_only=inventory_only,
+        locks=locks,
+        prefetch=prefetch,
+    ))
+
+
+async def build_inventory_and_issues_async(
+    mode: str,
+    venv_dir: str,
+    dry_run: bool,
+    verbose: bool,
+    do_upgrade: bool,
+    backend: str = "metadata",
+    use_cache: bool = True,
+    chunk_size: int = PIP_UPGRADE_CHUNK,
+    wheelhouse: Optional[str] = WHEELHOUSE,
+    sink: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    venv_roots: Optional[List[str]] = None,
+    venv_depth: int = VENV_MAX_DEPTH,
+    venv_prune: Tuple[str, ...] = VENV_PRUNE,
+    journal: Optional[StepJournal] = None,
+    inventory_only: bool = False,
+    locks: Optional[LockManager] = None,
+    prefetch: bool = True,
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    Asynchronní jádro build_inventory_and_issues().
+
+    Pořadí a souběh kroků:
+      1. pkg update/upgrade/list  ┐ běží souběžně
+      2. inventář všech venv      ┘ (venv apt nemění)
+      3. inventář system pip – až po pkg upgrade (apt mění systémové site-packages)
+      4. pip upgrade (D) – system pip a jednotlivé skupiny venv souběžně
+         (omezeno --jobs); v rámci skupiny identických venv (group_venvs)
+         se plán (pip list --outdated) zjistí jen na prvním ještě
+         neupgradovaném členu, ten se upgraduje první (sestavené wheely
+         jdou do wheelhouse) a pak ostatní členové souběžně stejné verze
+
+    S prefetch (D, apt-get k dispozici) se krok 1 rozdělí: pkg update,
+    plán (apt_upgrade_plan), stažení balíčků (apt_prefetch) a offline
+    instalace. Stahování běží souběžně s krokem 2 a – pokud upgrade
+    nemění python – i s upgradem venv z kroku 4. Instalace ale čeká, až
+    upgrade venv doběhne: sdist buildy linkují proti knihovnám z apt
+    (openssl, libffi, ...) a ty se nesmí měnit uprostřed buildu.
+
+    S journal se dokončené kroky přeskočí (--resume) a nové se zapisují.
+
+    Výsledky venv se skládají v pořadí z discover_venvs, takže výstup
+    je deterministický. Do sink jdou záznamy každého zdroje hned po jeho
+    dokončení (pořadí zdrojů v sink tedy deterministické není).
+    """
+    inventory: Dict[str, Any] = {
+        "timestamp": timestamp_now_iso(),
+        "mode": mode,
+        "host": os.uname().nodename if hasattr(os, "uname") else "termux",
+        "pkg": [],
+        "system_pip": [],
+        "venvs": {},
+    }
+    issues: List[Dict[str, Any]] = []
+
+    def _emit(kind: str, record: Dict[str, Any]) -> None:
+        if sink is not None:
+            sink(kind, record)
+
+    def _lock_resource(pip_exe: str, include_user: bool = False) -> str:
+        return "pip:system" if include_user else "venv:" + os.path.dirname(os.path.dirname(os.path.abspath(pip_exe)))
+
+    def _lock_issue(resource: str, e: LockTimeout) -> Dict[str, Any]:
+        return {"category": "lock_timeout", "cmd": [], "rc": -1, "stderr": str(e), "resource": resource}
+
+    def _emit_packages(source: str, pkgs_: List[Dict[str, Any]], **extra: Any) -> None:
+        for p in pkgs_:
+            _emit("package", dict({"source": source}, **extra, **p))
+
+    cache = load_inventory_cache() if use_cache else None
+
+    pkg_cmd = detect_package_manager()
+    logger.info("Using package manager: %s", pkg_cmd)
+
+    sys_pip: Optional[str] = None
+    sys_issues: List[Dict[str, Any]] = []
+    if mode in ("B", "C", "D"):
+        sys_pip = find_system_pip()
+        if sys_pip:
+            logger.info("Using system pip at %s", sys_pip)
+        else:
+            sys_issues.append({
+                "category": "system_pip_missing",
+                "cmd": ["which pip3"],
+                "rc": 127,
+                "stderr": "system pip not found in PATH",
+            })
+
+    venv_pips: List[Tuple[str, str]] = []
+    if mode in ("C", "D"):
+        roots = [venv_dir] + [r for r in (venv_roots or []) if r != venv_dir]
+        with timed("phase", "venv_discovery"):
+            venv_pips = discover_venvs(
+                roots,
+                max_depth=venv_depth,
+                prune=venv_prune,
+                cache_path=VENV_DISCOVERY_CACHE if use_cache else None,
+            )
+        logger.info("Found %d venv pip executables under %s", len(venv_pips), ", ".join(roots))
+
+    async def _pip_inventory(
+        name: str, pip_exe: str, include_user: bool = False
+    ) -> Tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]:
+        """Inventář jednoho pipu; pokud sedí otisk v cache, nic nespouští."""
+        fp = path_fingerprint(find_site_packages(pip_exe, include_user=include_user))
+        hit = cache_get(cache, "pip:" + pip_exe, fp)
+        if hit is not None:
+            return hit, None
+        resource = _lock_resource(pip_exe, include_user)
+        try:
+            async with maybe_locked_async(locks, resource, shared=True):
+                with timed("phase", "pip_list:" + name, pip=pip_exe):
+                    pkgs_, issue_ = await inventory_list(pip_exe, dry_run, backend, include_user)
+        except LockTimeout as e:
+            return [], _lock_issue(resource, e)
+        if not dry_run and issue_ is None:
+            cache_put(cache, "pip:" + pip_exe, fp, pkgs_)
+        return pkgs_, issue_
+
+    def _venv_issue(vname: str, issue_: Dict[str, Any]) -> Dict[str, Any]:
+        issue_ = dict(issue_)
+        issue_["venv"] = vname
+        return issue_
+
+    async def _venv(vname: str, pip_exe: str) -> Tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]:
+        pkgs_, issue_ = await _pip_inventory(vname, pip_exe)
+        _emit_packages("venv", pkgs_, venv=vname)
+        _emit("venv", {"venv": vname, "pip": pip_exe, "packages": len(pkgs_)})
+        if issue_:
+            _emit("issue", _venv_issue(vname, issue_))
+        return pkgs_, issue_
+
+    async def _venvs() -> List[Tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]]:
+        return list(await asyncio.gather(*(_venv(vname, pip_exe) for vname, pip_exe in venv_pips)))
+
+    async def _pkg() -> Tuple[List[Dict[str, str]], List[Dict[str, Any]]]:
+        try:
+            async with maybe_locked_async(locks, "pkg", shared=inventory_only or dry_run):
+                with timed("phase", "pkg"):
+                    pkgs_, issues_ = await pkg_update_and_list(
+                        pkg_cmd, dry_run=dry_run, cache=cache, journal=journal, upgrade=not inventory_only
+                    )
+        except LockTimeout as e:
+            pkgs_, issues_ = [], [_lock_issue("pkg", e)]
+        _emit_packages("pkg", pkgs_)
+        for it in issues_:
+            _emit("issue", it)
+        return pkgs_, issues_
+
+    def _assemble_venvs(
+        venv_results: List[Tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]]
+    ) -> List[Dict[str, Any]]:
+        for (vname, pip_exe), (pkgs_venv, issue_venv) in zip(venv_pips, venv_results):
+            inventory["venvs"][vname] = {
+                "pip": pip_exe,
+                "packages": pkgs_venv,
+            }
+            if issue_venv:
+                inventory["venvs"][vname]["error"] = issue_venv.get("category")
+                issues.append(_venv_issue(vname, issue_venv))
+        groups_ = group_venvs(inventory["venvs"])
+        inventory["venv_groups"] = groups_
+        for group in groups_:
+            _emit("venv_group", group)
+        shared = [g for g in groups_ if len(g["members"]) > 1]
+        if shared:
+            logger.info(
+                "%d venvs form %d groups (%d with shared package sets)",
+                len(venv_pips), len(groups_), len(shared),
+            )
+        return groups_
+
+    # pip upgrade (D) – system pip a skupiny venv souběžně
+    async def _upgrade_one(
+        step: str, vname: Optional[str], pip_exe: str, plan: Optional[List[Dict[str, str]]] = None
+    ) -> List[Dict[str, Any]]:
+        if journal is not None and journal.done(step):
+            logger.info("Skipping %s (completed in interrupted run)", step)
+            return []
+        resource = _lock_resource(pip_exe, include_user=vname is None)
+        try:
+            async with maybe_locked_async(locks, resource):
+                with timed("phase", step, pip=pip_exe) as rec:
+                    up_issues = await pip_upgrade(pip_exe, False, chunk_size, wheelhouse, outdated=plan, stats=rec)
+        except LockTimeout as e:
+            up_issues = [_lock_issue(resource, e)]
+        if vname is not None:
+            up_issues = [_venv_issue(vname, it) for it in up_issues]
+        for it in up_issues:
+            _emit("issue", it)
+        if journal is not None and not up_issues:
+            journal.mark(step)
+        return up_issues
+
+    async def _upgrade_group(group: Dict[str, Any]) -> List[Dict[str, Any]]:
+        pending = [
+            v for v in group["members"]
+            if journal is None or not journal.done("pip_upgrade:" + v)
+        ]
+        if not pending:
+            return []
+        plan: Optional[List[Dict[str, str]]] = None
+        if len(pending) > 1:
+            leader_pip = inventory["venvs"][pending[0]]["pip"]
+            with timed("phase", "pip_plan:" + group["fingerprint"], pip=leader_pip):
+                plan, plan_issue = await pip_outdated(leader_pip, dry_run=False)
+            if plan_issue:
+                plan = None  # každý člen si plán zjistí sám (a nahlásí chybu)
+            else:
+                logger.info(
+                    "Upgrade plan for venv group %s (%d venvs): %d packages",
+                    group["fingerprint"], len(pending), len(plan),
+                )
+
+        def _one(v: str) -> Any:
+            return _upgrade_one("pip_upgrade:" + v, v, inventory["venvs"][v]["pip"], plan)
+
+        group_issues = await _one(pending[0])
+        for up_issues in await asyncio.gather(*(_one(v) for v in pending[1:])):
+            group_issues.extend(up_issues)
+        return group_issues
+
+    prefetch_state: Dict[str, Any] = {"venvs_safe": False}
+
+    async def _venv_upgrades(groups_: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        t0 = time.monotonic()
+        up_issues: List[Dict[str, Any]] = []
+        for group_issues in await asyncio.gather(*(_upgrade_group(g) for g in groups_)):
+            up_issues.extend(group_issues)
+        prefetch_state["pip_window"] = (t0, time.monotonic())
+        return up_issues
+
+    async def _pkg_prefetched(
+        plan_ready: Any, install_ready: Any
+    ) -> Tuple[List[Dict[str, str]], List[Dict[str, Any]]]:
+        """update -> plán -> stažení (souběžně s pip) -> po upgradu venv offline instalace -> seznam."""
+        pkgs_: List[Dict[str, str]] = []
+        issues_: List[Dict[str, Any]] = []
+        try:
+            async with maybe_locked_async(locks, "pkg"):
+                with timed("phase", "pkg"):
+                    await _pkg_step("pkg.update", "pkg_update", [pkg_cmd, "update", "-y"], dry_run, journal, issues_)
+                    apt_plan, plan_issue = await apt_upgrade_plan(dry_run)
+                    if plan_issue:
+                        issues_.append(plan_issue)
+                    names = {p["name"] for p in apt_plan}
+                    prefetch_state["packages"] = len(names)
+                    prefetch_state["venvs_safe"] = plan_issue is None and not APT_PYTHON_PACKAGES.intersection(names)
+                    plan_ready.set()
+                    t0 = time.monotonic()
+                    fetched = await apt_prefetch(dry_run, journal, issues_)
+                    prefetch_state["download_window"] = (t0, time.monotonic())
+                    prefetch_state.update(fetched)
+                    if not install_ready.is_set():
+                        logger.info("Packages downloaded; install waits for the venv upgrades")
+                        await install_ready.wait()
+                    pkgs_, more = await pkg_update_and_list(
+                        pkg_cmd, dry_run=dry_run, cache=cache, journal=journal, update=False, offline=fetched["ok"]
+                    )
+                    issues_.extend(more)
+        except LockTimeout as e:
+            issues_.append(_lock_issue("pkg", e))
+        finally:
+            plan_ready.set()
+        _emit_packages("pkg", pkgs_)
+        for it in issues_:
+            _emit("issue", it)
+        return pkgs_, issues_
+
+    upgrading = mode == "D" and do_upgrade and not dry_run and not inventory_only
+    use_prefetch = prefetch and upgrading and pkg_cmd in ("pkg", "apt") and shutil.which("apt-get") is not None
+    venv_up_task = None
+
+    if not use_prefetch:
+        # Krok 1 + 2: pkg a venv inventář souběžně
+        (pkgs, pkg_issues), venv_results = await asyncio.gather(_pkg(), _venvs())
+        groups = _assemble_venvs(venv_results)
+    else:
+        # Krok 1 + 2 s prefetchem: stahování balíčků běží souběžně s inventářem
+        # venv a (pokud upgrade nemění python) i s upgradem venv; instalace
+        # balíčků počká, až upgrade venv doběhne
+        plan_ready = asyncio.Event()
+        install_ready = asyncio.Event()
+        pkg_task = asyncio.create_task(_pkg_prefetched(plan_ready, install_ready))
+        groups = _assemble_venvs(await _venvs())
+        await plan_ready.wait()
+        if prefetch_state["venvs_safe"]:
+            venv_up_task = asyncio.create_task(_venv_upgrades(groups))
+            venv_up_task.add_done_callback(lambda _task: install_ready.set())
+        else:
+            logger.info("apt upgrade changes python; venv upgrades wait for the install")
+            install_ready.set()
+        pkgs, pkg_issues = await pkg_task
+    inventory["pkg"] = pkgs
+    issues.extend(pkg_issues)
+
+    # Krok 3: system pip
+    issues.extend(sys_issues)
+    for it in sys_issues:
+        _emit("issue", it)
+    if sys_pip:
+        pkgs_sys, issue_sys = await _pip_inventory("system", sys_pip, include_user=True)
+        inventory["system_pip"] = pkgs_sys
+        _emit_packages("system_pip", pkgs_sys)
+        if issue_sys:
+            issues.append(issue_sys)
+            _emit("issue", issue_sys)
+
+    if cache is not None:
+        save_inventory_cache(cache)
+
+    # Krok 4: pip upgrade (D) – system pip a skupiny venv souběžně
+    if upgrading:
+        tasks = [] if venv_up_task is not None else [_venv_upgrades(groups)]
+        if sys_pip:
+            tasks.insert(0, _upgrade_one("pip_upgrade:system", None, sys_pip))
+        for up_issues in await asyncio.gather(*tasks):
+            issues.extend(up_issues)
+        if venv_up_task is not None:
+            issues.extend(await venv_up_task)
+
+    if use_prefetch and "download_window" in prefetch_state:
+        d0, d1 = prefetch_state["download_window"]
+        u0, u1 = prefetch_state.get("pip_window", (d1, d1))
+        overlap = max(0.0, min(d1, u1) - max(d0, u0)) if venv_up_task is not None else 0.0
+        inventory["prefetch"] = {
+            "packages": prefetch_state["packages"],
+            "files": prefetch_state["files"],
+            "bytes": prefetch_state["bytes"],
+            "download_seconds": round(d1 - d0, 3),
+            "saved_seconds": round(overlap, 3),
+            "offline_install": prefetch_state["ok"],
+        }
+        logger.info(
+            "Prefetched %d files (%d B) in %.1fs; %.1fs overlapped with venv upgrades",
+            prefetch_state["files"], prefetch_state["bytes"], d1 - d0, overlap,
+        )
+
+    return inventory, issues
+
+# -------------------------------------------------------------
+# Bezpečnostní upozornění – offline OSV index
+# -------------------------------------------------------------
+
+# Soubor indexu (vše little-endian, řetězce jako (offset, délka) do bloku řetězců):
+#   hlavička  magic, n_keys, keys_off, entries_off, strings_off, manifest_off, manifest_len
+#   klíče     seřazené podle bajtů "ekosystém\0jméno": key_off, key_len, first, count
+#   záznamy   interval verzí: adv_off, adv_len, lo_off, lo_len, hi_off, hi_len, flags
+# Prázdné lo/hi = neomezeno; flags & ADV_HI_INCLUSIVE = hi je poslední postižená verze.
+_ADV_MAGIC = b"AKTOSV\x00\x01"
+_ADV_HEADER = "<8s6I"
+_ADV_KEY = "<4I"
+_ADV_ENTRY = "<6IB3x"
+ADV_HI_INCLUSIVE = 1
+
+
+def _osv_name(ecosystem: str, name: str) -> str:
+    return canonical_pkg_name(name) if ecosystem == "PyPI" else name.lower()
+
+
+def parse_osv_advisory(data: Any) -> Tuple[Optional[Dict[str, Any]], List[List[Any]]]:
+    """
+    Jedno OSV upozornění -> (detail, intervaly).
+
+    detail: {id, summary, aliases, severity}; intervaly:
+    [[ekosystém, jméno, id, lo, hi, flags], ...] z rozsahů ECOSYSTEM / SEMVER
+    (GIT se přeskočí); výčet "versions" se použije jen u balíčku bez rozsahů.
+    Stažená (withdrawn) upozornění se vynechají.
+    """
+    if not isinstance(data, dict) or not data.get("id") or data.get("withdrawn"):
+        return None, []
+    adv_id = data["id"]
+    severity = (data.get("database_specific") or {}).get("severity")
+    if not severity:
+        scores = [sev.get("score") for sev in data.get("severity") or [] if isinstance(sev, dict)]
+        severity = next((sc for sc in scores if sc), None)
+    detail = {
+        "id": adv_id,
+        "summary": (data.get("summary") or data.get("details") or "").strip()[:200],
+        "aliases": data.get("aliases") or [],
+        "severity": severity,
+    }
+    intervals: List[List[Any]] = []
+    for aff in data.get("affected") or []:
+        pkg = aff.get("package") or {}
+        if not pkg.get("ecosystem") or not pkg.get("name"):
+            continue
+        eco = pkg["ecosystem"].split(":", 1)[0]  # "Debian:12" -> "Debian"
+        name = _osv_name(eco, pkg["name"])
+        ranged = False
+        for rng in aff.get("ranges") or []:
+            if rng.get("type") not in ("ECOSYSTEM", "SEMVER"):
+                continue
+            ranged = True
+            lo: Optional[str] = None
+            for ev in rng.get("events") or []:
+                if "introduced" in ev:
+                    lo = "" if ev["introduced"] == "0" else ev["introduced"]
+                elif lo is not None and "fixed" in ev:
+                    intervals.append([eco, name, adv_id, lo, ev["fixed"], 0])
+                    lo = None
+                elif lo is not None and "last_affected" in ev:
+                    intervals.append([eco, name, adv_id, lo, ev["last_affected"], ADV_HI_INCLUSIVE])
+                    lo = None
+            if lo is not None:
+                intervals.append([eco, name, adv_id, lo, "", 0])
+        if not ranged:
+            for version in aff.get("versions") or []:
+                intervals.append([eco, name, adv_id, version, version, ADV_HI_INCLUSIVE])
+    return detail, intervals
+
+
+def _parse_osv_file(path: str) -> Tuple[Dict[str, Dict[str, Any]], List[List[Any]]]:
+    """OSV dump: jeden JSON (upozornění nebo jejich seznam), nebo zip s JSON soubory."""
+    import zipfile
+
+    docs: List[Any] = []
+    try:
+        if path.endswith(".zip"):
+            with zipfile.ZipFile(path) as zf:
+                for member in zf.namelist():
+                    if member.endswith(".json"):
+                        docs.append(json.loads(zf.read(member)))
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            docs.extend(data if isinstance(data, list) else [data])
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        logger.warning("Unable to read advisory dump %s: %s", path, e)
+    details: Dict[str, Dict[str, Any]] = {}
+    intervals: List[List[Any]] = []
+    for doc in docs:
+        detail, found = parse_osv_advisory(doc)
+        if detail is not None:
+            details[detail["id"]] = detail
+            intervals.extend(found)
+    return details, intervals
+
+
+def _advisory_sources(db_dir: str) -> Dict[str, List[int]]:
+    """{cesta: [mtime_ns, size]} všech *.json / *.zip pod db_dir."""
+    sources: Dict[str, List[int]] = {}
+    for dirpath, _dirs, names in os.walk(db_dir):
+        for fn in names:
+            if fn.endswith((".json", ".zip")):
+                path = os.path.join(dirpath, fn)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                sources[path] = [st.st_mtime_ns, st.st_size]
+    return sources
+
+
+def write_advisory_index(
+    path: str,
+    intervals: List[List[Any]],
+    details: Dict[str, Dict[str, Any]],
+    manifest: Dict[str, Any],
+) -> None:
+    """Zapíše binární index (formát viz _ADV_HEADER) atomicky do path."""
+    import struct
+
+    strings = bytearray()
+    refs: Dict[bytes, Tuple[int, int]] = {}
+
+    def _s(raw: bytes) -> Tuple[int, int]:
+        ref = refs.get(raw)
+        if ref is None:
+            ref = refs[raw] = (len(strings), len(raw))
+            strings.extend(raw)
+        return ref
+
+    adv_refs = {
+        adv_id: _s(json.dumps(d, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+        for adv_id, d in details.items()
+    }
+    by_key: Dict[bytes, set] = {}
+    for eco, name, adv_id, lo, hi, flags in intervals:
+        if adv_id in adv_refs:
+            by_key.setdefault(f"{eco}\0{name}".encode("utf-8"), set()).add((adv_id, lo, hi, flags))
+
+    key_recs = bytearray()
+    entry_recs = bytearray()
+    n_entries = 0
+    for key in sorted(by_key):
+        items = sorted(by_key[key])
+        key_recs += struct.pack(_ADV_KEY, *_s(key), n_entries, len(items))
+        for adv_id, lo, hi, flags in items:
+            entry_recs += struct.pack(
+                _ADV_ENTRY, *adv_refs[adv_id], *_s(lo.encode("utf-8")), *_s(hi.encode("utf-8")), flags
+            )
+        n_entries += len(items)
+
+    manifest_raw = json.dumps(manifest, separators=(",", ":")).encode("utf-8")
+    keys_off = struct.calcsize(_ADV_HEADER)
+    entries_off = keys_off + len(key_recs)
+    strings_off = entries_off + len(entry_recs)
+    manifest_off = strings_off + len(strings)
+    header = struct.pack(
+        _ADV_HEADER, _ADV_MAGIC, len(by_key), keys_off, entries_off, strings_off, manifest_off, len(manifest_raw)
+    )
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        for part in (header, key_recs, entry_recs, strings, manifest_raw):
+            f.write(part)
+    os.replace(tmp, path)
+
+
+class AdvisoryIndex:
+    """
+    Index upozornění namapovaný do paměti (mmap, jen čtení).
+
+    lookup() hledá klíč "ekosystém\0jméno" binárním půlením přímo v mmap
+    a porovná verzi s intervaly balíčku (compare_versions) – z disku se
+    čtou jen stránky, na které se sáhne, nic se nenačítá celé.
+    """
+
+    def __init__(self, path: str) -> None:
+        import mmap
+        import struct
+
+        self.path = path
+        self._details: Dict[int, Dict[str, Any]] = {}
+        self._key = struct.Struct(_ADV_KEY)
+        self._entry = struct.Struct(_ADV_ENTRY)
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            (magic, self.n_keys, self._keys_off, self._entries_off, self._strings_off,
+             manifest_off, manifest_len) = struct.unpack_from(_ADV_HEADER, self._mm, 0)
+            if magic != _ADV_MAGIC:
+                raise ValueError(f"{path} is not an advisory index")
+            self.manifest = json.loads(self._mm[manifest_off : manifest_off + manifest_len])
+        except (struct.error, ValueError):
+            self._mm.close()
+            raise ValueError(f"{path} is not a valid advisory index")
+
+    def close(self) -> None:
+        self._mm.close()
+
+    def _str(self, off: int, length: int) -> bytes:
+        start = self._strings_off + off
+        return self._mm[start : start + length]
+
+    def _find(self, key: bytes) -> Optional[Tuple[int, int]]:
+        lo, hi = 0, self.n_keys
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k_off, k_len, first, count = self._key.unpack_from(self._mm, self._keys_off + mid * self._key.size)
+            k = self._str(k_off, k_len)
+            if k == key:
+                return first, count
+            if k < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return None
+
+    def lookup(self, ecosystem: str, name: str, version: str) -> List[Dict[str, Any]]:
+        """Upozornění, do jejichž rozsahu verze spadá: [{id, summary, aliases, severity, fixed}]."""
+        found = self._find(f"{ecosystem}\0{_osv_name(ecosystem, name)}".encode("utf-8"))
+        if found is None:
+            return []
+        first, count = found
+        hits: Dict[Tuple[int, int], List[str]] = {}
+        for i in range(first, first + count):
+            adv_off, adv_len, lo_off, lo_len, hi_off, hi_len, flags = self._entry.unpack_from(
+                self._mm, self._entries_off + i * self._entry.size
+            )
+            if lo_len and compare_versions(version, self._str(lo_off, lo_len).decode("utf-8")) < 0:
+                continue
+            if hi_len:
+                hi = self._str(hi_off, hi_len).decode("utf-8")
+                cmp = compare_versions(version, hi)
+                if cmp > 0 or (cmp == 0 and not flags & ADV_HI_INCLUSIVE):
+                    continue
+            fixed = hits.setdefault((adv_off, adv_len), [])
+            if hi_len and not flags & ADV_HI_INCLUSIVE:
+                fixed.append(hi)
+        result = []
+        for (adv_off, adv_len), fixed in hits.items():
+            detail = self._details.get(adv_off)
+            if detail is None:
+                detail = self._details[adv_off] = json.loads(self._str(adv_off, adv_len))
+            result.append(dict(detail, fixed=fixed))
+        return result
+
+
+def advisory_index_path(db_dir: str) -> str:
+    """Index pro databázi db_dir: výchozí ADVISORY_INDEX, jiné adresáře mají vlastní (podle hashe cesty)."""
+    db_dir = os.path.abspath(os.path.expanduser(db_dir))
+    if db_dir == os.path.abspath(ADVISORY_DIR):
+        return ADVISORY_INDEX
+    import hashlib
+
+    digest = hashlib.sha1(db_dir.encode("utf-8", "surrogateescape")).hexdigest()[:16]
+    return os.path.join(CACHE_DIR, f"advisories-{digest}.idx")
+
+
+def update_advisory_index(db_dir: str = ADVISORY_DIR, index_path: Optional[str] = None) -> Optional[AdvisoryIndex]:
+    """
+    Otevře index upozornění; když se dumpy v db_dir změnily, inkrementálně ho přestaví.
+    Bez index_path se použije advisory_index_path(db_dir), takže střídání
+    několika --advisory-db index nepřestavuje.
+
+    Manifest ({cesta: [mtime_ns, size]}) je uložený v indexu, takže běh bez
+    změn jen stat-ne soubory a namapuje index. Při změně se znovu čtou jen
+    změněné dumpy – rozparsované intervaly ostatních jsou v <index>.state.
+    Bez databáze vrací None.
+    """
+    sources = _advisory_sources(db_dir)
+    if not sources:
+        return None
+    if index_path is None:
+        index_path = advisory_index_path(db_dir)
+    manifest = {"version": ADVISORY_INDEX_VERSION, "files": sources}
+    try:
+        index = AdvisoryIndex(index_path)
+    except (OSError, ValueError):
+        index = None
+    if index is not None:
+        if index.manifest == manifest:
+            return index
+        index.close()
+
+    state_path = index_path + ".state"
+    try:
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        if state.get("version") != ADVISORY_INDEX_VERSION:
+            state = {}
+    except (OSError, ValueError):
+        state = {}
+    cached_files = state.get("files", {}) if isinstance(state, dict) else {}
+
+    files: Dict[str, Any] = {}
+    reread = 0
+    for path, fp in sorted(sources.items()):
+        cached = cached_files.get(path)
+        if cached is not None and cached.get("fp") == fp:
+            files[path] = cached
+            continue
+        details, intervals = _parse_osv_file(path)
+        files[path] = {"fp": fp, "details": details, "intervals": intervals}
+        reread += 1
+
+    details_all: Dict[str, Dict[str, Any]] = {}
+    intervals_all: List[List[Any]] = []
+    for entry in files.values():
+        details_all.update(entry["details"])
+        intervals_all.extend(entry["intervals"])
+    try:
+        write_advisory_index(index_path, intervals_all, details_all, manifest)
+        tmp = state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": ADVISORY_INDEX_VERSION, "files": files}, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, state_path)
+    except OSError as e:
+        logger.warning("Unable to write advisory index %s: %s", index_path, e)
+        return None
+    logger.info(
+        "Advisory index: %d advisories, %d version ranges (%d of %d dumps re-read)",
+        len(details_all), len(intervals_all), reread, len(sources),
+    )
+    return AdvisoryIndex(index_path)
+
+
+def match_advisories(inventory: Dict[str, Any], index: AdvisoryIndex) -> List[Dict[str, Any]]:
+    """
+    Porovná všechny balíčky inventáře (pkg, system_pip, venv) s indexem.
+
+    Vrací issue "vulnerable_package" pro každou dvojici (balíček ve zdroji,
+    upozornění). Stejné (ekosystém, jméno, verze) ve více venv se hledá
+    jen jednou.
+    """
+    issues: List[Dict[str, Any]] = []
+    memo: Dict[Tuple[str, str, str], List[Dict[str, Any]]] = {}
+
+    def _check(source: str, pkgs: List[Dict[str, Any]], **extra: Any) -> None:
+        eco = ADVISORY_ECOSYSTEMS[source]
+        for p in pkgs:
+            name, version = p.get("name"), p.get("version")
+            if not name or not version:
+                continue
+            key = (eco, name, version)
+            hits = memo.get(key)
+            if hits is None:
+                hits = memo[key] = index.lookup(eco, name, version)
+            for adv in hits:
+                issues.append(dict(
+                    {"category": "vulnerable_package", "cmd": [], "rc": -1, "stderr": adv["summary"], "source": source},
+                    **extra,
+                    package=name,
+                    version=version,
+                    advisory=adv["id"],
+                    aliases=adv["aliases"],
+                    severity=adv["severity"],
+                    fixed=adv["fixed"],
+                ))
+
+    _check("pkg", inventory.get("pkg", []))
+    _check("system_pip", inventory.get("system_pip", []))
+    for vname, entry in inventory.get("venvs", {}).items():
+        _check("venv", entry.get("packages", []), venv=vname)
+    return issues
+
+
+def check_inventory_advisories(inventory: Dict[str, Any], db_dir: str = ADVISORY_DIR) -> List[Dict[str, Any]]:
+    """update_advisory_index + match_advisories; bez databáze v db_dir nic nedělá."""
+    with timed("phase", "advisories"):
+        index = update_advisory_index(db_dir)
+        if index is None:
+            logger.debug("No advisory database in %s, skipping vulnerability check", db_dir)
+            return []
+        try:
+            issues = match_advisories(inventory, index)
+        finally:
+            index.close()
+    if issues:
+        logger.warning("%d installed packages match known advisories", len({(i["source"], i.get("venv"), i["package"]) for i in issues}))
+    return issues
+
+# -------------------------------------------------------------
+# Plán upgradu (--plan / --apply-plan)
+# -------------------------------------------------------------
+
+def load_upgrade_stats(path: str = UPGRADE_STATS) -> Dict[str, Any]:
+    """{"version", "values": {klíč: hodnota}, "samples": {klíč: počet}}; chybějící klíče z UPGRADE_STATS_DEFAULT."""
+    data: Any = None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        pass
+    if not isinstance(data, dict) or data.get("version") != UPGRADE_STATS_VERSION:
+        data = {"version": UPGRADE_STATS_VERSION, "values": {}, "samples": {}}
+    for key, value in UPGRADE_STATS_DEFAULT.items():
+        data["values"].setdefault(key, value)
+    return data
+
+
+def learn_upgrade_stats(
+    timings: Dict[str, Any],
+    diff: Dict[str, Any],
+    prefetch: Optional[Dict[str, Any]] = None,
+    path: str = UPGRADE_STATS,
+) -> Dict[str, Any]:
+    """
+    Zpřesní odhady z doběhnutého upgradu (režim D nebo --apply-plan).
+
+    Počty změněných balíčků bere z diffu proti minulému inventáři (jen zdroje
+    se statusem "changed"), časy z fází timings: pkg.upgrade (apt)
+    a pip_upgrade:<venv|system> (pip; pole "built" = sestavené wheely).
+    Rychlost stahování se učí jen z prefetch (čisté stahování bez instalace).
+    Hodnoty jsou klouzavé průměry s vahou UPGRADE_STATS_ALPHA.
+    """
+    data = load_upgrade_stats(path)
+    values, samples = data["values"], data["samples"]
+
+    def _learn(key: str, value: float) -> None:
+        if value <= 0:
+            return
+        n = samples.get(key, 0)
+        values[key] = round(value if n == 0 else (1 - UPGRADE_STATS_ALPHA) * values[key] + UPGRADE_STATS_ALPHA * value, 3)
+        samples[key] = n + 1
+
+    def _changed(source: str) -> int:
+        e = diff.get("sources", {}).get(source)
+        if not e or e["status"] != "changed":
+            return 0
+        return len(e["added"]) + len(e["upgraded"]) + len(e["downgraded"])
+
+    phases = timings.get("phases", [])
+    n = _changed("pkg")
+    wall = sum(r["wall"] for r in phases if r["name"] == "pkg.upgrade")
+    if n and wall:
+        _learn("apt_package", wall / n)
+    for r in phases:
+        if not r["name"].startswith("pip_upgrade:"):
+            continue
+        vname = r["name"].split(":", 1)[1]
+        n = _changed("system_pip" if vname == "system" else "venv:" + vname)
+        if not n:
+            continue
+        built = min(r.get("built", 0), n)
+        if built:
+            _learn("pip_build", max(0.0, r["wall"] - (n - built) * values["pip_package"]) / built)
+        else:
+            _learn("pip_package", r["wall"] / n)
+    if prefetch and prefetch.get("bytes") and prefetch.get("download_seconds"):
+        _learn("bytes_per_second", prefetch["bytes"] / prefetch["download_seconds"])
+    if samples:
+        safe_write_json(path, data)
+    return data
+
+
+def _download_size(url: str, timeout: float = MIRROR_PROBE_TIMEOUT) -> Optional[int]:
+    """Bajtů ke stažení: file:// (wheelhouse) = 0, http(s) podle HEAD Content-Length; None = nezjištěno."""
+    import urllib.parse
+    import urllib.request
+
+    scheme = urllib.parse.urlsplit(url).scheme
+    if scheme == "file":
+        return 0
+    if scheme not in ("http", "https"):
+        return None
+    req = urllib.request.Request(url, method="HEAD", headers={"User-Agent": "Termux-Updater"})
+    try:
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            length = resp.headers.get("Content-Length")
+    except Exception as e:
+        logger.debug("Unable to get size of %s: %s", url, e)
+        return None
+    return int(length) if length and length.isdigit() else None
+
+
+async def pip_upgrade_plan(
+    pip_exe: str,
+    installed: Dict[str, str],
+    wheelhouse: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Plán upgradu jednoho pipu: `pip list --outdated` a pak
+    `pip install --dry-run --report -` s jméno==nejnovější verze.
+
+    Report obsahuje i nové / upgradované závislosti a odkud se balíček vezme;
+    co není wheel (sdist, adresář), se bude sestavovat ("build": True).
+    installed: {kanonické jméno: verze} pro pole "current".
+
+    Vrací ([{name, current, target, build, url, download_bytes}], issue).
+    pip bez --report (< 22.2) vrátí aspoň plán z --outdated bez velikostí
+    a issue "pip_plan".
+    """
+    import urllib.parse
+
+    outdated, issue = await pip_outdated(pip_exe, dry_run=False)
+    if issue or not outdated:
+        return [], issue
+    cmd = [pip_exe, "install", "--dry-run", "--quiet", "--report", "-"]
+    if wheelhouse and os.path.isdir(wheelhouse):
+        cmd += ["--find-links", wheelhouse]
+    specs = [f"{p['name']}=={p['latest_version']}" for p in outdated if p.get("latest_version")]
+    rc, out, err = await run_cmd_async(cmd + specs, timeout=CMD_TIMEOUTS["pip"])
+    try:
+        report = json.loads(out) if rc == 0 else None
+    except ValueError as e:
+        report, err = None, f"parse error: {e}; raw: {out[:200]}"
+    if not isinstance(report, dict):
+        fallback = [
+            {"name": p["name"], "current": p.get("version"), "target": p.get("latest_version"),
+             "build": None, "url": None, "download_bytes": None}
+            for p in outdated
+        ]
+        return fallback, {"category": "pip_plan", "cmd": cmd, "rc": rc, "stderr": err}
+
+    plan: List[Dict[str, Any]] = []
+    for item in report.get("install", []):
+        meta = item.get("metadata") or {}
+        info = item.get("download_info") or {}
+        url = info.get("url") or ""
+        if not meta.get("name"):
+            continue
+        plan.append({
+            "name": meta["name"],
+            "current": installed.get(canonical_pkg_name(meta["name"])),
+            "target": meta.get("version"),
+            "build": "dir_info" in info or not urllib.parse.urlsplit(url).path.endswith(".whl"),
+            "url": url,
         })
+    sizes = await asyncio.gather(*(asyncio.to_thread(_download_size, p["url"]) for p in plan))
+    for p, size in zip(plan, sizes):
+        p["download_bytes"] = size
+    plan.sort(key=lambda p: canonical_pkg_name(p["name"]))
+    return plan, None
 
-    return packages, issues
+
+def _plan_source(source: str, packages: List[Dict[str, Any]], stats: Dict[str, float], **extra: Any) -> Dict[str, Any]:
+    """Položka plánu pro jeden zdroj: balíčky, součty a odhad doby (s)."""
+    sizes = [p.get("download_bytes") for p in packages]
+    download = sum(size for size in sizes if size)
+    builds = sum(1 for p in packages if p.get("build"))
+    if source == "pkg":
+        estimate = len(packages) * stats["apt_package"]
+    else:
+        estimate = builds * stats["pip_build"] + (len(packages) - builds) * stats["pip_package"]
+    estimate += download / stats["bytes_per_second"]
+    entry = {"source": source}
+    entry.update(extra)
+    entry.update({
+        "packages": packages,
+        "builds": builds,
+        "download_bytes": download,
+        "unknown_sizes": sum(1 for size in sizes if size is None),
+        "estimate_seconds": round(estimate, 1),
+    })
+    return entry
 
 
-def pip_list(pip_exe: str, dry_run: bool) -> Tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]:
+async def build_upgrade_plan_async(
+    mode: str,
+    venv_dir: str,
+    venv_roots: Optional[List[str]] = None,
+    venv_depth: int = VENV_MAX_DEPTH,
+    venv_prune: Tuple[str, ...] = VENV_PRUNE,
+    use_cache: bool = True,
+    wheelhouse: Optional[str] = WHEELHOUSE,
+    locks: Optional[LockManager] = None,
+    stats_path: str = UPGRADE_STATS,
+) -> Dict[str, Any]:
     """
-    `pip list --format=json`
+    Plán upgradu bez instalace (--plan) pro zdroje podle režimu (A–D).
+
+    pkg: `pkg update` (jen seznamy balíčků), apt_upgrade_plan a
+    apt_download_sizes. pip: pip_upgrade_plan; identické venv
+    (group_venvs) se plánují jednou na leaderu skupiny. Odhad doby
+    vychází z load_upgrade_stats (naměřeno v minulých bězích).
+
+    Vrací JSON plánu: {version, generated, host, mode, sources: [...],
+    download_bytes, estimate_seconds, stats, issues}; apply_upgrade_plan
+    ho později provede přesně (pevné verze).
     """
-    cmd = [pip_exe, "list", "--format=json"]
-    rc, out, err = run_cmd(cmd, dry_run)
-    if rc in (-1, 0):
-        if dry_run:
-            return [], None
+    stats = load_upgrade_stats(stats_path)["values"]
+    issues: List[Dict[str, Any]] = []
+    sources: List[Dict[str, Any]] = []
+
+    async def _pkg() -> None:
+        pkg_cmd = detect_package_manager()
+        if pkg_cmd not in ("pkg", "apt") or not shutil.which("apt-get"):
+            issues.append({
+                "category": "apt_plan",
+                "cmd": ["apt-get", "-s", "full-upgrade"],
+                "rc": 127,
+                "stderr": f"apt-get not available for {pkg_cmd}, pkg source not planned",
+            })
+            return
         try:
-            data = json.loads(out)
-        except Exception as e:
-            return [], {
-                "category": "pip_list_parse",
-                "cmd": cmd,
-                "rc": rc,
-                "stderr": f"parse error: {e}; raw: {out[:200]}",
-            }
-        pkgs = [{"name": p.get("name"), "version": p.get("version")} for p in data]
-        return pkgs, None
+            async with maybe_locked_async(locks, "pkg"):
+                with timed("phase", "plan:pkg"):
+                    await _pkg_step("pkg.update", "pkg_update", [pkg_cmd, "update", "-y"], False, None, issues)
+                    (apt_plan, plan_issue), (sizes, size_issue) = await asyncio.gather(
+                        apt_upgrade_plan(False), apt_download_sizes(False)
+                    )
+        except LockTimeout as e:
+            issues.append({"category": "lock_timeout", "cmd": [], "rc": -1, "stderr": str(e), "resource": "pkg"})
+            return
+        issues.extend(it for it in (plan_issue, size_issue) if it)
+        for p in apt_plan:
+            p["download_bytes"] = sizes.get(p["name"], 0)
+        if apt_plan:
+            sources.append(_plan_source("pkg", apt_plan, stats))
 
-    return [], {"category": "pip_exec", "cmd": cmd, "rc": rc, "stderr": err}
+    async def _installed(pip_exe: str, include_user: bool = False) -> Tuple[List[Dict[str, str]], Optional[Dict[str, Any]]]:
+        resource = "pip:system" if include_user else "venv:" + os.path.dirname(os.path.dirname(os.path.abspath(pip_exe)))
+        try:
+            async with maybe_locked_async(locks, resource, shared=True):
+                return await inventory_list(pip_exe, False, "metadata", include_user)
+        except LockTimeout as e:
+            return [], {"category": "lock_timeout", "cmd": [], "rc": -1, "stderr": str(e), "resource": resource}
+
+    async def _pip(source: str, pip_exe: str, pkgs: List[Dict[str, str]], **extra: Any) -> List[Dict[str, Any]]:
+        installed = {canonical_pkg_name(p["name"]): p.get("version") for p in pkgs if p.get("name")}
+        with timed("phase", "plan:" + source, pip=pip_exe):
+            plan, issue = await pip_upgrade_plan(pip_exe, installed, wheelhouse)
+        if issue:
+            issues.append(dict(issue, **extra))
+        if plan:
+            sources.append(_plan_source(source, plan, stats, pip=pip_exe, **extra))
+        return plan
+
+    async def _system_pip() -> None:
+        sys_pip = find_system_pip()
+        if not sys_pip:
+            issues.append({"category": "system_pip_missing", "cmd": ["which pip3"], "rc": 127, "stderr": "system pip not found in PATH"})
+            return
+        pkgs, issue = await _installed(sys_pip, include_user=True)
+        if issue:
+            issues.append(issue)
+        else:
+            await _pip("system_pip", sys_pip, pkgs)
+
+    async def _venv_group(group: Dict[str, Any], venvs: Dict[str, Dict[str, Any]]) -> None:
+        leader, *members = group["members"]
+        plan = await _pip("venv:" + leader, venvs[leader]["pip"], venvs[leader]["packages"], venv=leader)
+        for vname in members:
+            if plan:
+                # stejné soubory se podruhé nestahují (pip cache / wheelhouse)
+                copied = [dict(p, download_bytes=0) for p in plan]
+                sources.append(_plan_source("venv:" + vname, copied, stats, pip=venvs[vname]["pip"], venv=vname))
+
+    async def _venvs() -> None:
+        roots = [venv_dir] + [r for r in (venv_roots or []) if r != venv_dir]
+        venv_pips = discover_venvs(
+            roots, max_depth=venv_depth, prune=venv_prune,
+            cache_path=VENV_DISCOVERY_CACHE if use_cache else None,
+        )
+        results = await asyncio.gather(*(_installed(pip_exe) for _, pip_exe in venv_pips))
+        venvs: Dict[str, Dict[str, Any]] = {}
+        for (vname, pip_exe), (pkgs, issue) in zip(venv_pips, results):
+            if issue:
+                issues.append(dict(issue, venv=vname))
+            else:
+                venvs[vname] = {"pip": pip_exe, "packages": pkgs}
+        await asyncio.gather(*(_venv_group(g, venvs) for g in group_venvs(venvs)))
 
+    tasks = [_pkg()]
+    if mode in ("B", "C", "D"):
+        tasks.append(_system_pip())
+    if mode in ("C", "D"):
+        tasks.append(_venvs())
+    await asyncio.gather(*tasks)
+
+    sources.sort(key=lambda e: (e["source"] != "pkg", e["source"] != "system_pip", e["source"]))
+    return {
+        "version": PLAN_VERSION,
+        "generated": timestamp_now_iso(),
+        "host": os.uname().nodename if hasattr(os, "uname") else "termux",
+        "mode": mode,
+        "sources": sources,
+        "download_bytes": sum(e["download_bytes"] for e in sources),
+        "estimate_seconds": round(sum(e["estimate_seconds"] for e in sources), 1),
+        "stats": stats,
+        "issues": issues,
+    }
+
+
+def build_upgrade_plan(**kwargs: Any) -> Dict[str, Any]:
+    """Synchronní obal nad build_upgrade_plan_async."""
+    return asyncio.run(build_upgrade_plan_async(**kwargs))
 
-def pip_upgrade(pip_exe: str, dry_run: bool) -> Optional[Dict[str, Any]]:
+
+def log_plan_summary(plan: Dict[str, Any]) -> None:
+    """Souhrn plánu pro --plan."""
+    total = sum(len(e["packages"]) for e in plan["sources"])
+    logger.info(
+        "Upgrade plan: %d packages in %d sources, %d B to download, estimated %.0fs",
+        total, len(plan["sources"]), plan["download_bytes"], plan["estimate_seconds"],
+    )
+    for e in plan["sources"]:
+        logger.info(
+            "  %-30s %4d packages %3d builds %12d B  ~%.0fs",
+            e["source"], len(e["packages"]), e["builds"], e["download_bytes"], e["estimate_seconds"],
+        )
+
+
+async def apply_upgrade_plan_async(
+    plan: Dict[str, Any],
+    dry_run: bool = False,
+    chunk_size: int = PIP_UPGRADE_CHUNK,
+    wheelhouse: Optional[str] = WHEELHOUSE,
+    locks: Optional[LockManager] = None,
+    journal: Optional[StepJournal] = None,
+) -> List[Dict[str, Any]]:
     """
-    `pip install --upgrade` pro všechny nainstalované balíčky.
-    Používá se jen v režimu D a nikdy s --dry-run.
+    Provede plán z build_upgrade_plan přesně: apt i pip instalují pevné verze.
+
+    Zdroj, jehož nainstalované verze se od plánu liší (mezitím ho změnil
+    jiný běh), se přeskočí s issue "plan_stale". pkg a venv běží souběžně,
+    system pip až po pkg (apt mění systémové site-packages). Kroky mají
+    stejná jména jako v režimu D (pkg.upgrade, pip_upgrade:<venv|system>),
+    takže fungují --resume i learn_upgrade_stats.
+
+    Vrací seznam issues.
     """
-    if dry_run:
+    if plan.get("version") != PLAN_VERSION:
+        raise ValueError(f"unsupported plan version {plan.get('version')!r}")
+    issues: List[Dict[str, Any]] = []
+
+    def _stale(entry: Dict[str, Any], installed: Dict[str, Optional[str]]) -> bool:
+        changed = [
+            {"package": p["name"], "expected": p.get("current"), "installed": installed.get(canonical_pkg_name(p["name"]))}
+            for p in entry["packages"]
+            if installed.get(canonical_pkg_name(p["name"])) != p.get("current")
+        ]
+        if changed:
+            logger.warning("%s changed since the plan was made, skipping it", entry["source"])
+            issues.append({
+                "category": "plan_stale",
+                "cmd": [],
+                "rc": -1,
+                "stderr": f"{len(changed)} packages differ from the plan",
+                "source": entry["source"],
+                "packages": changed[:20],
+            })
+        return bool(changed)
+
+    async def _pkg(entry: Dict[str, Any]) -> None:
+        try:
+            async with maybe_locked_async(locks, "pkg"):
+                dpkg = read_dpkg_status(DPKG_STATUS) or []
+                if _stale(entry, {canonical_pkg_name(p["name"]): p.get("version") for p in dpkg}):
+                    return
+                # nové závislosti si apt dotáhne sám (ve verzi z plánu – stejné seznamy)
+                targets = [p for p in entry["packages"] if p.get("current") is not None]
+                if not targets:
+                    logger.info("Plan for pkg only adds new dependencies, nothing to upgrade")
+                    return
+                # install by balíčky označil jako ručně instalované (a jejich závislosti
+                # by pak autoremove nikdy neuklidil) – --only-upgrade a obnova auto značek
+                rc, out, _ = await run_cmd_async(["apt-mark", "showauto"], dry_run, timeout=CMD_TIMEOUTS["pkg"])
+                auto = set(out.split()) if rc == 0 else set()
+                cmd = ["apt-get", "-y", "--only-upgrade", "install"] + [f"{p['name']}={p['target']}" for p in targets]
+                if await _pkg_step("pkg.upgrade", "pkg_upgrade", cmd, dry_run, journal, issues):
+                    was_auto = sorted(p["name"] for p in targets if p["name"] in auto)
+                    if was_auto:
+                        await run_cmd_async(["apt-mark", "auto"] + was_auto, dry_run, timeout=CMD_TIMEOUTS["pkg"])
+        except LockTimeout as e:
+            issues.append({"category": "lock_timeout", "cmd": [], "rc": -1, "stderr": str(e), "resource": "pkg"})
+
+    async def _pip(entry: Dict[str, Any]) -> None:
+        vname = entry.get("venv")
+        step = "pip_upgrade:" + (vname or "system")
+        if journal is not None and journal.done(step):
+            logger.info("Skipping %s (completed in interrupted run)", step)
+            return
+        pip_exe = entry["pip"]
+        resource = "venv:" + os.path.dirname(os.path.dirname(os.path.abspath(pip_exe))) if vname else "pip:system"
+        try:
+            async with maybe_locked_async(locks, resource):
+                pkgs, issue = await inventory_list(pip_exe, False, "metadata", include_user=vname is None)
+                if issue:
+                    issues.append(dict(issue, venv=vname) if vname else issue)
+                    return
+                if _stale(entry, {canonical_pkg_name(p["name"]): p.get("version") for p in pkgs if p.get("name")}):
+                    return
+                pinned = [{"name": p["name"], "latest_version": p["target"]} for p in entry["packages"]]
+                with timed("phase", step, pip=pip_exe) as rec:
+                    up_issues = await pip_upgrade(pip_exe, dry_run, chunk_size, wheelhouse, outdated=pinned, stats=rec)
+        except LockTimeout as e:
+            up_issues = [{"category": "lock_timeout", "cmd": [], "rc": -1, "stderr": str(e), "resource": resource}]
+        issues.extend(dict(it, venv=vname) if vname else it for it in up_issues)
+        if journal is not None and not up_issues and not dry_run:
+            journal.mark(step)
+
+    entries = {e["source"]: e for e in plan.get("sources", [])}
+
+    async def _pkg_then_system() -> None:
+        if "pkg" in entries:
+            await _pkg(entries["pkg"])
+        if "system_pip" in entries:
+            await _pip(entries["system_pip"])
+
+    await asyncio.gather(
+        _pkg_then_system(),
+        *(_pip(e) for src, e in entries.items() if src.startswith("venv:")),
+    )
+    return issues
+
+
+def apply_upgrade_plan(plan: Dict[str, Any], **kwargs: Any) -> List[Dict[str, Any]]:
+    """Synchronní obal nad apply_upgrade_plan_async."""
+    return asyncio.run(apply_upgrade_plan_async(plan, **kwargs))
+
+
+# -------------------------------------------------------------
+# Daemon – inventář v paměti, dotazy přes Unix socket
+# -------------------------------------------------------------
+
+def emit_inventory(
+    inventory: Dict[str, Any],
+    issues: List[Dict[str, Any]],
+    sink: Callable[[str, Dict[str, Any]], None],
+) -> None:
+    """Pošle hotový inventář do sink ve stejném tvaru jako build_inventory_and_issues."""
+    for source in ("pkg", "system_pip"):
+        for p in inventory.get(source, []):
+            sink("package", dict({"source": source}, **p))
+    for vname, entry in inventory.get("venvs", {}).items():
+        for p in entry["packages"]:
+            sink("package", dict({"source": "venv", "venv": vname}, **p))
+        sink("venv", {"venv": vname, "pip": entry["pip"], "packages": len(entry["packages"])})
+    for group in inventory.get("venv_groups", []):
+        sink("venv_group", group)
+    for it in issues:
+        sink("issue", it)
+
+
+class InventoryDaemon:
+    """
+    Drží inventář (režim A–C, bez upgradů) v paměti a odpovídá na dotazy.
+
+    Každých poll sekund porovná otisk dpkg status, nalezených venv a jejich
+    site-packages (jen stat – discover_venvs má vlastní cache); inventář se
+    přestaví jen když se něco změnilo. Přestavba používá INVENTORY_CACHE,
+    takže se znovu čtou jen změněné zdroje. Mezi dotazy se inventář drží
+    jako CompactInventory.
+
+    Protokol: jeden JSON řádek dotazu {"cmd": ...}, jeden JSON řádek
+    odpovědi. Příkazy: ping, status, inventory, refresh, shutdown.
+    """
+
+    def __init__(
+        self,
+        mode: str = "C",
+        venv_dir: str = os.path.join(HOME, "venv"),
+        venv_roots: Optional[List[str]] = None,
+        backend: str = "metadata",
+        poll: float = DAEMON_POLL,
+        venv_depth: int = VENV_MAX_DEPTH,
+        venv_prune: Tuple[str, ...] = VENV_PRUNE,
+    ) -> None:
+        self.mode = mode
+        self.roots = [os.path.abspath(r) for r in [venv_dir] + [r for r in (venv_roots or []) if r != venv_dir]]
+        self.backend = backend
+        self.venv_depth = venv_depth
+        self.venv_prune = venv_prune
+        self.poll = poll
+        self.started = timestamp_now_iso()
+        self.inventory: Optional[CompactInventory] = None
+        self.issues: List[Dict[str, Any]] = []
+        self.timings: Dict[str, Any] = {}
+        self.refreshed: Optional[str] = None
+        self.refreshes = 0
+        self._signature: Any = None
+        self._lock = asyncio.Lock()
+        self._stop = asyncio.Event()
+
+    def _watch_signature(self) -> List[Any]:
+        sig: List[Any] = [path_fingerprint([DPKG_STATUS])]
+        if self.mode in ("B", "C"):
+            sys_pip = find_system_pip()
+            sig.append(path_fingerprint(find_site_packages(sys_pip, include_user=True)) if sys_pip else None)
+        if self.mode == "C":
+            for vname, pip_exe in discover_venvs(self.roots, max_depth=self.venv_depth, prune=self.venv_prune):
+                sig.append([vname, path_fingerprint(find_site_packages(pip_exe))])
+        return sig
+
+    async def refresh(self, force: bool = False) -> bool:
+        """Přestaví inventář, pokud se změnil otisk (nebo force). Vrací True při přestavbě."""
+        async with self._lock:
+            sig = await asyncio.to_thread(self._watch_signature)
+            if not force and self.inventory is not None and sig == self._signature:
+                return False
+            timings_reset()
+            inventory, issues = await build_inventory_and_issues_async(
+                mode=self.mode,
+                venv_dir=self.roots[0],
+                dry_run=False,
+                verbose=False,
+                do_upgrade=False,
+                backend=self.backend,
+                venv_roots=self.roots[1:],
+                venv_depth=self.venv_depth,
+                venv_prune=self.venv_prune,
+                inventory_only=True,
+            )
+            self.inventory, self.issues = CompactInventory(inventory), issues
+            self.timings = timings_report()
+            self._signature = sig
+            self.refreshed = timestamp_now_iso()
+            self.refreshes += 1
+            logger.info("Inventory refreshed in %.2fs", self.timings["total_wall"])
+            return True
+
+    def status(self) -> Dict[str, Any]:
+        counts = self.inventory.counts() if self.inventory is not None else {"pkg": 0, "system_pip": 0, "venvs": 0}
+        return {
+            "ok": True,
+            "pid": os.getpid(),
+            "started": self.started,
+            "refreshed": self.refreshed,
+            "refreshes": self.refreshes,
+            "mode": self.mode,
+            "venv_roots": self.roots,
+            "venv_depth": self.venv_depth,
+            "venv_prune": list(self.venv_prune),
+            "backend": self.backend,
+            "counts": counts,
+            "issues": len(self.issues),
+        }
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            line = await asyncio.wait_for(reader.readline(), timeout=10)
+            try:
+                cmd = json.loads(line or b"{}").get("cmd")
+            except ValueError:
+                cmd = None
+            if cmd == "ping":
+                resp: Dict[str, Any] = {"ok": True, "pid": os.getpid()}
+            elif cmd == "status":
+                resp = self.status()
+            elif cmd == "refresh":
+                await self.refresh(force=True)
+                resp = self.status()
+            elif cmd == "inventory":
+                await self.refresh()
+                inventory = self.inventory.expand() if self.inventory is not None else None
+                resp = dict(self.status(), inventory=inventory, issue_list=self.issues, timings=self.timings)
+            elif cmd == "shutdown":
+                resp = {"ok": True}
+                self.stop()
+            else:
+                resp = {"ok": False, "error": f"unknown command: {cmd!r}"}
+            writer.write(json.dumps(resp, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n")
+            await writer.drain()
+        except (OSError, asyncio.TimeoutError) as e:
+            logger.debug("Daemon client error: %s", e)
+        finally:
+            writer.close()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    async def _watch(self) -> None:
+        while not self._stop.is_set():
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error("Inventory refresh failed: %s", e)
+            try:
+                await asyncio.wait_for(self._stop.wait(), timeout=self.poll)
+            except asyncio.TimeoutError:
+                pass
+
+    async def serve(self, path: str = DAEMON_SOCKET) -> None:
+        """Poslouchá na Unix socketu path, dokud nepřijde shutdown (nebo signál)."""
+        if os.path.exists(path):
+            if daemon_request({"cmd": "ping"}, path, timeout=1) is not None:
+                raise RuntimeError(f"daemon already running on {path}")
+            os.unlink(path)  # zbytek po spadlém daemonu
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        server = await asyncio.start_unix_server(self.handle, path=path)
+        os.chmod(path, 0o600)
+        logger.info("Daemon listening on %s (pid %d)", path, os.getpid())
+        watcher = asyncio.create_task(self._watch())
+        try:
+            await self._stop.wait()
+        finally:
+            watcher.cancel()
+            server.close()
+            await server.wait_closed()
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            logger.info("Daemon stopped.")
+
+
+def daemon_request(
+    request: Dict[str, Any], path: str = DAEMON_SOCKET, timeout: float = 5.0
+) -> Optional[Dict[str, Any]]:
+    """
+    Pošle dotaz běžícímu daemonu. Vrací odpověď, nebo None, když daemon
+    neběží / neodpovídá (volající pak běží samostatně).
+    """
+    import socket
+
+    if not os.path.exists(path):
         return None
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(timeout)
+            sock.connect(path)
+            sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+        resp = json.loads(b"".join(chunks))
+    except (OSError, ValueError) as e:
+        logger.debug("Daemon at %s not available: %s", path, e)
+        return None
+    return resp if isinstance(resp, dict) else None
+
+
+def parse_daemon_args(argv: List[str]) -> argparse.Namespace:
+    p = argparse.ArgumentParser(
+        prog="aktualizator daemon",
+        description="Daemon, který drží inventář v paměti a odpovídá přes Unix socket.",
+    )
+    p.add_argument("--socket", default=DAEMON_SOCKET, help=f"Cesta k socketu (výchozí: {DAEMON_SOCKET}).")
+    p.add_argument("--mode", choices=["A", "B", "C"], default="C", help="Rozsah inventáře (jako u hlavního příkazu).")
+    p.add_argument("--venv-dir", default=os.path.join(HOME, "venv"), help="Adresář kde hledat venvs.")
+    p.add_argument("--venv-root", action="append", default=[], metavar="DIR", help="Další kořen pro venv (lze opakovat).")
+    p.add_argument("--venv-depth", type=int, default=VENV_MAX_DEPTH, metavar="N",
+                   help=f"Max. hloubka hledání venv pod kořenem (výchozí: {VENV_MAX_DEPTH}).")
+    p.add_argument("--venv-prune", action="append", default=[], metavar="PATTERN",
+                   help="Další vynechané adresáře při hledání venv (fnmatch vzor, lze opakovat).")
+    p.add_argument("--inventory-backend", choices=list(INVENTORY_BACKENDS), default="metadata")
+    p.add_argument("--poll", type=float, default=DAEMON_POLL, metavar="SEC",
+                   help=f"Interval kontroly změn (výchozí: {DAEMON_POLL:.0f} s).")
+    p.add_argument("--jobs", type=int, default=default_jobs(), metavar="N")
+    p.add_argument("--query", choices=["ping", "status", "inventory", "refresh", "shutdown"], default=None,
+                   help="Neposlouchat, ale poslat dotaz běžícímu daemonu a vypsat odpověď (JSON).")
+    p.add_argument("--verbose", action="store_true")
+    return p.parse_args(argv)
+
+
+def daemon_main(argv: List[str]) -> None:
+    """Subpříkaz `daemon`."""
+    args = parse_daemon_args(argv)
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    if args.query:
+        resp = daemon_request({"cmd": args.query}, args.socket, timeout=600 if args.query in ("inventory", "refresh") else 5)
+        if resp is None:
+            resp = {"ok": False, "error": f"daemon not running on {args.socket}"}
+        json.dump(resp, sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+        if not resp.get("ok"):
+            sys.exit(1)
+        return
+
+    set_cmd_concurrency(args.jobs)
+    daemon = InventoryDaemon(
+        mode=args.mode,
+        venv_dir=args.venv_dir,
+        venv_roots=args.venv_root,
+        backend=args.inventory_backend,
+        poll=args.poll,
+        venv_depth=args.venv_depth,
+        venv_prune=VENV_PRUNE + tuple(args.venv_prune),
+    )
+
+    async def _run() -> None:
+        import signal
+
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, daemon.stop)
+        await daemon.serve(args.socket)
+
+    try:
+        asyncio.run(_run())
+    except RuntimeError as e:
+        logger.error("%s", e)
+        sys.exit(1)
+
+# -------------------------------------------------------------
+# Plánovač – fronta kroků podle nabíjení, baterie, sítě a zátěže (subpříkaz schedule)
+# -------------------------------------------------------------
 
-    pkgs, issue = pip_list(pip_exe, dry_run=False)
-    if issue:
-        return issue
-    if not pkgs:
+def _termux_api(cmd: str) -> Optional[Dict[str, Any]]:
+    """JSON objekt z příkazu Termux:API (None, když příkaz chybí, selže nebo visí)."""
+    if shutil.which(cmd) is None:
         return None
+    try:
+        proc = subprocess.run([cmd], capture_output=True, text=True, timeout=SCHEDULE_PROBE_TIMEOUT)
+        data = json.loads(proc.stdout) if proc.returncode == 0 else None
+    except (OSError, ValueError, subprocess.TimeoutExpired) as e:
+        logger.debug("%s failed: %s", cmd, e)
+        return None
+    return data if isinstance(data, dict) else None
 
-    names = [p["name"] for p in pkgs if p.get("name")]
-    if not names:
+
+def _read_sys(path: str) -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
         return None
 
-    cmd = [pip_exe, "install", "--upgrade"] + names
-    rc, out, err = run_cmd(cmd, dry_run=False)
-    if rc != 0:
-        return {"category": "pip_upgrade", "cmd": cmd, "rc": rc, "stderr": err}
-    return None
 
-# -------------------------------------------------------------
-# Repair systém – důkladná oprava Termux prostředí
-# -------------------------------------------------------------
+def probe_battery() -> Dict[str, Any]:
+    """
+    Nabíjení a stav baterie v %: termux-battery-status (Termux:API),
+    jinak /sys/class/power_supply (Linux; Android ho aplikacím většinou nedá).
+    """
+    data = _termux_api("termux-battery-status")
+    if data is not None:
+        return {
+            "charging": data.get("plugged", "UNPLUGGED") != "UNPLUGGED" or data.get("status") in ("CHARGING", "FULL"),
+            "battery": data.get("percentage"),
+        }
+    import glob
+
+    result: Dict[str, Any] = {}
+    for supply in sorted(glob.glob("/sys/class/power_supply/*")):
+        kind = _read_sys(os.path.join(supply, "type"))
+        if kind == "Battery":
+            capacity = _read_sys(os.path.join(supply, "capacity")) or ""
+            if capacity.isdigit():
+                result["battery"] = int(capacity)
+            online = _read_sys(os.path.join(supply, "status")) in ("Charging", "Full")
+        elif kind in ("Mains", "USB"):
+            online = _read_sys(os.path.join(supply, "online")) == "1"
+        else:
+            continue
+        result["charging"] = result.get("charging", False) or online
+    return result
+
+
+# Prefixy síťových rozhraní -> typ připojení (Android: wlan*, rmnet* / ccmni*)
+_NET_PREFIXES = (("wl", "wifi"), ("eth", "ethernet"), ("en", "ethernet"),
+                 ("rmnet", "mobile"), ("ccmni", "mobile"), ("ww", "mobile"))
+
+
+def probe_network() -> Dict[str, Any]:
+    """
+    Typ připojení: "wifi" | "ethernet" | "mobile" | "none".
+
+    Připojenou wifi pozná termux-wifi-connectioninfo; jinak rozhodnou
+    aktivní rozhraní v /sys/class/net. Když Termux:API hlásí, že wifi
+    připojená není, a rozhraní nejdou přečíst, bere se síť jako mobilní
+    (měřená) – radši odložit, než stahovat přes data.
+    """
+    wifi = _termux_api("termux-wifi-connectioninfo")
+    if wifi is not None and wifi.get("supplicant_state") == "COMPLETED":
+        return {"network": "wifi"}
+    try:
+        names = os.listdir("/sys/class/net")
+    except OSError:
+        return {"network": "mobile"} if wifi is not None else {}
+    kinds = set()
+    for name in names:
+        if name == "lo" or _read_sys(os.path.join("/sys/class/net", name, "operstate")) != "up":
+            continue
+        kind = next((k for prefix, k in _NET_PREFIXES if name.startswith(prefix)), "other")
+        if not (kind == "wifi" and wifi is not None):
+            kinds.add(kind)
+    for kind in ("ethernet", "wifi", "mobile"):
+        if kind in kinds:
+            return {"network": kind}
+    if kinds:
+        return {"network": "mobile"} if wifi is not None else {}  # jen tun / neznámá rozhraní
+    return {"network": "none"}
+
+
+def probe_load() -> Dict[str, Any]:
+    """Zátěž: loadavg za 1 min na jedno CPU (novější Android ho aplikacím nedá)."""
+    try:
+        return {"load": round(os.getloadavg()[0] / (os.cpu_count() or 1), 3)}
+    except OSError:
+        return {}
+
+
+# Sondy podmínek; každá vrací dict s částí hodnot (charging, battery,
+# network, metered, load). --probe NAME=CMD sondu nahradí příkazem.
+SCHEDULE_PROBES: Dict[str, Callable[[], Dict[str, Any]]] = {
+    "battery": probe_battery,
+    "network": probe_network,
+    "load": probe_load,
+}
+
+
+def command_probe(cmd: str) -> Callable[[], Dict[str, Any]]:
+    """
+    Sonda z příkazu, který vypíše JSON objekt s hodnotami podmínek,
+    např. `cat stav.json` – náhrada skutečných sond pro testy (--probe).
+    """
+    import shlex
+
+    argv = shlex.split(cmd)
+
+    def _probe() -> Dict[str, Any]:
+        proc = subprocess.run(argv, capture_output=True, text=True, timeout=SCHEDULE_PROBE_TIMEOUT, check=True)
+        data = json.loads(proc.stdout)
+        if not isinstance(data, dict):
+            raise ValueError(f"{cmd}: expected a JSON object")
+        return data
+
+    return _probe
+
+
+def read_conditions(probes: Optional[Dict[str, Callable[[], Dict[str, Any]]]] = None) -> Dict[str, Any]:
+    """
+    Spustí sondy a sloučí jejich výsledky. Hodnota, kterou žádná sonda
+    nezjistila (nebo sonda selhala), zůstane None = neznámá.
+    metered se odvodí z typu sítě, pokud ho sonda neuvedla sama.
+    """
+    cond: Dict[str, Any] = {"charging": None, "battery": None, "network": None, "metered": None, "load": None}
+    for name, probe in (SCHEDULE_PROBES if probes is None else probes).items():
+        try:
+            cond.update(probe())
+        except (OSError, ValueError, subprocess.SubprocessError) as e:
+            logger.warning("Condition probe %s failed: %s", name, e)
+    if cond["metered"] is None and cond["network"] in ("wifi", "ethernet", "mobile"):
+        cond["metered"] = cond["network"] == "mobile"
+    return cond
+
+
+def schedule_blockers(
+    kind: str, cond: Dict[str, Any], policy: Dict[str, Dict[str, Any]] = SCHEDULE_POLICY
+) -> List[str]:
+    """Proč krok druhu kind teď nemůže běžet (prázdný seznam = může)."""
+    rule = policy.get(kind, {})
+    reasons: List[str] = []
+    charging, battery, load = cond.get("charging"), cond.get("battery"), cond.get("load")
+    if rule.get("charging") and charging is False:
+        reasons.append("not charging")
+    min_battery = rule.get("min_battery")
+    if min_battery is not None and charging is not True and battery is not None and battery < min_battery:
+        reasons.append(f"battery {battery}% < {min_battery}%")
+    if rule.get("network") and cond.get("network") == "none":
+        reasons.append("offline")
+    elif rule.get("network") == "unmetered" and cond.get("metered"):
+        reasons.append(f"metered network ({cond.get('network') or 'unknown'})")
+    max_load = rule.get("max_load")
+    if max_load is not None and load is not None and load > max_load:
+        reasons.append(f"load {load:.2f} > {max_load:.2f} per CPU")
+    return reasons
+
+
+def load_schedule(path: str = SCHEDULE_QUEUE) -> List[Dict[str, Any]]:
+    """
+    Fronta plánovače: {"version": 1, "jobs": [{id, kind, added, attempts,
+    pip?, venv?, deferred?, last_error?}, ...]} v pořadí spouštění.
+    id jsou jména kroků jako v žurnálu (pkg.update, pip_upgrade:<venv>, ...).
+    """
+    try:
+        data = load_json(path)
+    except (OSError, ValueError):
+        return []
+    if not isinstance(data, dict) or data.get("version") != SCHEDULE_VERSION:
+        return []
+    return [j for j in data.get("jobs", []) if isinstance(j, dict) and j.get("id") and j.get("kind")]
+
+
+def save_schedule(jobs: List[Dict[str, Any]], path: str = SCHEDULE_QUEUE) -> None:
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"version": SCHEDULE_VERSION, "jobs": jobs}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+    except OSError as e:
+        logger.warning("Unable to write schedule queue %s: %s", path, e)
+
+
+def update_schedule(
+    job_id: str,
+    changes: Optional[Dict[str, Any]],
+    path: str = SCHEDULE_QUEUE,
+    locks: Optional[LockManager] = None,
+) -> None:
+    """Změní jeden krok fronty (changes=None ho odebere); pod zámkem "schedule"."""
+    with maybe_locked(locks, "schedule"):
+        jobs = load_schedule(path)
+        if changes is None:
+            jobs = [j for j in jobs if j["id"] != job_id]
+        else:
+            for j in jobs:
+                if j["id"] == job_id:
+                    j.update(changes)
+        save_schedule(jobs, path)
+
+
+def schedule_jobs(
+    phases: Tuple[str, ...],
+    venv_dir: str,
+    venv_roots: Optional[List[str]] = None,
+    venv_depth: int = VENV_MAX_DEPTH,
+    venv_prune: Tuple[str, ...] = VENV_PRUNE,
+    use_cache: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Kroky upgradu z režimu D pro frontu, omezené na phases (SCHEDULE_PHASES):
+    pkg = pkg update + pkg upgrade, system-pip = pip upgrade systémového
+    pipu, venvs = pip upgrade každého venv zvlášť.
+    """
+    added = timestamp_now_iso()
+
+    def _job(job_id: str, kind: str, **extra: Any) -> Dict[str, Any]:
+        return dict({"id": job_id, "kind": kind, "added": added, "attempts": 0}, **extra)
+
+    jobs: List[Dict[str, Any]] = []
+    if "pkg" in phases:
+        jobs += [_job("pkg.update", "pkg.update"), _job("pkg.upgrade", "pkg.upgrade")]
+    if "system-pip" in phases:
+        sys_pip = find_system_pip()
+        if sys_pip:
+            jobs.append(_job("pip_upgrade:system", "pip_upgrade", pip=sys_pip))
+        else:
+            logger.warning("System pip not found, not scheduling its upgrade")
+    if "venvs" in phases:
+        roots = [venv_dir] + [r for r in (venv_roots or []) if r != venv_dir]
+        for vname, pip_exe in discover_venvs(
+            roots,
+            max_depth=venv_depth,
+            prune=venv_prune,
+            cache_path=VENV_DISCOVERY_CACHE if use_cache else None,
+        ):
+            jobs.append(_job("pip_upgrade:" + vname, "pip_upgrade", pip=pip_exe, venv=vname))
+    return jobs
+
+
+def enqueue_schedule(
+    new_jobs: List[Dict[str, Any]], path: str = SCHEDULE_QUEUE, locks: Optional[LockManager] = None
+) -> int:
+    """Přidá kroky na konec fronty; kroky, které už ve frontě čekají, se nezdvojí. Vrací počet přidaných."""
+    with maybe_locked(locks, "schedule"):
+        jobs = load_schedule(path)
+        queued = {j["id"] for j in jobs}
+        added = [j for j in new_jobs if j["id"] not in queued]
+        save_schedule(jobs + added, path)
+    return len(added)
+
+
+def _schedule_waits_for(job: Dict[str, Any], queued: Any) -> Optional[str]:
+    """
+    Krok, na který job čeká: pkg upgrade na pkg update, system pip na oba
+    (apt mění systémové site-packages). Venv na pkg nečekají.
+    """
+    deps: Tuple[str, ...] = ()
+    if job["kind"] == "pkg.upgrade":
+        deps = ("pkg.update",)
+    elif job["id"] == "pip_upgrade:system":
+        deps = ("pkg.update", "pkg.upgrade")
+    return next((d for d in deps if d in queued), None)
+
+
+async def run_schedule_job(
+    job: Dict[str, Any],
+    pkg_cmd: str,
+    chunk_size: int = PIP_UPGRADE_CHUNK,
+    wheelhouse: Optional[str] = WHEELHOUSE,
+    locks: Optional[LockManager] = None,
+) -> List[Dict[str, Any]]:
+    """Provede jeden krok fronty se zámkem jeho prostředku. Vrací issues (prázdné = hotovo)."""
+    issues: List[Dict[str, Any]] = []
+    if job["kind"] == "pip_upgrade":
+        pip_exe = job["pip"]
+        if not os.path.exists(pip_exe):
+            logger.warning("%s no longer exists, dropping %s", pip_exe, job["id"])
+            return []
+        resource = "venv:" + os.path.dirname(os.path.dirname(os.path.abspath(pip_exe))) if job.get("venv") else "pip:system"
+    else:
+        resource = "pkg"
+    try:
+        async with maybe_locked_async(locks, resource):
+            if job["kind"] == "pip_upgrade":
+                with timed("phase", job["id"], pip=job["pip"]) as rec:
+                    issues = await pip_upgrade(job["pip"], False, chunk_size, wheelhouse, stats=rec)
+            else:
+                verb = job["kind"].split(".", 1)[1]
+                await _pkg_step(job["id"], "pkg_" + verb, [pkg_cmd, verb, "-y"], False, None, issues)
+    except LockTimeout as e:
+        issues = [{"category": "lock_timeout", "cmd": [], "rc": -1, "stderr": str(e), "resource": resource}]
+    if job.get("venv"):
+        issues = [dict(it, venv=job["venv"]) for it in issues]
+    return issues
+
+
+def run_schedule(
+    path: str = SCHEDULE_QUEUE,
+    probes: Optional[Dict[str, Callable[[], Dict[str, Any]]]] = None,
+    policy: Dict[str, Dict[str, Any]] = SCHEDULE_POLICY,
+    chunk_size: int = PIP_UPGRADE_CHUNK,
+    wheelhouse: Optional[str] = WHEELHOUSE,
+    locks: Optional[LockManager] = None,
+    queue_locks: Optional[LockManager] = None,
+) -> Tuple[int, int, List[Dict[str, Any]]]:
+    """
+    Jedno kolo plánovače: projde frontu v pořadí a spustí kroky, jejichž
+    podmínky (schedule_blockers) jsou splněné; ostatní odloží.
+
+    Podmínky se čtou znovu po každém spuštěném kroku (upgrade trvá
+    a telefon mezitím mohl odpojit nabíječku). Krok se z fronty odebere
+    až po úspěchu nebo po SCHEDULE_MAX_ATTEMPTS neúspěších, takže
+    odložené kroky i kroky přerušené zabitím procesu příště pokračují.
+    Obsazený zámek prostředku krok jen odloží (nepočítá se jako pokus).
+
+    Vrací (hotové kroky, kroky zbývající ve frontě, issues).
+    """
+    with maybe_locked(queue_locks, "schedule"):
+        jobs = load_schedule(path)
+    pkg_cmd = detect_package_manager()
+    finished: set = set()
+    done = 0
+    issues: List[Dict[str, Any]] = []
+    cond: Optional[Dict[str, Any]] = None
+
+    for job in jobs:
+        dep = _schedule_waits_for(job, {j["id"] for j in jobs if j["id"] not in finished})
+        if dep is not None:
+            logger.info("Deferring %s: waiting for %s", job["id"], dep)
+            update_schedule(job["id"], {"deferred": "waiting for " + dep}, path, queue_locks)
+            continue
+        if cond is None:
+            cond = read_conditions(probes)
+            logger.debug("Conditions: %s", cond)
+        reasons = schedule_blockers(job["kind"], cond, policy)
+        if reasons:
+            logger.info("Deferring %s: %s", job["id"], ", ".join(reasons))
+            update_schedule(job["id"], {"deferred": ", ".join(reasons)}, path, queue_locks)
+            continue
+
+        logger.info("Running %s", job["id"])
+        job_issues = asyncio.run(run_schedule_job(job, pkg_cmd, chunk_size, wheelhouse, locks))
+        cond = None
+        if not job_issues:
+            finished.add(job["id"])
+            done += 1
+            update_schedule(job["id"], None, path, queue_locks)
+        elif all(it["category"] == "lock_timeout" for it in job_issues):
+            logger.info("Deferring %s: %s", job["id"], job_issues[0]["stderr"])
+            update_schedule(job["id"], {"deferred": "locked"}, path, queue_locks)
+        else:
+            issues.extend(job_issues)
+            attempts = job.get("attempts", 0) + 1
+            if attempts >= SCHEDULE_MAX_ATTEMPTS:
+                logger.warning("%s failed %d times, removing it from the queue", job["id"], attempts)
+                finished.add(job["id"])
+                update_schedule(job["id"], None, path, queue_locks)
+            else:
+                update_schedule(
+                    job["id"],
+                    {"attempts": attempts, "last_error": job_issues[0]["category"], "deferred": "failed"},
+                    path,
+                    queue_locks,
+                )
+    return done, len(jobs) - len(finished), issues
+
+
+def schedule_status(
+    path: str = SCHEDULE_QUEUE,
+    probes: Optional[Dict[str, Callable[[], Dict[str, Any]]]] = None,
+    policy: Dict[str, Dict[str, Any]] = SCHEDULE_POLICY,
+) -> Dict[str, Any]:
+    """Aktuální podmínky a fronta; u každého kroku, co by mu teď bránilo ("blocked")."""
+    cond = read_conditions(probes)
+    jobs = load_schedule(path)
+    queued = {j["id"] for j in jobs}
+    for job in jobs:
+        dep = _schedule_waits_for(job, queued)
+        job["blocked"] = ["waiting for " + dep] if dep else schedule_blockers(job["kind"], cond, policy)
+    return {"conditions": cond, "policy": policy, "jobs": jobs}
+
+
+def parse_schedule_args(argv: List[str]) -> argparse.Namespace:
+    p = argparse.ArgumentParser(
+        prog="aktualizator schedule",
+        description="Fronta upgradů (pkg update, pkg upgrade, pip upgrade po venv), "
+                    "které se spouští, až to dovolí nabíjení, baterie, síť a zátěž CPU.",
+        epilog="Typicky z cronu: `schedule add` jednou denně a `schedule run` každých 15–30 min "
+               "(nebo jednou `schedule run --loop`). Odložené kroky zůstávají ve frontě.",
+    )
+    p.add_argument("action", choices=["add", "run", "status", "clear"],
+                   help="add = zařadit upgrade, run = spustit, co podmínky dovolí, "
+                        "status = podmínky a fronta (JSON), clear = vyprázdnit frontu.")
+    p.add_argument("--phases", default=",".join(SCHEDULE_PHASES), metavar="LIST",
+                   help="Co zařadit (add): čárkou oddělené fáze upgradu z režimu D – pkg, system-pip, "
+                        "venvs (výchozí: všechny).")
+    p.add_argument("--venv-dir", default=os.path.join(HOME, "venv"), help="Adresář kde hledat venvs.")
+    p.add_argument("--venv-root", action="append", default=[], metavar="DIR", help="Další kořen pro venv (lze opakovat).")
+    p.add_argument("--venv-depth", type=int, default=VENV_MAX_DEPTH, metavar="N",
+                   help=f"Max. hloubka hledání venv pod kořenem (výchozí: {VENV_MAX_DEPTH}).")
+    p.add_argument("--venv-prune", action="append", default=[], metavar="PATTERN",
+                   help="Další vynechané adresáře při hledání venv (fnmatch vzor, lze opakovat).")
+    p.add_argument("--queue", default=SCHEDULE_QUEUE, metavar="FILE", help=f"Soubor fronty (výchozí: {SCHEDULE_QUEUE}).")
+    p.add_argument("--probe", action="append", default=[], metavar="NAME=CMD",
+                   help="Nahradit sondu (battery, network, load) příkazem, který vypíše JSON objekt "
+                        "s hodnotami charging/battery/network/metered/load; prázdný CMD sondu vypne. Lze opakovat.")
+    p.add_argument("--policy", default=None, metavar="FILE",
+                   help="JSON {druh kroku: {min_battery, charging, network, max_load}} přepisující výchozí podmínky.")
+    p.add_argument("--loop", action="store_true", help="run: opakovat, dokud fronta není prázdná.")
+    p.add_argument("--interval", type=float, default=SCHEDULE_INTERVAL, metavar="SEC",
+                   help=f"Pauza mezi koly s --loop (výchozí: {SCHEDULE_INTERVAL} s).")
+    p.add_argument("--pip-chunk-size", type=int, default=PIP_UPGRADE_CHUNK, metavar="N")
+    p.add_argument("--wheelhouse", default=WHEELHOUSE, metavar="DIR")
+    p.add_argument("--no-wheelhouse", action="store_true")
+    p.add_argument("--no-lock", action="store_true", help="Nepoužívat zámky (pouze pro ladění).")
+    p.add_argument("--lock-timeout", type=float, default=0.0, metavar="SEC",
+                   help="Jak dlouho čekat na zámek kroku (výchozí: 0 = obsazený krok odložit).")
+    p.add_argument("--verbose", action="store_true")
+    args = p.parse_args(argv)
+    for spec in args.probe:
+        if "=" not in spec:
+            p.error(f"--probe expects NAME=CMD, got {spec!r}")
+    args.phases = tuple(ph.strip() for ph in args.phases.split(",") if ph.strip())
+    unknown = [ph for ph in args.phases if ph not in SCHEDULE_PHASES]
+    if unknown or not args.phases:
+        p.error(f"--phases expects a comma-separated list of {', '.join(SCHEDULE_PHASES)}, got {unknown or 'nothing'}")
+    return args
+
+
+def schedule_main(argv: List[str]) -> None:
+    """Subpříkaz `schedule`."""
+    args = parse_schedule_args(argv)
+    if args.verbose:
+        logger.setLevel(logging.DEBUG)
+
+    probes = dict(SCHEDULE_PROBES)
+    for spec in args.probe:
+        name, cmd = spec.split("=", 1)
+        if cmd.strip():
+            probes[name] = command_probe(cmd)
+        else:
+            probes.pop(name, None)
+
+    policy = {kind: dict(rule) for kind, rule in SCHEDULE_POLICY.items()}
+    if args.policy:
+        try:
+            overrides = load_json(args.policy)
+        except (OSError, ValueError) as e:
+            logger.error("Unable to read policy %s: %s", args.policy, e)
+            sys.exit(2)
+        if not isinstance(overrides, dict) or not all(isinstance(r, dict) for r in overrides.values()):
+            logger.error("Unable to use policy %s: expected {kind: {condition: value}}", args.policy)
+            sys.exit(2)
+        for kind, rule in overrides.items():
+            policy.setdefault(kind, {}).update(rule)
+
+    queue_locks = None if args.no_lock else LockManager()
+
+    if args.action == "status":
+        json.dump(schedule_status(args.queue, probes, policy), sys.stdout, ensure_ascii=False, indent=2)
+        sys.stdout.write("\n")
+        return
+    if args.action == "clear":
+        with maybe_locked(queue_locks, "schedule"):
+            save_schedule([], args.queue)
+        logger.info("Schedule queue cleared")
+        return
+    if args.action == "add":
+        jobs = schedule_jobs(
+            args.phases,
+            args.venv_dir,
+            args.venv_root,
+            venv_depth=args.venv_depth,
+            venv_prune=VENV_PRUNE + tuple(args.venv_prune),
+        )
+        added = enqueue_schedule(jobs, args.queue, queue_locks)
+        logger.info("Queued %d steps (%d already waiting) in %s", added, len(jobs) - added, args.queue)
+        return
+
+    # run: každé kolo drží "run" exkluzivně, takže nekoliduje s během hlavního příkazu
+    locks = None if args.no_lock else LockManager(timeout=args.lock_timeout)
+    wheelhouse = None if args.no_wheelhouse else args.wheelhouse
+    while True:
+        try:
+            with maybe_locked(locks, "run"):
+                done, remaining, issues = run_schedule(
+                    args.queue, probes, policy, args.pip_chunk_size, wheelhouse, locks, queue_locks
+                )
+        except LockTimeout as e:
+            logger.info("Another run is in progress, deferring the queue: %s", e)
+            done, remaining, issues = 0, len(load_schedule(args.queue)), []
+        for it in issues:
+            logger.warning(json.dumps(it, ensure_ascii=False))
+        logger.info("Schedule: %d steps done, %d waiting", done, remaining)
+        if not args.loop or not remaining:
+            break
+        time.sleep(args.interval)
+
+# -------------------------------------------------------------
+# Benchmark – falešné pkg/pip a syntetické venv (subpříkaz bench)
+# -------------------------------------------------------------
+
+BENCH_VENV_COUNTS = (1, 10, 100)
+BENCH_RESULTS_VERSION = 1
+
+_BENCH_FAKE_PKG = """#!/bin/sh
+sleep "${AKT_BENCH_LATENCY:-0}"
+case "$1" in
+  list-installed) cat "$AKT_BENCH_DIR/pkg_list.txt" ;;
+  *) echo "ok $*" ;;
+esac
+"""
+
+_BENCH_FAKE_PIP = """#!/bin/sh
+sleep "${AKT_BENCH_LATENCY:-0}"
+case "$*" in
+  *--outdated*) echo "[]" ;;
+  list*) cat "$AKT_BENCH_DIR/pip_list.json" ;;
+  *) echo "ok $*" ;;
+esac
+"""
+
+
+def _bench_write_exe(path: str, content: str) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.chmod(path, 0o755)
+
 
-def run_repair_routines() -> Dict[str, Any]:
+def bench_make_tree(root: str, venvs: int, packages: int) -> Dict[str, str]:
     """
-    Důkladná opravná sekvence pro Termux-Updater prostředí.
+    Vytvoří pod root falešné prostředí pro benchmark a vrátí proměnné
+    prostředí, se kterými ho skript použije (HOME, PREFIX, PATH, ...).
 
-    - Spustí pkg update/upgrade a zachytí chyby mirrorů.
-    - Zkusí detekovat a zakomentovat rozbité mirrory (not signed, bad key).
-    - Vyčistí pip cache a dočasné adresáře Termuxu.
-    - Opraví ~/bin/aktualizator symlink a executable bit.
+      root/bin/{pkg,pip3}              – falešné příkazy (latence přes AKT_BENCH_LATENCY)
+      root/prefix/var/lib/dpkg/status  – `packages` balíčků
+      root/home/venv/vNNNN/            – `venvs` venv, každý s `packages` dist-info
     """
-    results: Dict[str, Any] = {
-        "timestamp": timestamp_now_iso(),
-        "steps": [],
+    bin_dir = os.path.join(root, "bin")
+    home = os.path.join(root, "home")
+    prefix = os.path.join(root, "prefix")
+    pyver = f"{sys.version_info[0]}.{sys.version_info[1]}"
+    for d in (bin_dir, os.path.join(home, "Downloads"), os.path.join(prefix, "var", "lib", "dpkg"),
+              os.path.join(prefix, "etc", "apt", "sources.list.d")):
+        os.makedirs(d, exist_ok=True)
+
+    _bench_write_exe(os.path.join(bin_dir, "pkg"), _BENCH_FAKE_PKG)
+    _bench_write_exe(os.path.join(bin_dir, "pip3"), _BENCH_FAKE_PIP)
+    names = [f"bench-pkg-{i:04d}" for i in range(packages)]
+    with open(os.path.join(root, "pkg_list.txt"), "w", encoding="utf-8") as f:
+        f.write("Listing...\n")
+        f.writelines(f"{n}/stable,now 1.{i}.0 aarch64 [installed]\n" for i, n in enumerate(names))
+    with open(os.path.join(root, "pip_list.json"), "w", encoding="utf-8") as f:
+        json.dump([{"name": n, "version": f"1.{i}.0"} for i, n in enumerate(names)], f)
+    with open(os.path.join(prefix, "var", "lib", "dpkg", "status"), "w", encoding="utf-8") as f:
+        for i, n in enumerate(names):
+            f.write(f"Package: {n}\nStatus: install ok installed\nArchitecture: aarch64\n"
+                    f"Version: 1.{i}.0\nInstalled-Size: {100 + i}\nDescription: bench\n long\n\n")
+    with open(os.path.join(prefix, "etc", "apt", "sources.list"), "w", encoding="utf-8") as f:
+        f.write("deb https://packages-cf.termux.dev/apt/termux-main stable main\n")
+
+    for v in range(venvs):
+        venv = os.path.join(home, "venv", f"v{v:04d}")
+        site = os.path.join(venv, "lib", "python" + pyver, "site-packages")
+        os.makedirs(os.path.join(venv, "bin"), exist_ok=True)
+        os.makedirs(site, exist_ok=True)
+        _bench_write_exe(os.path.join(venv, "bin", "pip3"), _BENCH_FAKE_PIP)
+        with open(os.path.join(venv, "pyvenv.cfg"), "w", encoding="utf-8") as f:
+            f.write(f"home = {os.path.dirname(sys.executable)}\nversion = {pyver}.0\n")
+        for i, n in enumerate(names):
+            di = os.path.join(site, f"{n.replace('-', '_')}-1.{i}.0.dist-info")
+            os.makedirs(di, exist_ok=True)
+            with open(os.path.join(di, "METADATA"), "w", encoding="utf-8") as f:
+                f.write(f"Metadata-Version: 2.1\nName: {n}\nVersion: 1.{i}.0\n\nbench\n")
+
+    return {
+        "HOME": home,
+        "PREFIX": prefix,
+        "XDG_CACHE_HOME": os.path.join(home, ".cache"),
+        "PATH": bin_dir + os.pathsep + os.environ.get("PATH", ""),
+        "AKT_BENCH_DIR": root,
     }
 
-    def _log(msg: str) -> None:
-        logger.info(msg)
-        results["steps"].append(msg)
 
-    _log("==> Repair: starting Termux-Updater repair sequence")
+def _bench_stats(samples: List[float]) -> Dict[str, float]:
+    import statistics
 
-    bad_hosts: List[str] = []
+    return {
+        "min": round(min(samples), 6),
+        "median": round(statistics.median(samples), 6),
+        "max": round(max(samples), 6),
+        "runs": len(samples),
+    }
 
-    # 1. pkg update / upgrade, chyby uložíme
-    _log("[step] pkg update/upgrade via 'pkg'")
-    rc_upd, out_upd, err_upd = run_cmd(["pkg", "update", "-y"], dry_run=False)
-    if rc_upd != 0:
-        _log(f"[warn] pkg update failed (rc={rc_upd}):\n{err_upd[:400]}")
-        bad_hosts.extend(extract_bad_mirror_hosts(err_upd))
 
-    rc_upg, out_upg, err_upg = run_cmd(["pkg", "upgrade", "-y"], dry_run=False)
-    if rc_upg != 0:
-        _log(f"[warn] pkg upgrade failed (rc={rc_upg}):\n{err_upg[:400]}")
-        bad_hosts.extend(extract_bad_mirror_hosts(err_upg))
+def _bench_measure(fn: Callable[[], Any], repeat: int) -> Dict[str, float]:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - t0)
+    return _bench_stats(samples)
 
-    # 1b. Pokud jsme našli špatné mirrory – upravíme APT sources a zkusíme to znovu
-    unique_bad = sorted(set(bad_hosts))
-    if unique_bad:
-        _log(f"[step] Detected problematic mirrors: {', '.join(unique_bad)}")
-        changes = sanitize_apt_sources(unique_bad)
-        if changes:
-            for ch in changes:
-                _log(f"[fix] Disabled mirror in {ch['file']}: {ch['line']}")
-            _log("[step] Retrying pkg update/upgrade after mirror fix...")
-            rc2, _, err2 = run_cmd(["pkg", "update", "-y"], dry_run=False)
-            if rc2 != 0:
-                _log(f"[warn] pkg update still failing after mirror fix (rc={rc2}):\n{err2[:400]}")
-            rc3, _, err3 = run_cmd(["pkg", "upgrade", "-y"], dry_run=False)
-            if rc3 != 0:
-                _log(f"[warn] pkg upgrade still failing after mirror fix (rc={rc3}):\n{err3[:400]}")
-        else:
-            _log("[info] No APT source files modified while sanitizing mirrors.")
 
-    # 2. Vyčištění pip cache
-    _log("[step] Cleaning pip caches...")
-    for cache in ["~/.cache/pip", "~/.cache/jupyter", "~/.cache/pip-tools"]:
-        path = os.path.expanduser(cache)
-        if os.path.isdir(path):
-            shutil.rmtree(path, ignore_errors=True)
-            _log(f"[clean] Removed cache: {path}")
+def bench_worker(repeat: int, apt_lines: int) -> Dict[str, Any]:
+    """
+    Měření uvnitř falešného prostředí (HOME/PREFIX/PATH už nastavil bench_main).
 
-    # 3. Vyčištění dočasných adresářů Termuxu
-    _log("[step] Cleaning Termux temporary directories...")
-    for tmpdir in ["~/tmp", "/data/data/com.termux/files/usr/tmp"]:
-        path = os.path.expanduser(tmpdir)
-        if os.path.isdir(path):
-            shutil.rmtree(path, ignore_errors=True)
-            _log(f"[clean] Removed tmp: {path}")
+    build_cold: bez INVENTORY_CACHE, build_warm: s naplněnou cache.
+    """
+    venv_dir = os.path.join(HOME, "venv")
+    results: Dict[str, Any] = {}
 
-    # 4. Oprava symlinku ~/bin/aktualizator + executable bit
-    _log("[step] Repairing aktualizator symlink and executable bit...")
-    exe = os.path.join(HOME, "Termux-Updater", "aktualizator", "Termux-Updater-Pro.py")
-    bindir = os.path.join(HOME, "bin")
-    os.makedirs(bindir, exist_ok=True)
-    symlink = os.path.join(bindir, "aktualizator")
+    def _build(use_cache: bool) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        timings_reset()
+        return build_inventory_and_issues(
+            mode="C", venv_dir=venv_dir, dry_run=False, verbose=False, do_upgrade=False,
+            use_cache=use_cache, wheelhouse=None,
+        )
 
-    try:
-        if os.path.islink(symlink) or os.path.isfile(symlink):
-            os.remove(symlink)
-        os.symlink(exe, symlink)
-        _log(f"[ok] Recreated symlink: {symlink} -> {exe}")
-    except Exception as e:
-        _log(f"[warn] Failed to repair symlink: {e}")
+    results["build_inventory_and_issues.cold"] = _bench_measure(lambda: _build(False), repeat)
+    _build(True)
+    results["build_inventory_and_issues.warm"] = _bench_measure(lambda: _build(True), repeat)
 
-    try:
-        os.chmod(exe, 0o755)
-        _log(f"[ok] Ensured executable bit on: {exe}")
-    except Exception as e:
-        _log(f"[warn] Failed to chmod main script: {e}")
+    pip_exe = shutil.which("pip3") or "pip3"
+    results["pip_list"] = _bench_measure(lambda: asyncio.run(pip_list(pip_exe, False)), repeat)
 
-    _log("==> Repair: completed")
+    bad = "E: The repository 'https://mirror{0}.example.org/termux/main stable InRelease' is not signed."
+    noise = "Get:{0} https://packages-cf.termux.dev/apt/termux-main stable/main aarch64 pkg{0} [12.3 kB]"
+    apt_out = "\n".join((bad if i % 50 == 0 else noise).format(i) for i in range(apt_lines))
+    results["extract_bad_mirror_hosts"] = _bench_measure(lambda: extract_bad_mirror_hosts(apt_out), repeat)
 
-    # Repair log uložíme i standardně
-    safe_write_json(OUT_REPAIR_LOG, results)
+    inventory, _ = _build(True)
+    out = os.path.join(HOME, "bench_out.json")
+    results["safe_write_json"] = _bench_measure(lambda: safe_write_json(out, inventory), repeat)
+    results["safe_write_json"]["bytes"] = os.path.getsize(out)
     return results
 
-# -------------------------------------------------------------
-# Orchestr – inventář
-# -------------------------------------------------------------
 
-def build_inventory_and_issues(
-    mode: str,
-    venv_dir: str,
-    dry_run: bool,
-    verbose: bool,
-    do_upgrade: bool,
-) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
-    """
-    Orchestruje pkg + pip + venv inventář a upgrady.
+def parse_bench_args(argv: List[str]) -> argparse.Namespace:
+    p = argparse.ArgumentParser(
+        prog="aktualizator bench",
+        description="Benchmark s falešnými pkg/pip a syntetickými venv; výsledky do JSON pro porovnání verzí.",
+    )
+    p.add_argument("--venvs", default=",".join(map(str, BENCH_VENV_COUNTS)), metavar="N,N,...",
+                   help="Počty venv, pro které se měří (1–500; výchozí: %(default)s).")
+    p.add_argument("--packages", type=int, default=50, metavar="N",
+                   help="Balíčků v každém venv / pip list / dpkg status (výchozí: %(default)s).")
+    p.add_argument("--latency", type=float, default=0.05, metavar="SEC",
+                   help="Latence falešných pkg/pip (výchozí: %(default)s s).")
+    p.add_argument("--apt-lines", type=int, default=20000, metavar="N",
+                   help="Řádků syntetického apt výstupu pro extract_bad_mirror_hosts.")
+    p.add_argument("--repeat", type=int, default=3, metavar="N", help="Opakování každého měření.")
+    p.add_argument("--out", default=None, metavar="FILE", help="Zapsat výsledky do JSON souboru.")
+    p.add_argument("--compare", default=None, metavar="FILE", help="Porovnat s dřívějšími výsledky (JSON z --out).")
+    p.add_argument("--keep", action="store_true", help="Nemazat vygenerovaná prostředí.")
+    p.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    return p.parse_args(argv)
 
-    mode: 'A'|'B'|'C'|'D'
-    do_upgrade: pokud True a mode == 'D', provede pip upgrade (nikdy s --dry-run).
-    """
-    inventory: Dict[str, Any] = {
-        "timestamp": timestamp_now_iso(),
-        "mode": mode,
-        "host": os.uname().nodename if hasattr(os, "uname") else "termux",
-        "pkg": [],
-        "system_pip": [],
-        "venvs": {},
-    }
-    issues: List[Dict[str, Any]] = []
 
-    pkg_cmd = detect_package_manager()
-    logger.info("Using package manager: %s", pkg_cmd)
+def bench_compare(old: Dict[str, Any], new: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Poměr mediánů new/old pro každé (počet venv, měření) přítomné v obou."""
+    old_idx = {(r["venvs"], k): v for r in old.get("results", []) for k, v in r["timings"].items()}
+    rows = []
+    for r in new.get("results", []):
+        for k, v in r["timings"].items():
+            prev = old_idx.get((r["venvs"], k))
+            if prev and prev["median"] > 0:
+                rows.append({
+                    "venvs": r["venvs"], "measure": k,
+                    "old": prev["median"], "new": v["median"],
+                    "ratio": round(v["median"] / prev["median"], 3),
+                })
+    return rows
 
-    # Krok 1: pkg
-    pkgs, pkg_issues = pkg_update_and_list(pkg_cmd, dry_run=dry_run)
-    inventory["pkg"] = pkgs
-    issues.extend(pkg_issues)
 
-    # Krok 2: system pip (B, C, D)
-    if mode in ("B", "C", "D"):
-        sys_pip = find_system_pip()
-        if sys_pip:
-            logger.info("Using system pip at %s", sys_pip)
-            pkgs_sys, issue_sys = pip_list(sys_pip, dry_run=dry_run)
-            inventory["system_pip"] = pkgs_sys
-            if issue_sys:
-                issues.append(issue_sys)
-
-            if mode == "D" and do_upgrade and not dry_run:
-                up_issue = pip_upgrade(sys_pip, dry_run=False)
-                if up_issue:
-                    issues.append(up_issue)
-        else:
-            issues.append({
-                "category": "system_pip_missing",
-                "cmd": ["which pip3"],
-                "rc": 127,
-                "stderr": "system pip not found in PATH",
-            })
+def bench_main(argv: List[str]) -> None:
+    """Subpříkaz `bench`."""
+    import tempfile
 
-    # Krok 3: venv pipy (C, D)
-    if mode in ("C", "D"):
-        venv_pips = find_venv_pips(venv_dir)
-        logger.info("Found %d venv pip executables under %s", len(venv_pips), venv_dir)
-        for pip_exe in venv_pips:
-            vname = os.path.basename(os.path.dirname(os.path.dirname(pip_exe)))
-            pkgs_venv, issue_venv = pip_list(pip_exe, dry_run=dry_run)
-            inventory["venvs"][vname] = {
-                "pip": pip_exe,
-                "packages": pkgs_venv,
-            }
-            if issue_venv:
-                issue_venv = dict(issue_venv)
-                issue_venv["venv"] = vname
-                issues.append(issue_venv)
+    args = parse_bench_args(argv)
+    if args.worker:
+        logger.setLevel(logging.WARNING)
+        json.dump(bench_worker(args.repeat, args.apt_lines), sys.stdout)
+        return
 
-            if mode == "D" and do_upgrade and not dry_run:
-                up_issue = pip_upgrade(pip_exe, dry_run=False)
-                if up_issue:
-                    up_issue = dict(up_issue)
-                    up_issue["venv"] = vname
-                    issues.append(up_issue)
+    counts = [int(c) for c in args.venvs.split(",") if c.strip()]
+    if any(not 1 <= c <= 500 for c in counts):
+        logger.error("Venv counts must be between 1 and 500")
+        sys.exit(2)
 
-    return inventory, issues
+    results = []
+    for count in counts:
+        root = tempfile.mkdtemp(prefix=f"aktualizator-bench-{count}-")
+        try:
+            t0 = time.perf_counter()
+            env = dict(os.environ, AKT_BENCH_LATENCY=str(args.latency))
+            env.update(bench_make_tree(root, count, args.packages))
+            setup = time.perf_counter() - t0
+            cmd = [sys.executable, os.path.abspath(__file__), "bench", "--worker",
+                   "--repeat", str(args.repeat), "--apt-lines", str(args.apt_lines)]
+            proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+            if proc.returncode != 0:
+                logger.error("Benchmark worker failed for %d venvs:\n%s", count, proc.stderr[-2000:])
+                sys.exit(1)
+            timings = json.loads(proc.stdout)
+        finally:
+            if args.keep:
+                logger.info("Kept benchmark tree %s", root)
+            else:
+                shutil.rmtree(root, ignore_errors=True)
+        results.append({"venvs": count, "setup": round(setup, 3), "timings": timings})
+        logger.info("venvs=%d:", count)
+        for name, st in timings.items():
+            logger.info("  %-36s median %8.4fs  min %8.4fs", name, st["median"], st["min"])
+
+    report = {
+        "version": BENCH_RESULTS_VERSION,
+        "generated": timestamp_now_iso(),
+        "script": os.path.abspath(__file__),
+        "python": sys.version.split()[0],
+        "platform": sys.platform,
+        "params": {"packages": args.packages, "latency": args.latency,
+                   "apt_lines": args.apt_lines, "repeat": args.repeat},
+        "results": results,
+    }
+    if args.out:
+        safe_write_json(args.out, report)
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            rows = bench_compare(json.load(f), report)
+        for row in rows:
+            flag = "  <-- slower" if row["ratio"] > 1.2 else ""
+            logger.info("venvs=%-4d %-36s %8.4fs -> %8.4fs  x%.2f%s",
+                        row["venvs"], row["measure"], row["old"], row["new"], row["ratio"], flag)
 
 # -------------------------------------------------------------
 # CLI
@@ -548,7 +5859,14 @@ def build_inventory_and_issues(
 
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(
-        description="Termux-Aktualizator — pkg + pip + venv aktualizátor s repair módem."
+        description="Termux-Aktualizator — pkg + pip + venv aktualizátor s repair módem.",
+        epilog=(
+            "Subpříkazy: aggregate DIR (sloučení inventářů flotily; viz `aggregate --help`), "
+            "daemon (inventář v paměti přes Unix socket; viz `daemon --help`), "
+            "bench (benchmark s falešnými pkg/pip; viz `bench --help`), "
+            "classify-log LOG... (chyby mirrorů v apt logu; viz `classify-log --help`), "
+            "schedule add|run|status|clear (upgrady podle nabíjení, baterie a sítě; viz `schedule --help`)."
+        ),
     )
 
     p.add_argument(
@@ -562,6 +5880,96 @@ def parse_args() -> argparse.Namespace:
         default=os.path.join(HOME, "venv"),
         help="Adresář kde hledat venvs (default: ~/venv)",
     )
+    p.add_argument(
+        "--venv-root",
+        action="append",
+        default=[],
+        metavar="DIR",
+        help="Další adresář pro hledání venv, např. ~/projects (lze opakovat).",
+    )
+    p.add_argument(
+        "--venv-depth",
+        type=int,
+        default=VENV_MAX_DEPTH,
+        metavar="N",
+        help=f"Max. hloubka hledání venv pod kořenem (výchozí: {VENV_MAX_DEPTH}).",
+    )
+    p.add_argument(
+        "--venv-prune",
+        action="append",
+        default=[],
+        metavar="PATTERN",
+        help="Další vynechané adresáře při hledání venv (fnmatch vzor, lze opakovat).",
+    )
+    p.add_argument(
+        "--jobs",
+        type=int,
+        default=default_jobs(),
+        metavar="N",
+        help="Max. počet souběžně běžících příkazů (výchozí: počet CPU).",
+    )
+    p.add_argument(
+        "--cmd-timeout",
+        type=float,
+        default=None,
+        metavar="SEC",
+        help="Timeout jednoho pkg/pip příkazu v sekundách (výchozí: pkg 3600, pip 1800).",
+    )
+    p.add_argument(
+        "--inventory-backend",
+        choices=INVENTORY_BACKENDS,
+        default="metadata",
+        help="Zdroj pip inventáře: metadata=čtení site-packages (výchozí), pip=pip list.",
+    )
+    p.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Nepoužívat cache inventáře (~/.cache/termux-updater/inventory.json).",
+    )
+    p.add_argument(
+        "--pip-chunk-size",
+        type=int,
+        default=PIP_UPGRADE_CHUNK,
+        metavar="N",
+        help=f"Počet balíčků v jedné pip upgrade dávce (výchozí: {PIP_UPGRADE_CHUNK}).",
+    )
+    p.add_argument(
+        "--profile-out",
+        default=None,
+        metavar="PATH",
+        help="Zapsat měření časů: *.jsonl = JSON lines, jinak Chrome trace JSON.",
+    )
+    p.add_argument(
+        "--wheelhouse",
+        default=WHEELHOUSE,
+        metavar="DIR",
+        help="Sdílený adresář wheelů pro pip upgrade ve všech venv (výchozí: ~/.cache/termux-updater/wheels).",
+    )
+    p.add_argument(
+        "--no-wheelhouse",
+        action="store_true",
+        help="Nepoužívat sdílený wheelhouse.",
+    )
+    p.add_argument(
+        "--wheelhouse-max-mb",
+        type=int,
+        default=WHEELHOUSE_MAX_MB,
+        metavar="MB",
+        help=f"Max. velikost wheelhouse, nad ní se mažou nejdéle nepoužité wheely (výchozí: {WHEELHOUSE_MAX_MB}).",
+    )
+    p.add_argument(
+        "--wheelhouse-max-age-days",
+        type=float,
+        default=WHEELHOUSE_MAX_AGE / 86400,
+        metavar="DAYS",
+        help="Wheely nepoužité déle se smažou (výchozí: 60).",
+    )
+    p.add_argument(
+        "--format",
+        choices=["json", "jsonl"],
+        default="json",
+        help="Formát výstupu: json (výchozí) nebo jsonl (streamový zápis, záznam po záznamu).",
+    )
     p.add_argument(
         "--dry-run",
         action="store_true",
@@ -572,10 +5980,48 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Detailní DEBUG výstup.",
     )
+    p.add_argument(
+        "--inventory-only",
+        action="store_true",
+        help="Jen inventář: bez pkg update/upgrade a pip upgrade. Pokud běží daemon, odpoví on.",
+    )
+    p.add_argument(
+        "--no-prefetch",
+        action="store_true",
+        help="V režimu D nestahovat apt balíčky předem souběžně s pip upgrady.",
+    )
+    p.add_argument(
+        "--no-daemon",
+        action="store_true",
+        help="S --inventory-only se neptat daemonu, vždy běžet samostatně.",
+    )
+    p.add_argument(
+        "--daemon-socket",
+        default=DAEMON_SOCKET,
+        help=f"Socket daemonu (výchozí: {DAEMON_SOCKET}).",
+    )
+    p.add_argument(
+        "--startup-profile",
+        action="store_true",
+        help="Vypsat časy importů a startu (spustí příkaz pod python -X importtime).",
+    )
+    p.add_argument(
+        "--resume",
+        action="store_true",
+        help=f"Pokračovat v přerušeném běhu – přeskočit kroky hotové podle žurnálu ({JOURNAL_FILE}).",
+    )
     p.add_argument(
         "--no-lock",
         action="store_true",
-        help="Nepoužívat zámek (pouze pro ladění).",
+        help="Nepoužívat zámky (pouze pro ladění).",
+    )
+    p.add_argument(
+        "--lock-timeout",
+        type=float,
+        default=None,
+        metavar="SEC",
+        help="Jak dlouho čekat na zámek (výchozí: bez limitu; 0 = nečekat). "
+             "Po vypršení se vypíše PID a příkaz držitele.",
     )
     p.add_argument(
         "--out-inventory",
@@ -587,6 +6033,56 @@ def parse_args() -> argparse.Namespace:
         default=OUT_ISSUES,
         help="Cesta pro issues JSON (výchozí: downloads).",
     )
+    p.add_argument(
+        "--out-diff",
+        default=OUT_DIFF,
+        help="Cesta pro diff JSON oproti minulému běhu (výchozí: downloads).",
+    )
+    p.add_argument(
+        "--advisory-db",
+        default=ADVISORY_DIR,
+        metavar="DIR",
+        help=f"Adresář s OSV dumpy (*.json, *.zip) pro kontrolu zranitelností (výchozí: {ADVISORY_DIR}).",
+    )
+    p.add_argument(
+        "--no-advisories",
+        action="store_true",
+        help="Nekontrolovat inventář proti offline databázi bezpečnostních upozornění.",
+    )
+    p.add_argument(
+        "--compress",
+        choices=sorted(COMPRESS_SUFFIXES),
+        default=None,
+        help="Výstupy zapisovat komprimovaně (*.json.gz / *.json.xz, kompaktní JSON); čtení pozná formát samo.",
+    )
+    p.add_argument(
+        "--plan",
+        action="store_true",
+        help="Jen naplánovat upgrade (apt-get -s, pip --dry-run --report) s odhadem doby; nic neinstaluje.",
+    )
+    p.add_argument(
+        "--out-plan",
+        default=OUT_PLAN,
+        help="Cesta pro plán z --plan (výchozí: downloads).",
+    )
+    p.add_argument(
+        "--apply-plan",
+        default=None,
+        metavar="FILE",
+        help="Provést dříve uložený plán (pevné verze), pak zapsat inventář jako obvykle.",
+    )
+    p.add_argument(
+        "--diff",
+        action="store_true",
+        help="Vypsat souhrn změn oproti minulému běhu.",
+    )
+    p.add_argument(
+        "--history-size",
+        type=int,
+        default=HISTORY_SIZE,
+        metavar="N",
+        help=f"Počet uchovávaných inventářů pro diff (výchozí: {HISTORY_SIZE}).",
+    )
     p.add_argument(
         "--repair",
         action="store_true",
@@ -597,6 +6093,34 @@ def parse_args() -> argparse.Namespace:
         action="store_true",
         help="Spustit pouze repair a skončit (bez aktualizace).",
     )
+    p.add_argument(
+        "--rank-mirrors",
+        action="store_true",
+        help="Změřit rychlost mirrorů ze sources.list, vypsat pořadí a skončit.",
+    )
+    p.add_argument(
+        "--select-mirror",
+        action="store_true",
+        help="Před aktualizací přepnout sources.list na nejrychlejší zdravý mirror.",
+    )
+    p.add_argument(
+        "--mirror-rollback",
+        action="store_true",
+        help="Vrátit sources.list ze zálohy poslední změny mirroru a skončit.",
+    )
+    p.add_argument(
+        "--mirror-candidates",
+        default=None,
+        metavar="FILE",
+        help="Další kandidátní mirrory (řádky `URL SUITE COMPONENTS`).",
+    )
+    p.add_argument(
+        "--mirror-ttl",
+        type=float,
+        default=MIRROR_CACHE_TTL,
+        metavar="SEC",
+        help=f"Platnost uložených měření mirrorů (výchozí: {MIRROR_CACHE_TTL} s).",
+    )
     p.add_argument(
         "--repair-log",
         default=OUT_REPAIR_LOG,
@@ -609,58 +6133,314 @@ def parse_args() -> argparse.Namespace:
 # main()
 # -------------------------------------------------------------
 
+SUBCOMMANDS: Dict[str, Callable[[List[str]], None]] = {
+    "aggregate": aggregate_main,
+    "daemon": daemon_main,
+    "bench": bench_main,
+    "classify-log": classify_main,
+    "schedule": schedule_main,
+}
+
+
+_IMPORTTIME_RE = r"^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)"
+
+
+def startup_profile(argv: List[str], top: int = 15) -> int:
+    """
+    --startup-profile: spustí tentýž příkaz pod `python -X importtime`
+    a vypíše, kolik stál start interpretu a které importy nejvíc.
+
+    Ostatní stderr výstup potomka se propouští beze změny.
+    Vrací návratový kód potomka.
+    """
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-X", "importtime", os.path.abspath(__file__)] + argv,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    imports: List[Tuple[int, int, int, str]] = []  # (self µs, cumulative µs, hloubka, modul)
+    assert proc.stderr is not None
+    importtime = _regex(_IMPORTTIME_RE)
+    for line in proc.stderr:
+        m = importtime.match(line)
+        if m:
+            imports.append((int(m.group(1)), int(m.group(2)), len(m.group(3)) // 2, m.group(4)))
+        elif not line.startswith("import time:"):
+            sys.stderr.write(line)
+    rc = proc.wait()
+    wall = time.perf_counter() - t0
+
+    total = sum(i[0] for i in imports) / 1000
+    own = [i for i in imports if i[2] == 0]
+    logger.info("Startup profile: %d modules imported in %.1f ms (process wall %.1f ms)", len(imports), total, wall * 1000)
+    for self_us, cum_us, _depth, name in sorted(own, key=lambda i: i[1], reverse=True)[:top]:
+        logger.info("  %-32s %8.1f ms  (self %.1f ms)", name, cum_us / 1000, self_us / 1000)
+    return rc
+
+
 def main() -> None:
+    setup_logging()
+    if "--startup-profile" in sys.argv[1:]:
+        sys.exit(startup_profile([a for a in sys.argv[1:] if a != "--startup-profile"]))
+
+    if len(sys.argv) > 1 and sys.argv[1] in SUBCOMMANDS:
+        SUBCOMMANDS[sys.argv[1]](sys.argv[2:])
+        return
+
     args = parse_args()
 
     if args.verbose:
         logger.setLevel(logging.DEBUG)
 
     logger.debug("Starting Aktualizator, args: %s", vars(args))
+    timings_reset()
+
+    if args.cmd_timeout is not None:
+        for kind in CMD_TIMEOUTS:
+            CMD_TIMEOUTS[kind] = args.cmd_timeout if args.cmd_timeout > 0 else None
 
     # Repair mód (bez locku – aby šel spustit i při rozbitém zámku)
     if args.repair or args.repair_only:
         logger.info("Running repair routines (requested by user)...")
         repair_result = run_repair_routines()
-        safe_write_json(args.repair_log, repair_result)
-        logger.info("Repair log written to %s", args.repair_log)
+        written = safe_write_json(args.repair_log, repair_result, compress=args.compress)
+        remove_other_variants(args.repair_log, written)
+        logger.info("Repair log written to %s", written)
         if args.repair_only:
             logger.info("Repair-only mode, exiting.")
             return
 
-    # Standardní běh se zámkem
-    lock_fd = None
-    if not args.no_lock:
+    # Mirrory: sources se přepisují pod zámkem "pkg", aby se neměnily
+    # pod rukama apt v jiném běhu (nebo v plánovači)
+    mirror_locks = None if args.no_lock else LockManager(timeout=args.lock_timeout)
+    if args.mirror_rollback:
         try:
-            lock_fd = open(LOCKFILE, "w")
-            if not file_lock(lock_fd):
-                logger.error("Unable to obtain lock, exiting.")
+            with maybe_locked(mirror_locks, "pkg"):
+                restored = rollback_mirror_selection()
+        except LockTimeout as e:
+            logger.error("Unable to obtain lock, exiting: %s", e)
+            sys.exit(1)
+        for path in restored:
+            logger.info("Restored %s", path)
+        if not restored:
+            logger.info("No mirror change to roll back.")
+        return
+
+    if args.rank_mirrors or args.select_mirror:
+        extra = load_mirror_candidates(args.mirror_candidates) if args.mirror_candidates else None
+        entries = parse_apt_sources()
+        rankings = rank_mirrors(entries, extra, jobs=max(args.jobs, 4), ttl=args.mirror_ttl)
+        for key, ranked in rankings.items():
+            logger.info("Mirrors for %s:", key.replace("|", " "))
+            for r in ranked:
+                if r["healthy"]:
+                    logger.info("  %-55s %7.3fs  %9.0f B/s", r["url"], r["total"], r["throughput"])
+                else:
+                    logger.info("  %-55s  failed  (%s)", r["url"], r["error"])
+        if args.rank_mirrors:
+            return
+        if not args.dry_run:
+            try:
+                with maybe_locked(mirror_locks, "pkg"):
+                    switched = select_fastest_mirrors(rankings, parse_apt_sources())
+            except LockTimeout as e:
+                logger.error("Unable to obtain lock, exiting: %s", e)
                 sys.exit(1)
-        except Exception as e:
-            logger.error("Lockfile error: %s", e)
+            for ch in switched:
+                logger.info("Switched mirror in %s: %s -> %s", ch["file"], ch["old"], ch["new"])
+
+    # Plán upgradu: nic se neinstaluje, jen pkg update (seznamy balíčků)
+    if args.plan:
+        plan_locks = None if args.no_lock else LockManager(timeout=args.lock_timeout)
+        try:
+            upgrade_plan = build_upgrade_plan(
+                mode=args.mode,
+                venv_dir=args.venv_dir,
+                venv_roots=args.venv_root,
+                venv_depth=args.venv_depth,
+                venv_prune=VENV_PRUNE + tuple(args.venv_prune),
+                use_cache=not args.no_cache,
+                wheelhouse=None if args.no_wheelhouse else args.wheelhouse,
+                locks=plan_locks,
+            )
+        finally:
+            if plan_locks is not None:
+                plan_locks.release_all()
+        written = safe_write_json(args.out_plan, upgrade_plan, compress=args.compress)
+        remove_other_variants(args.out_plan, written)
+        log_plan_summary(upgrade_plan)
+        for it in upgrade_plan["issues"]:
+            logger.warning(json.dumps(it, ensure_ascii=False))
+        return
+
+    plan: Optional[Dict[str, Any]] = None
+    if args.apply_plan:
+        try:
+            plan = load_json(args.apply_plan)
+        except (OSError, ValueError) as e:
+            logger.error("Unable to read plan %s: %s", args.apply_plan, e)
+            sys.exit(2)
+        if not isinstance(plan, dict) or plan.get("version") != PLAN_VERSION:
+            logger.error("Unable to apply plan %s: not a version %d plan", args.apply_plan, PLAN_VERSION)
             sys.exit(2)
+        args.mode = plan.get("mode", args.mode)
 
-    try:
-        inventory, issues = build_inventory_and_issues(
-            mode=args.mode,
-            venv_dir=args.venv_dir,
-            dry_run=args.dry_run,
-            verbose=args.verbose,
-            do_upgrade=(args.mode == "D"),
+    # Inventář od daemonu (pokud běží se stejným rozsahem a hledáním venv); jinak samostatný běh
+    daemon_resp: Optional[Dict[str, Any]] = None
+    if args.inventory_only and args.mode != "D" and not args.no_daemon:
+        daemon_resp = daemon_request({"cmd": "inventory"}, args.daemon_socket, timeout=600)
+        expected = {
+            "mode": args.mode,
+            "venv_roots": [os.path.abspath(r) for r in [args.venv_dir] + [r for r in args.venv_root if r != args.venv_dir]],
+            "venv_depth": args.venv_depth,
+            "venv_prune": list(VENV_PRUNE + tuple(args.venv_prune)),
+            "backend": args.inventory_backend,
+        }
+        if daemon_resp is not None and not (
+            daemon_resp.get("ok") and all(daemon_resp.get(k) == v for k, v in expected.items())
+        ):
+            logger.debug("Daemon inventory does not match requested mode/venv discovery/backend, running standalone")
+            daemon_resp = None
+
+    # Zámky: běh, který mění systém, drží "run" exkluzivně; pkg / pip / venv
+    # zamyká build po prostředcích, takže inventář (A–C, --dry-run,
+    # --inventory-only) může běžet souběžně s upgradem nesouvisejících venv
+    locks: Optional[LockManager] = None
+    if not args.no_lock:
+        locks = LockManager(timeout=args.lock_timeout)
+        if not args.dry_run and not args.inventory_only:
+            try:
+                locks.acquire("run")
+            except LockTimeout as e:
+                logger.error("Unable to obtain lock, exiting: %s", e)
+                sys.exit(1)
+            except OSError as e:
+                logger.error("Lockfile error: %s", e)
+                sys.exit(2)
+
+    journal: Optional[StepJournal] = None
+    if not args.dry_run and not args.inventory_only:
+        journal = StepJournal(
+            JOURNAL_FILE, args.mode, resume=args.resume, plan=plan.get("generated") if plan is not None else None
         )
 
+    inv_writer: Optional[JsonlWriter] = None
+    issue_writer: Optional[JsonlWriter] = None
+    sink: Optional[Callable[[str, Dict[str, Any]], None]] = None
+    if args.format == "jsonl":
+        inv_writer = JsonlWriter(jsonl_path(args.out_inventory), compress=args.compress)
+        issue_writer = JsonlWriter(jsonl_path(args.out_issues), compress=args.compress)
+        header = {"generated": timestamp_now_iso(), "mode": args.mode, "dry_run": bool(args.dry_run)}
+        inv_writer.write("header", header)
+        issue_writer.write("header", header)
+
+        def _jsonl_sink(kind: str, record: Dict[str, Any]) -> None:
+            (issue_writer if kind == "issue" else inv_writer).write(kind, record)
+
+        sink = _jsonl_sink
+
+    try:
+        plan_issues: List[Dict[str, Any]] = []
+        if plan is not None:
+            plan_issues = apply_upgrade_plan(
+                plan,
+                dry_run=args.dry_run,
+                chunk_size=args.pip_chunk_size,
+                wheelhouse=None if args.no_wheelhouse else args.wheelhouse,
+                locks=locks,
+                journal=journal,
+            )
+            if sink is not None:
+                for it in plan_issues:
+                    sink("issue", it)
+
+        if daemon_resp is not None:
+            logger.info("Inventory served by daemon (pid %s, refreshed %s)", daemon_resp["pid"], daemon_resp["refreshed"])
+            inventory, issues = daemon_resp["inventory"], daemon_resp["issue_list"]
+            if sink is not None:
+                emit_inventory(inventory, issues, sink)
+        else:
+            inventory, issues = build_inventory_and_issues(
+                mode=args.mode,
+                venv_dir=args.venv_dir,
+                dry_run=args.dry_run,
+                verbose=args.verbose,
+                do_upgrade=(args.mode == "D" and plan is None),
+                jobs=args.jobs,
+                backend=args.inventory_backend,
+                use_cache=not args.no_cache,
+                chunk_size=args.pip_chunk_size,
+                wheelhouse=None if args.no_wheelhouse else args.wheelhouse,
+                sink=sink,
+                venv_roots=args.venv_root,
+                venv_depth=args.venv_depth,
+                venv_prune=VENV_PRUNE + tuple(args.venv_prune),
+                journal=journal,
+                inventory_only=args.inventory_only or plan is not None,
+                locks=locks,
+                prefetch=not args.no_prefetch,
+            )
+        issues = plan_issues + issues
+
+        if not args.no_advisories:
+            adv_issues = check_inventory_advisories(inventory, args.advisory_db)
+            issues.extend(adv_issues)
+            if sink is not None:
+                for it in adv_issues:
+                    sink("issue", it)
+        if args.mode == "D" and not args.dry_run and not args.inventory_only and not args.no_wheelhouse:
+            pruned = prune_wheelhouse(
+                args.wheelhouse,
+                max_bytes=args.wheelhouse_max_mb * 1024 * 1024,
+                max_age=args.wheelhouse_max_age_days * 86400,
+            )
+            if pruned["removed"]:
+                logger.info("Wheelhouse: removed %d wheels (%d B freed)", len(pruned["removed"]), pruned["freed"])
+
+        if locks is not None:
+            try:
+                locks.acquire("outputs")
+            except LockTimeout as e:
+                logger.error("Unable to lock output files, exiting: %s", e)
+                sys.exit(1)
+
         out_inventory = {
             "generated": timestamp_now_iso(),
             "mode": args.mode,
             "dry_run": bool(args.dry_run),
             "inventory": inventory,
+            "timings": timings_report(),
         }
         out_issues = {
             "generated": timestamp_now_iso(),
             "issues": issues,
         }
 
-        safe_write_json(args.out_inventory, out_inventory)
-        safe_write_json(args.out_issues, out_issues)
+        if inv_writer and issue_writer:
+            inv_writer.write("inventory", {k: inventory[k] for k in ("timestamp", "mode", "host")})
+            inv_writer.write("timings", out_inventory["timings"])
+            inv_writer.close()
+            issue_writer.close()
+            remove_other_variants(jsonl_path(args.out_inventory), inv_writer.path)
+            remove_other_variants(jsonl_path(args.out_issues), issue_writer.path)
+        else:
+            for out_path, data in ((args.out_inventory, out_inventory), (args.out_issues, out_issues)):
+                remove_other_variants(out_path, safe_write_json(out_path, data, compress=args.compress))
+        if args.profile_out:
+            write_profile(args.profile_out)
+
+        if not args.dry_run:
+            diff = record_and_diff(inventory, keep=args.history_size)
+            remove_other_variants(args.out_diff, safe_write_json(args.out_diff, diff, compress=args.compress))
+            if args.diff:
+                log_diff_summary(diff)
+            if plan is not None or (args.mode == "D" and not args.inventory_only):
+                learn_upgrade_stats(out_inventory["timings"], diff, inventory.get("prefetch"))
+        elif args.diff:
+            # dry-run: diff jen do logu – historie ani Aktualizator_diff.json se nemění
+            logger.info("Dry run: diff is not recorded in the history")
+            log_diff_summary(record_and_diff(inventory, keep=args.history_size, record=False))
 
         if issues:
             logger.warning("Package manager issues: %d", len(issues))
@@ -669,14 +6449,17 @@ def main() -> None:
         else:
             logger.info("No issues detected.")
 
+        if journal is not None:
+            journal.finish()
         logger.info("Aktualizator finished.")
     finally:
-        if lock_fd:
-            try:
-                fcntl.flock(lock_fd, fcntl.LOCK_UN)
-                lock_fd.close()
-            except Exception:
-                pass
+        if journal is not None:
+            journal.close()
+        for writer in (inv_writer, issue_writer):
+            if writer is not None:
+                writer.abort()
+        if locks is not None:
+            locks.release_all()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,29 @@
+"""Společné fixtures: skript se načítá jako modul (jméno souboru není importovatelné)."""
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "aktualizator", "Termux-Updater-Pro.py")
+
+
+@pytest.fixture(scope="session")
+def akt():
+    spec = importlib.util.spec_from_file_location("aktualizator", SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module  # pickle (ProcessPoolExecutor) hledá funkce podle jména modulu
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def fake_tree(akt, tmp_path):
+    """
+    Falešné prostředí z bench_make_tree: 2 venv po 5 balíčcích, dpkg status,
+    sources.list a falešné pkg/pip3. Vrací (kořen, proměnné prostředí pro skript).
+    """
+    root = tmp_path / "tree"
+    env = akt.bench_make_tree(str(root), venvs=2, packages=5)
+    return root, env
@@ -0,0 +1,82 @@
+"""Offline OSV advisory index: sestavení, vyhledání a porovnání verzí."""
+
+import json
+import os
+
+
+def _osv(adv_id, name, introduced, fixed, ecosystem="PyPI"):
+    return {
+        "id": adv_id,
+        "summary": f"{name} is vulnerable",
+        "affected": [{
+            "package": {"ecosystem": ecosystem, "name": name},
+            "ranges": [{"type": "ECOSYSTEM", "events": [{"introduced": introduced}, {"fixed": fixed}]}],
+        }],
+    }
+
+
+def test_advisory_index(akt, tmp_path):
+    db = tmp_path / "osv"
+    db.mkdir()
+    (db / "a.json").write_text(json.dumps(_osv("GHSA-1", "Bench_Pkg", "1.0", "1.3.0")), encoding="utf-8")
+    (db / "b.json").write_text(json.dumps(_osv("TERMUX-1", "bench-pkg-0001", "0", "2.0", "Termux")), encoding="utf-8")
+    index_path = str(tmp_path / "advisories.idx")
+
+    index = akt.update_advisory_index(str(db), index_path)
+    try:
+        assert [a["id"] for a in index.lookup("PyPI", "bench-pkg", "1.2.0")] == ["GHSA-1"]
+        assert index.lookup("PyPI", "bench-pkg", "1.3.0") == []
+        assert index.lookup("PyPI", "bench-pkg", "0.9") == []
+        inventory = {
+            "pkg": [{"name": "bench-pkg-0001", "version": "1.1.0"}],
+            "system_pip": [],
+            "venvs": {"v": {"packages": [{"name": "bench_pkg", "version": "1.0"}]}},
+        }
+        issues = akt.match_advisories(inventory, index)
+    finally:
+        index.close()
+    assert sorted((i["source"], i["advisory"]) for i in issues) == [("pkg", "TERMUX-1"), ("venv", "GHSA-1")]
+
+
+def test_compare_versions_pads_release(akt):
+    assert akt.compare_versions("1.0", "1.0.0") == 0
+    assert akt.compare_versions("1.0.0rc1", "1rc1") == 0
+    assert akt.compare_versions("1.0rc1", "1.0.0") == -1
+    assert akt.compare_versions("1.0.0", "1.0.post1") == -1
+    assert akt.compare_versions("1.10", "1.9.0") == 1
+    assert akt.compare_versions("1.1.1", "1.1.1a") == -1
+
+
+def test_advisory_fixed_release_padding(akt, tmp_path):
+    db = tmp_path / "osv"
+    db.mkdir()
+    (db / "a.json").write_text(json.dumps(_osv("GHSA-2", "pad", "0", "1.0.0")), encoding="utf-8")
+    index = akt.update_advisory_index(str(db), str(tmp_path / "idx"))
+    try:
+        assert index.lookup("PyPI", "pad", "1.0") == []
+        assert [a["id"] for a in index.lookup("PyPI", "pad", "0.9")] == ["GHSA-2"]
+    finally:
+        index.close()
+
+
+def test_advisory_index_per_database(akt, tmp_path, monkeypatch):
+    monkeypatch.setattr(akt, "CACHE_DIR", str(tmp_path / "cache"))
+    dbs = []
+    for n in range(2):
+        db = tmp_path / f"db{n}"
+        db.mkdir()
+        (db / "a.json").write_text(json.dumps(_osv(f"GHSA-{n}", "pkg", "0", "9")), encoding="utf-8")
+        dbs.append(str(db))
+    paths = {akt.advisory_index_path(db) for db in dbs}
+    assert len(paths) == 2 and akt.advisory_index_path(akt.ADVISORY_DIR) == akt.ADVISORY_INDEX
+
+    for db in dbs:
+        akt.update_advisory_index(db).close()
+    mtimes = {p: os.stat(p).st_mtime_ns for p in paths}
+    for n, db in enumerate(dbs):
+        index = akt.update_advisory_index(db)
+        try:
+            assert [a["id"] for a in index.lookup("PyPI", "pkg", "1")] == [f"GHSA-{n}"]
+        finally:
+            index.close()
+    assert {p: os.stat(p).st_mtime_ns for p in paths} == mtimes  # nic se nepřestavělo
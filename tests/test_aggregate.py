@@ -0,0 +1,83 @@
+"""Subpříkaz aggregate: FleetIndex nad inventáři z více zařízení."""
+
+import json
+import os
+import subprocess
+import sys
+
+from conftest import SCRIPT
+
+
+def _inventory(path, host, timestamp, pkg=(), system_pip=(), venvs=None):
+    inventory = {
+        "timestamp": timestamp,
+        "host": host,
+        "pkg": [{"name": n, "version": v} for n, v in pkg],
+        "system_pip": [{"name": n, "version": v} for n, v in system_pip],
+        "venvs": {
+            name: {"packages": [{"name": n, "version": v} for n, v in pkgs]}
+            for name, pkgs in (venvs or {}).items()
+        },
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps({"inventory": inventory}), encoding="utf-8")
+
+
+def _fleet(tmp_path):
+    root = tmp_path / "fleet"
+    _inventory(root / "a" / "inv.json", "a", "2026-01-02T00:00:00+00:00",
+               pkg=[("openssl", "3.1.0")], system_pip=[("requests", "2.28.0")],
+               venvs={"web": [("Requests", "2.31.0")]})
+    _inventory(root / "b" / "inv.json", "b", "2026-01-02T00:00:00+00:00",
+               pkg=[("openssl", "3.2.1")], system_pip=[("requests", "2.31.0")])
+    _inventory(root / "c.json", "c", "2026-01-02T00:00:00+00:00", pkg=[("openssl", "3.0.9")])
+    (root / "issues.json").write_text(json.dumps({"issues": []}), encoding="utf-8")
+    return root
+
+
+def test_fleet_queries(akt, tmp_path):
+    index = akt.build_fleet_index(str(_fleet(tmp_path)), jobs=1)
+    assert len(index) == 6 and index.tables["host"] == ["a", "b", "c"]
+
+    assert [r["host"] for r in index.hosts_below("openssl", "3.2")] == ["a", "c"]
+    assert index.hosts_below("requests", "2.31", source="venv") == []
+    assert index.hosts_below("requests", "2.31") == [{"host": "a", "source": "system_pip", "version": "2.28.0"}]
+    assert index.version_spread("REQUESTS") == {
+        "package": "requests", "versions": {"2.28.0": 1, "2.31.0": 2}, "hosts": 2, "min": "2.28.0", "max": "2.31.0",
+    }
+    assert [sp["package"] for sp in index.spread_all()] == ["openssl", "requests"]
+    assert index.spread_all(source="pkg")[0]["versions"] == {"3.0.9": 1, "3.1.0": 1, "3.2.1": 1}
+
+    saved = tmp_path / "fleet.idx"
+    index.save(str(saved))
+    loaded = akt.FleetIndex.load(str(saved))
+    assert loaded.hosts_below("openssl", "3.2") == index.hosts_below("openssl", "3.2")
+
+
+def test_one_inventory_per_host(akt, tmp_path):
+    root = _fleet(tmp_path)
+    _inventory(root / "backup" / "a-old.json", "a", "2025-12-01T00:00:00+00:00", pkg=[("openssl", "1.1.1")])
+    _inventory(root / "b" / "inv-new.json", "b", "2026-02-01T10:00:00.5+00:00", pkg=[("openssl", "3.3.0")])
+
+    index = akt.build_fleet_index(str(root), jobs=2)
+    assert index.tables["host"] == ["a", "b", "c"]
+    assert index.version_spread("openssl")["versions"] == {"3.0.9": 1, "3.1.0": 1, "3.3.0": 1}
+
+
+def test_index_file_is_not_an_input(akt, tmp_path):
+    root = _fleet(tmp_path)
+    index_path = root / "fleet-index.json"
+    cmd = [sys.executable, SCRIPT, "aggregate", str(root), "--jobs", "1", "--index", str(index_path),
+           "--spread", "openssl"]
+    first = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+    assert first.returncode == 0, first.stderr
+    assert os.path.isfile(index_path)
+    assert str(index_path) in akt._inventory_files(str(root))
+    assert str(index_path) not in akt._inventory_files(str(root), (str(index_path),))
+
+    os.utime(root / "c.json")  # novější inventář -> index se přestaví, sám sebe ale nenačte
+    second = subprocess.run(cmd, capture_output=True, text=True, timeout=60)
+    assert second.returncode == 0, second.stderr
+    result = json.loads(second.stdout)
+    assert result["hosts"] == 3 and result["rows"] == 6
+    assert result["spread"][0]["hosts"] == 3
@@ -0,0 +1,51 @@
+"""AptLogClassifier: chyby apt výstupu po hostitelích mirrorů."""
+
+import gzip
+
+LOG = (
+    "Hit:1 https://good.example.org/termux stable InRelease\n"
+    "Err:2 https://unsigned.example.org/termux stable InRelease\n"
+    "  The following signatures couldn't be verified because the public key is not available: NO_PUBKEY 1234\n"
+    "E: The repository 'https://unsigned.example.org/termux stable InRelease' is not signed.\n"
+    "Err:3 https://slow.example.org/termux stable InRelease\n"
+    "  Could not connect to slow.example.org:443 (1.2.3.4), connection timed out\n"
+    "E: Failed to fetch https://gone.example.org/termux/dists/stable/main/binary-aarch64/Packages  404  Not Found\n"
+)
+
+
+def test_classify_gz_log(akt, tmp_path):
+    log = tmp_path / "apt.log.gz"
+    with gzip.open(log, "wt", encoding="utf-8") as f:
+        f.write(LOG)
+    report = akt.classify_apt_log(str(log)).report()
+    assert report["lines"] == 7
+    assert report["ok_hosts"] == ["good.example.org"]
+    assert report["hosts"] == {
+        "gone.example.org": {"not_found": 1},
+        "slow.example.org": {"timeout": 1},
+        "unsigned.example.org": {"unsigned": 2},
+    }
+    assert report["totals"] == {"unsigned": 2, "timeout": 1, "not_found": 1}
+    assert report["bad_hosts"] == ["gone.example.org", "slow.example.org", "unsigned.example.org"]
+    assert akt.extract_bad_mirror_hosts(LOG) == ["unsigned.example.org"]
+
+
+def test_stream_chunks_and_merge(akt):
+    whole = akt.AptLogClassifier()
+    whole.feed_text(LOG)
+    whole.close()
+
+    chunked = akt.AptLogClassifier()
+    for i in range(0, len(LOG), 17):
+        chunked.feed_text(LOG[i : i + 17])
+    chunked.close()
+    assert chunked.report() == whole.report()
+
+    # bez jediného funkčního mirroru je timeout spíš rozbitá síť než špatný mirror
+    offline = akt.AptLogClassifier()
+    offline.feed_text("Err:1 https://a.example.org/termux stable InRelease\n  Connection timed out\n")
+    offline.close()
+    assert offline.bad_hosts() == []
+    offline.merge(whole)
+    assert offline.bad_hosts() == ["a.example.org", "gone.example.org", "slow.example.org", "unsigned.example.org"]
+    assert offline.bad_hosts(min_count=2) == ["unsigned.example.org"]
@@ -0,0 +1,53 @@
+"""Subpříkaz bench: doběhne ve falešném prostředí a zapíše výsledky, se kterými umí bench_compare."""
+
+import json
+import os
+import subprocess
+import sys
+
+from conftest import SCRIPT
+
+
+def test_bench_smoke(akt, tmp_path):
+    out = tmp_path / "bench.json"
+    proc = subprocess.run(
+        [sys.executable, SCRIPT, "bench", "--venvs", "1", "--packages", "5", "--latency", "0",
+         "--repeat", "1", "--apt-lines", "200", "--out", str(out)],
+        capture_output=True, text=True, timeout=300,
+    )
+    assert proc.returncode == 0, proc.stderr
+
+    report = json.loads(out.read_text(encoding="utf-8"))
+    assert report["version"] == akt.BENCH_RESULTS_VERSION
+    assert report["params"] == {"packages": 5, "latency": 0.0, "apt_lines": 200, "repeat": 1}
+    [result] = report["results"]
+    assert result["venvs"] == 1
+    assert {"build_inventory_and_issues.cold", "build_inventory_and_issues.warm", "pip_list",
+            "extract_bad_mirror_hosts", "safe_write_json"} <= set(result["timings"])
+    for stats in result["timings"].values():
+        assert stats["runs"] == 1
+        assert 0 <= stats["min"] <= stats["median"] <= stats["max"]
+
+    rows = akt.bench_compare(report, report)
+    assert len(rows) == len(result["timings"])
+    assert all(r["ratio"] == 1.0 and r["venvs"] == 1 for r in rows)
+
+
+def test_bench_compare_skips_unmatched(akt):
+    old = {"results": [{"venvs": 1, "timings": {"a": {"median": 2.0}, "gone": {"median": 1.0}}}]}
+    new = {"results": [{"venvs": 1, "timings": {"a": {"median": 3.0}, "new": {"median": 1.0}}},
+                       {"venvs": 10, "timings": {"a": {"median": 1.0}}}]}
+    assert akt.bench_compare(old, new) == [{"venvs": 1, "measure": "a", "old": 2.0, "new": 3.0, "ratio": 1.5}]
+
+
+def test_fake_tree_is_readable(akt, fake_tree):
+    root, env = fake_tree
+    status = os.path.join(env["PREFIX"], "var", "lib", "dpkg", "status")
+    pkgs = akt.read_dpkg_status(status)
+    assert [p["name"] for p in pkgs] == [f"bench-pkg-{i:04d}" for i in range(5)]
+    assert pkgs[2] == {"name": "bench-pkg-0002", "version": "1.2.0", "architecture": "aarch64", "installed_size": 102}
+
+    venvs = akt.discover_venvs([os.path.join(env["HOME"], "venv")], cache_path=None)
+    assert [name for name, _ in venvs] == ["v0000", "v0001"]
+    for _name, pip in venvs:
+        assert len(akt.read_site_packages(akt.find_site_packages(pip))) == 5
@@ -0,0 +1,79 @@
+"""Kompaktní uložení balíčků (PackageTable) a komprimované výstupy (--compress)."""
+
+import pytest
+
+
+def test_package_table_round_trip(akt):
+    table = akt.PackageTable()
+    records = [
+        {"name": "bash", "version": "5.2", "installed_size": 1},
+        {"name": "zsh", "version": "5.9", "installed_size": None},
+        {"name": "true", "version": "1", "flag": True},
+        {"name": "one", "version": 1},
+    ]
+    fields, rows = table.pack(records)
+    assert fields == ("name", "version", "installed_size", "flag")
+    assert len(rows) == len(records) * len(fields)
+    unpacked = table.unpack(fields, rows)
+    assert unpacked == [
+        {"name": "bash", "version": "5.2", "installed_size": 1},
+        {"name": "zsh", "version": "5.9", "installed_size": None},
+        {"name": "true", "version": "1", "flag": True},
+        {"name": "one", "version": 1},
+    ]
+    assert "flag" not in unpacked[0]  # chybějící pole (index 0) se nevrací
+    assert type(unpacked[2]["flag"]) is bool and type(unpacked[0]["installed_size"]) is int
+    assert table.unpack(*table.pack([])) == []
+
+    again = akt.PackageTable(table.values)
+    assert again.unpack(fields, rows) == unpacked
+    assert again.index("bash") == table.index("bash")
+
+
+def test_compact_inventory_expand(akt):
+    inventory = {
+        "timestamp": "2026-01-01T00:00:00+00:00",
+        "mode": "C",
+        "pkg": [{"name": "python", "version": "3.11.7"}],
+        "system_pip": [{"name": "pip", "version": "24.0"}],
+        "venvs": {
+            "a": {"pip": "/v/a/bin/pip", "packages": [{"name": "rich", "version": "13.7"}]},
+            "b": {"pip": "/v/b/bin/pip", "packages": []},
+        },
+    }
+    compact = akt.CompactInventory(inventory)
+    assert compact.counts() == {"pkg": 1, "system_pip": 1, "venvs": 2}
+    assert compact.expand() == inventory
+
+
+@pytest.mark.parametrize("compress", [None, "gz", "xz"])
+def test_compressed_outputs_round_trip(akt, tmp_path, compress):
+    data = {"inventory": {"pkg": [{"name": "žluťoučký", "version": "1.0"}]}}
+    base = str(tmp_path / "Aktualizator_seznam.json")
+    written = akt.safe_write_json(base, data, compress=compress)
+    assert written == akt.compressed_path(base, compress)
+    assert akt.detect_compression(written) == compress
+    assert akt.load_json(written) == data
+
+    writer = akt.JsonlWriter(akt.jsonl_path(base), compress=compress)
+    writer.write("package", {"source": "pkg", "name": "bash", "version": "5.2"})
+    writer.write("package", {"source": "venv", "venv": "a", "name": "rich", "version": "13.7"})
+    writer.close()
+    assert [r["name"] for r in akt.iter_jsonl_records(writer.path, kind="package", source="venv")] == ["rich"]
+
+
+def test_compress_replaces_other_variants(akt, tmp_path):
+    base = str(tmp_path / "out.json")
+    plain = akt.safe_write_json(base, {"a": 1})
+    gz = akt.safe_write_json(base, {"a": 2}, compress="gz")
+    akt.remove_other_variants(base, gz)
+    assert not (tmp_path / "out.json").exists() and plain == base
+    assert akt.load_json(gz) == {"a": 2}
+
+    xz = akt.safe_write_json(str(tmp_path / "x.json"), {"a": 1}, compress="xz")
+    with open(xz, "rb") as f:
+        head = f.read(20)
+    with open(xz, "wb") as f:
+        f.write(head)
+    with pytest.raises(ValueError):
+        akt.load_json(xz)
@@ -0,0 +1,38 @@
+"""Inventář pkg přímo z dpkg status souboru."""
+
+STATUS = """\
+Package: zsh
+Status: install ok installed
+Architecture: aarch64
+Installed-Size: 9876
+Version: 5.9-3
+Description: Z shell
+ Dlouhý popis přes více řádků.
+ Package: not-a-package
+
+Package: old-lib
+Status: deinstall ok config-files
+Version: 1.0
+
+Package: bash
+Status: hold ok installed
+Version: 5.2.21-1
+Installed-Size: unknown
+Architecture: aarch64
+"""
+
+
+def test_read_dpkg_status(akt, tmp_path):
+    status = tmp_path / "status"
+    status.write_text(STATUS, encoding="utf-8")
+    assert akt.read_dpkg_status(str(status)) == [
+        {"name": "bash", "version": "5.2.21-1", "architecture": "aarch64", "installed_size": None},
+        {"name": "zsh", "version": "5.9-3", "architecture": "aarch64", "installed_size": 9876},
+    ]
+
+
+def test_read_dpkg_status_missing_or_empty(akt, tmp_path):
+    assert akt.read_dpkg_status(str(tmp_path / "missing")) is None
+    empty = tmp_path / "status"
+    empty.write_text("", encoding="utf-8")
+    assert akt.read_dpkg_status(str(empty)) == []
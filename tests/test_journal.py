@@ -0,0 +1,69 @@
+"""StepJournal: --resume přeskočí kroky dokončené v přerušeném běhu stejného režimu."""
+
+import json
+
+
+def _interrupted(akt, path, mode="D"):
+    journal = akt.StepJournal(str(path), mode)
+    journal.mark("pkg.update")
+    journal.mark("pip_upgrade:system")
+    journal.close()  # proces zabit, žurnál zůstal na disku
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"type": "step", "st')  # useknutý poslední zápis
+
+
+def test_resume_skips_completed_steps(akt, tmp_path):
+    path = tmp_path / "journal"
+    _interrupted(akt, path)
+
+    journal = akt.StepJournal(str(path), "D", resume=True)
+    assert journal.done("pkg.update") and journal.done("pip_upgrade:system")
+    assert not journal.done("pkg.upgrade")
+    journal.mark("pkg.upgrade")
+    journal.finish()
+    assert not path.exists()
+
+
+def test_without_resume_starts_over(akt, tmp_path):
+    path = tmp_path / "journal"
+    _interrupted(akt, path)
+
+    journal = akt.StepJournal(str(path), "D")
+    assert not journal.done("pkg.update")
+    journal.close()
+    [header] = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert header["type"] == "run" and header["mode"] == "D"
+
+
+def test_resume_ignores_other_mode_and_stale_journal(akt, tmp_path, monkeypatch):
+    path = tmp_path / "journal"
+    _interrupted(akt, path, mode="D")
+    journal = akt.StepJournal(str(path), "A", resume=True)
+    assert journal.completed == {}
+    journal.close()
+    assert json.loads(path.read_text(encoding="utf-8").splitlines()[0])["mode"] == "A"
+
+    _interrupted(akt, path, mode="D")
+    monkeypatch.setattr(akt, "JOURNAL_MAX_AGE", -1)
+    journal = akt.StepJournal(str(path), "D", resume=True)
+    assert journal.completed == {}
+    journal.close()
+
+
+def test_resume_requires_the_same_plan(akt, tmp_path):
+    path = tmp_path / "journal"
+    journal = akt.StepJournal(str(path), "D", plan="2026-01-01T00:00:00+00:00")
+    journal.mark("pkg.upgrade")
+    journal.close()
+
+    for plan in (None, "2026-02-01T00:00:00+00:00"):
+        resumed = akt.StepJournal(str(path), "D", resume=True, plan=plan)
+        assert resumed.completed == {}
+        resumed.close()
+        journal = akt.StepJournal(str(path), "D", plan="2026-01-01T00:00:00+00:00")
+        journal.mark("pkg.upgrade")
+        journal.close()
+
+    resumed = akt.StepJournal(str(path), "D", resume=True, plan="2026-01-01T00:00:00+00:00")
+    assert resumed.done("pkg.upgrade")
+    resumed.close()
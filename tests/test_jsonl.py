@@ -0,0 +1,56 @@
+"""JSON-lines výstup: JsonlWriter zapisuje index sekcí, iter_jsonl_records podle něj čte."""
+
+import json
+
+
+def _write(akt, path):
+    writer = akt.JsonlWriter(str(path))
+    writer.write("header", {"mode": "C"})
+    writer.write("package", {"source": "pkg", "name": "bash", "version": "5.2"})
+    writer.write("package", {"source": "pkg", "name": "curl", "version": "8.5"})
+    writer.write("package", {"source": "venv", "venv": "a", "name": "requests", "version": "2.31"})
+    writer.write("venv", {"venv": "a", "packages": 1})
+    writer.write("package", {"source": "venv", "venv": "b", "name": "rich", "version": "13.7"})
+    writer.write("issue", {"category": "pip_exec", "rc": 1})
+    writer.write("package", {"source": "pkg", "name": "zsh", "version": "5.9"})
+    writer.close()
+
+
+def test_writer_index_and_partial(akt, tmp_path):
+    path = tmp_path / "inventory.jsonl"
+    writer = akt.JsonlWriter(str(path))
+    writer.write("header", {"mode": "C"})
+    assert not path.exists() and json.loads((tmp_path / "inventory.jsonl.partial").read_text())["type"] == "header"
+    writer.abort()
+
+    _write(akt, path)
+    assert not (tmp_path / "inventory.jsonl.partial").exists()
+    index = akt.read_jsonl_index(str(path))
+    assert index["records"] == 8
+    assert {k: v[2] for k, v in index["sections"].items()} == {
+        "header": 1, "package:pkg": 2, "package:venv:a": 1, "venv": 1,
+        "package:venv:b": 1, "issue": 1, "package:pkg#2": 1,
+    }
+    lines = path.read_bytes()
+    offset, size, _count = index["sections"]["package:venv:a"]
+    assert json.loads(lines[offset : offset + size])["name"] == "requests"
+
+
+def test_iter_records_round_trip(akt, tmp_path):
+    path = tmp_path / "inventory.jsonl"
+    _write(akt, path)
+
+    def names(**filters):
+        return [r.get("name") for r in akt.iter_jsonl_records(str(path), **filters)]
+
+    assert len(list(akt.iter_jsonl_records(str(path)))) == 8
+    assert names(kind="package", source="pkg") == ["bash", "curl", "zsh"]
+    assert names(kind="package", source="venv") == ["requests", "rich"]
+    assert names(kind="package", source="venv", venv="b") == ["rich"]
+    assert names(kind="package", where=lambda r: r["version"].startswith("5")) == ["bash", "zsh"]
+    assert [r["category"] for r in akt.iter_jsonl_records(str(path), kind="issue")] == ["pip_exec"]
+
+    # bez indexu (useknutý soubor) se čte řádek po řádku se stejným výsledkem
+    path.write_bytes(b"".join(path.read_bytes().splitlines(keepends=True)[:-1]))
+    assert akt.read_jsonl_index(str(path)) is None
+    assert names(kind="package", source="pkg") == ["bash", "curl", "zsh"]
@@ -0,0 +1,49 @@
+"""LockManager: sdílené / exkluzivní zámky po prostředcích (flock se chová stejně i mezi dvěma správci v jednom procesu)."""
+
+import asyncio
+import os
+
+import pytest
+
+
+def test_shared_and_exclusive(akt, tmp_path):
+    lock_dir = str(tmp_path / "locks")
+    writer, reader1, reader2 = (akt.LockManager(lock_dir, timeout=0) for _ in range(3))
+
+    writer.acquire("pkg")
+    [holder] = writer.holders("pkg")
+    assert holder["pid"] == os.getpid() and holder["mode"] == "exclusive"
+    with pytest.raises(akt.LockTimeout, match="pkg is held by pid"):
+        reader1.acquire("pkg", shared=True)
+    reader1.acquire("venv:/home/v", shared=True)  # jiný prostředek není blokovaný
+    writer.release("pkg")
+
+    reader1.acquire("pkg", shared=True)
+    reader2.acquire("pkg", shared=True)
+    with pytest.raises(akt.LockTimeout):
+        writer.acquire("pkg")
+    with pytest.raises(RuntimeError):
+        reader1.acquire("pkg", shared=True)
+    reader1.release_all()
+    reader2.release_all()
+
+    with writer.hold("pkg"):
+        assert "pkg" in writer._held
+    assert writer._held == {} and writer.holders("pkg") == []
+
+
+def test_wait_for_release(akt, tmp_path):
+    lock_dir = str(tmp_path / "locks")
+    first, second = akt.LockManager(lock_dir), akt.LockManager(lock_dir, timeout=5)
+
+    async def _run():
+        first.acquire("venv:/home/v")
+        loop = asyncio.get_running_loop()
+        loop.call_later(0.2, first.release, "venv:/home/v")
+        async with akt.maybe_locked_async(second, "venv:/home/v"):
+            return "venv:/home/v" in second._held
+
+    assert asyncio.run(_run())
+    assert second._held == {}
+    with akt.maybe_locked(None, "pkg"):
+        pass
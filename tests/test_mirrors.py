@@ -0,0 +1,97 @@
+"""Měření a přepínání mirrorů proti lokálnímu HTTP serveru místo skutečných mirrorů."""
+
+import http.server
+import threading
+import time
+
+import pytest
+
+SUITE = "test-suite"  # není v TERMUX_MIRRORS, takže se nezkouší žádný skutečný mirror
+COMPONENTS = "main"
+
+
+class _MirrorHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        mirror = self.path.split("/")[1]
+        if mirror == "broken" or not self.path.endswith(f"/dists/{SUITE}/InRelease"):
+            self.send_error(404)
+            return
+        if mirror == "slow":
+            time.sleep(0.3)
+        body = f"Origin: test\nSuite: {SUITE}\nComponents: {COMPONENTS}\n".encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture(scope="module")
+def server():
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", 0), _MirrorHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def sources(tmp_path, server):
+    path = tmp_path / "sources.list"
+    path.write_text(f"# test\ndeb {server}/slow {SUITE} {COMPONENTS}\n", encoding="utf-8")
+    return path
+
+
+def test_probe_mirror(akt, server):
+    ok = akt.probe_mirror(f"{server}/fast", SUITE, timeout=5)
+    assert ok["healthy"] and ok["bytes"] > 0 and ok["error"] is None
+    assert ok["latency"] <= ok["total"]
+
+    broken = akt.probe_mirror(f"{server}/broken", SUITE, timeout=5)
+    assert not broken["healthy"] and "404" in broken["error"]
+
+
+def test_rank_mirrors_orders_healthy_by_speed(akt, server, sources):
+    entries = akt.parse_apt_sources([str(sources)])
+    extra = [(f"{server}/broken", SUITE, COMPONENTS), (f"{server}/fast", SUITE, COMPONENTS)]
+    rankings = akt.rank_mirrors(entries, extra, jobs=3, timeout=5, cache_path=None)
+    ranked = rankings[f"{SUITE}|{COMPONENTS}"]
+    assert [r["url"] for r in ranked] == [f"{server}/fast", f"{server}/slow", f"{server}/broken"]
+    assert [r["healthy"] for r in ranked] == [True, True, False]
+
+
+def test_select_and_rollback_round_trip(akt, server, sources, tmp_path):
+    original = sources.read_text(encoding="utf-8")
+    rollback = str(tmp_path / "rollback.json")
+    entries = akt.parse_apt_sources([str(sources)])
+    extra = [(f"{server}/fast", SUITE, COMPONENTS)]
+    rankings = akt.rank_mirrors(entries, extra, timeout=5, cache_path=None)
+
+    changes = akt.select_fastest_mirrors(rankings, entries, rollback_path=rollback)
+    assert changes == [{"file": str(sources), "old": f"{server}/slow", "new": f"{server}/fast"}]
+    assert f"deb {server}/fast {SUITE}" in sources.read_text(encoding="utf-8")
+
+    # druhé přepnutí nesmí přepsat zálohu původního stavu
+    entries = akt.parse_apt_sources([str(sources)])
+    second = {f"{SUITE}|{COMPONENTS}": [
+        {"url": f"{server}/other", "healthy": True, "total": 0.001},
+        {"url": f"{server}/fast", "healthy": True, "total": 1.0},
+    ]}
+    assert akt.select_fastest_mirrors(second, entries, rollback_path=rollback)
+    assert f"deb {server}/other {SUITE}" in sources.read_text(encoding="utf-8")
+
+    assert akt.rollback_mirror_selection(rollback) == [str(sources)]
+    assert sources.read_text(encoding="utf-8") == original
+    assert akt.rollback_mirror_selection(rollback) == []
+
+
+def test_select_keeps_current_mirror_within_margin(akt, sources, tmp_path, server):
+    entries = akt.parse_apt_sources([str(sources)])
+    rankings = {f"{SUITE}|{COMPONENTS}": [
+        {"url": f"{server}/fast", "healthy": True, "total": 0.95},
+        {"url": f"{server}/slow", "healthy": True, "total": 1.0},
+    ]}
+    assert akt.select_fastest_mirrors(rankings, entries, rollback_path=str(tmp_path / "rb.json")) == []
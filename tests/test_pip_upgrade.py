@@ -0,0 +1,49 @@
+"""Upgrade zastaralých pip balíčků: dávky podle závislostí a opakování po jednom balíčku."""
+
+import asyncio
+import os
+import stat
+
+
+def _dist_info(site, name, version, requires=()):
+    info = site / f"{name}-{version}.dist-info"
+    info.mkdir(parents=True)
+    lines = [f"Name: {name}", f"Version: {version}"] + [f"Requires-Dist: {r}" for r in requires]
+    (info / "METADATA").write_text("\n".join(lines) + "\n\nPopis\n", encoding="utf-8")
+
+
+def test_dependency_chunks_keep_requirements_together(akt, tmp_path):
+    site = tmp_path / "site-packages"
+    _dist_info(site, "app", "1.0", ["lib_core (>=2)", "docs-extra; extra == 'docs'"])
+    _dist_info(site, "lib_core", "2.0")
+    _dist_info(site, "docs_extra", "1.0")
+    _dist_info(site, "other", "1.0")
+    names = ["app", "other", "docs-extra", "Lib.Core"]
+
+    assert akt.dependency_chunks([str(site)], names, 2) == [["app", "Lib.Core"], ["other", "docs-extra"]]
+    assert akt.dependency_chunks([str(site)], names, 1) == [["app", "Lib.Core"], ["other"], ["docs-extra"]]
+    assert akt.dependency_chunks([], names, 3) == [["app", "other", "docs-extra"], ["Lib.Core"]]
+
+
+def test_failed_chunk_is_retried_per_package(akt, tmp_path):
+    calls = tmp_path / "calls"
+    pip = tmp_path / "bin" / "pip"
+    pip.parent.mkdir()
+    pip.write_text(
+        "#!/bin/sh\n"
+        f'echo "$*" >> "{calls}"\n'
+        'case " $* " in *" broken "*) echo "no matching distribution" >&2; exit 1;; esac\n',
+        encoding="utf-8",
+    )
+    os.chmod(pip, os.stat(pip).st_mode | stat.S_IEXEC)
+
+    issues = asyncio.run(akt.pip_install_chunked(str(pip), ["a", "broken", "c"], chunk_size=2))
+
+    assert [(i["category"], i["package"], i["rc"]) for i in issues] == [("pip_upgrade", "broken", 1)]
+    assert "no matching distribution" in issues[0]["stderr"]
+    assert calls.read_text(encoding="utf-8").splitlines() == [
+        "install --upgrade a broken",
+        "install --upgrade a",
+        "install --upgrade broken",
+        "install --upgrade c",
+    ]
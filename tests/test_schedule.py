@@ -0,0 +1,57 @@
+"""Subpříkaz schedule: fronta kroků podle fází a podmínky, které je odkládají."""
+
+import os
+import stat
+
+import pytest
+
+
+def _fake_pip(path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text('#!/bin/sh\ncase "$*" in *--outdated*) echo "[]";; esac\n', encoding="utf-8")
+    os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_jobs_per_phase(akt, tmp_path, monkeypatch):
+    monkeypatch.setattr(akt, "find_system_pip", lambda: "/usr/bin/pip")
+    venv_dir = str(tmp_path / "venv")
+
+    def ids(phases):
+        return [j["id"] for j in akt.schedule_jobs(phases, venv_dir, use_cache=False)]
+
+    assert ids(("pkg",)) == ["pkg.update", "pkg.upgrade"]
+    assert ids(("system-pip",)) == ["pip_upgrade:system"]
+    assert ids(akt.SCHEDULE_PHASES) == ["pkg.update", "pkg.upgrade", "pip_upgrade:system"]
+    assert akt.parse_schedule_args(["add"]).phases == akt.SCHEDULE_PHASES
+    assert akt.parse_schedule_args(["add", "--phases", "venvs, pkg"]).phases == ("venvs", "pkg")
+    with pytest.raises(SystemExit):
+        akt.parse_schedule_args(["add", "--phases", "pkg,B"])
+
+
+def test_blockers(akt):
+    policy = akt.SCHEDULE_POLICY
+    assert akt.schedule_blockers("pip_upgrade", {"charging": True, "network": "wifi", "metered": False, "load": 0.1}) == []
+    assert akt.schedule_blockers("pip_upgrade", {"charging": False, "network": "mobile", "metered": True, "load": 2.0}) == [
+        "not charging", "metered network (mobile)", "load 2.00 > 0.75 per CPU",
+    ]
+    assert akt.schedule_blockers("pkg.update", {"charging": False, "battery": 10, "network": "none"}, policy) == [
+        "battery 10% < 15%", "offline",
+    ]
+    assert akt.schedule_blockers("pkg.update", {"charging": None, "battery": None, "network": None}) == []
+
+
+def test_run_defers_until_conditions_allow(akt, tmp_path):
+    queue = str(tmp_path / "schedule.json")
+    pip = _fake_pip(tmp_path / "v" / "bin" / "pip")
+    job = {"id": "pip_upgrade:v", "kind": "pip_upgrade", "added": "now", "attempts": 0, "pip": pip, "venv": "v"}
+    assert akt.enqueue_schedule([job], queue) == 1
+    assert akt.enqueue_schedule([job], queue) == 0
+
+    unplugged = {"power": lambda: {"charging": False, "network": "wifi"}}
+    assert akt.run_schedule(queue, probes=unplugged, wheelhouse=None)[:2] == (0, 1)
+    assert akt.load_schedule(queue)[0]["deferred"] == "not charging"
+
+    plugged = {"power": lambda: {"charging": True, "network": "wifi"}}
+    assert akt.run_schedule(queue, probes=plugged, wheelhouse=None) == (1, 0, [])
+    assert akt.load_schedule(queue) == []
@@ -0,0 +1,65 @@
+"""Rekurzivní hledání venv s cache adresářů."""
+
+import os
+import stat
+
+
+def _env(path, cfg=True, lib=False):
+    os.makedirs(os.path.join(path, "bin"))
+    pip = os.path.join(path, "bin", "pip3")
+    with open(pip, "w", encoding="utf-8") as f:
+        f.write("#!/bin/sh\n")
+    os.chmod(pip, os.stat(pip).st_mode | stat.S_IEXEC)
+    if cfg:
+        with open(os.path.join(path, "pyvenv.cfg"), "w", encoding="utf-8") as f:
+            f.write("version = 3.11.7\n")
+    if lib:
+        os.makedirs(os.path.join(path, "lib"))
+    return pip
+
+
+def test_discover_layouts(akt, tmp_path):
+    root = tmp_path / "venv"
+    _env(str(root / "a"))
+    _env(str(root / "proj" / ".venv"))
+    _env(str(root / "legacy"), cfg=False)  # jen bin/pip3 přímo pod kořenem
+    _env(str(root / "deep" / "old"), cfg=False, lib=True)  # hlouběji starý layout s lib/
+    _env(str(root / "deep" / "tool"), cfg=False)  # hlouběji samotné bin/ nestačí
+    _env(str(root / "node_modules" / "x"))
+    _env(str(tmp_path / "elsewhere"))
+    os.symlink(tmp_path / "elsewhere", root / "linked")
+    os.symlink(root, root / "a" / "loop")
+    os.symlink(root, root / "proj" / "loop")
+
+    found = akt.discover_venvs([str(root)], cache_path=None)
+    assert [name for name, _ in found] == ["a", "deep/old", "legacy", "linked", "proj/.venv"]
+    assert dict(found)["linked"] == str(root / "linked" / "bin" / "pip3")
+    assert akt.discover_venvs([str(root)], max_depth=1, cache_path=None) == [
+        f for f in found if "/" not in f[0]
+    ]
+    assert akt.discover_venvs([str(root)], max_depth=0, cache_path=None) == []
+
+
+def test_names_across_roots(akt, tmp_path):
+    _env(str(tmp_path / "r1" / "app"))
+    _env(str(tmp_path / "r2" / "app"))
+    _env(str(tmp_path / "r2" / "tool"))
+    found = akt.discover_venvs([str(tmp_path / "r1"), str(tmp_path / "r2")], cache_path=None)
+    assert [name for name, _ in found] == sorted([str(tmp_path / "r1" / "app"), str(tmp_path / "r2" / "app"), "tool"])
+
+
+def test_cache_notices_changes(akt, tmp_path):
+    root = tmp_path / "venv"
+    _env(str(root / "a"))
+    cache = str(tmp_path / "venvs.json")
+    assert [n for n, _ in akt.discover_venvs([str(root)], cache_path=cache)] == ["a"]
+    assert os.path.isfile(cache)
+
+    _env(str(root / "b"))
+    _env(str(root / "proj" / "env"))
+    assert [n for n, _ in akt.discover_venvs([str(root)], cache_path=cache)] == ["a", "b", "proj/env"]
+
+    os.remove(root / "b" / "pyvenv.cfg")
+    os.rename(root / "b" / "bin", root / "b" / "scripts")
+    assert [n for n, _ in akt.discover_venvs([str(root)], cache_path=cache)] == ["a", "proj/env"]
+    assert [n for n, _ in akt.discover_venvs([str(root)], prune=("proj",), cache_path=cache)] == ["a"]